@@ -0,0 +1,65 @@
+"""Measure the per-request overhead of token_required with and without the
+verified-token cache.
+
+All calls share one request context, so each drops the token the previous
+call memoized in the request environ, as a new request would start without.
+
+Usage:
+    python benchmarks/bench_auth.py [ITERATIONS]
+"""
+
+import os
+import sys
+import time
+
+from flask import request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pastebin  # noqa: E402
+from pastebin import app, generate_jwt_token, token_required  # noqa: E402
+
+DEFAULT_ITERATIONS = 20_000
+
+
+@token_required
+def protected(current_user):
+    return current_user
+
+
+def new_request():
+    request.environ.pop("pastebin.verified_token", None)
+    return protected()
+
+
+def bench(iterations, cache_size):
+    pastebin.token_cache.clear()
+    pastebin.token_cache.maxsize = cache_size
+    headers = {"Authorization": f"Bearer {generate_jwt_token('bench')}"}
+
+    with app.test_request_context(headers=headers):
+        new_request()  # warm up
+        start = time.perf_counter()
+        for _ in range(iterations):
+            new_request()
+        elapsed = time.perf_counter() - start
+    return elapsed / iterations * 1_000_000
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ITERATIONS
+    maxsize = pastebin.token_cache.maxsize
+    try:
+        uncached = bench(iterations, 0)
+        cached = bench(iterations, maxsize or 10_000)
+    finally:
+        pastebin.token_cache.maxsize = maxsize
+
+    print(f"{'token cache':>12}  {'us / request':>12}")
+    print(f"{'off':>12}  {uncached:>12.2f}")
+    print(f"{'on':>12}  {cached:>12.2f}")
+    print(f"speedup: {uncached / cached:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
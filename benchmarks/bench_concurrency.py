@@ -0,0 +1,85 @@
+"""Compare note write throughput with striped locks and with one global lock.
+
+Threads create and then rewrite (with ``compare_and_set``) their own notes in
+an in-memory store. With ``lock_stripes=1`` every write is serialized, as
+under one global lock; with the default 64 stripes writes to different notes
+only share the short index update, so hashing and compressing large texts
+(which release the GIL) run in parallel on multi-core machines. The second
+table adds a listener that blocks for LISTENER_WAIT seconds per write, like
+one shipping writes over the network: listeners run under the note's stripe
+only, so the waits overlap. Each run also checks that no write was lost.
+
+Usage:
+    python benchmarks/bench_concurrency.py [TEXT_KIB]
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import MemoryNoteStore  # noqa: E402
+
+THREAD_COUNTS = [1, 2, 4, 8]
+WRITES_PER_THREAD = 400
+DEFAULT_TEXT_KIB = 64
+LISTENER_WAIT = 0.0002
+
+
+def texts(kib, count):
+    rng = random.Random(0)
+    words = [f"word{i}" for i in range(2000)]
+    base = " ".join(rng.choice(words) for _ in range(kib * 1024 // 8))
+    return [f"{i} {base}"[: kib * 1024] for i in range(count)]
+
+
+def run(stripes, threads, samples, listener_wait=0):
+    store = MemoryNoteStore(lock_stripes=stripes, compress_threshold=32 * 1024)
+    if listener_wait:
+        store.subscribe(lambda note_id, note: time.sleep(listener_wait))
+    barrier = threading.Barrier(threads + 1)
+
+    def work(t):
+        barrier.wait()
+        for i in range(WRITES_PER_THREAD // 2):
+            note_id = f"t{t}-{i}"
+            text = samples[(t * 7 + i) % len(samples)]
+            assert store.insert_if_absent(note_id, text, f"user{t}", False)
+            version = store[note_id].version
+            assert store.compare_and_set(note_id, version, text[::-1], True)
+
+    workers = [threading.Thread(target=work, args=(t,)) for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    assert len(store) == threads * WRITES_PER_THREAD // 2  # No lost writes
+    return threads * WRITES_PER_THREAD / elapsed
+
+
+def main():
+    kib = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_TEXT_KIB
+    samples = texts(kib, 64)
+    for title, listener_wait in (
+        (f"{kib} KiB texts, writes/s", 0),
+        (f"with a {LISTENER_WAIT * 1e6:.0f} us listener", LISTENER_WAIT),
+    ):
+        print(title)
+        print(f"{'threads':>7}  {'1 stripe':>9}  {'64 stripes':>10}  {'speedup':>7}")
+        for threads in THREAD_COUNTS:
+            single = run(1, threads, samples, listener_wait)
+            striped = run(64, threads, samples, listener_wait)
+            print(
+                f"{threads:>7}  {single:>9.0f}  {striped:>10.0f}"
+                f"  {striped / single:>6.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
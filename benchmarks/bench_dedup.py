@@ -0,0 +1,102 @@
+"""Report what content-addressed dedup saves on repetitive pastes.
+
+Fills an in-memory store with notes of which most repeat one of a few
+hundred common pastes (stack traces, configs, log excerpts) and the rest are
+unique, with dedup off and on, and prints the store's accounting alongside
+what tracemalloc saw allocated. Then times sanitizing a repeated paste that
+has fallen out of the sanitizer cache, with and without a stored note made
+from it.
+
+Usage:
+    python benchmarks/bench_dedup.py [NOTES]
+"""
+
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import MemoryNoteStore  # noqa: E402
+
+DEFAULT_NOTES = 20_000
+COMMON_PASTES = 200
+REPEATED_SHARE = 0.7
+SANITIZE_RUNS = 200
+
+
+def common_paste(i, rng):
+    frames = "".join(
+        f'  File "/srv/app/module_{rng.randint(1, 50)}.py", line {rng.randint(1, 900)},'
+        f" in handler_{rng.randint(1, 99)}\n    result = call(arg)\n"
+        for _ in range(rng.randint(10, 80))
+    )
+    return f"Traceback (most recent call last):\n{frames}KeyError: 'key-{i}'\n"
+
+
+def fill(store, count, rng):
+    pastes = [common_paste(i, rng) for i in range(COMMON_PASTES)]
+    for i in range(count):
+        if rng.random() < REPEATED_SHARE:
+            # Popular pastes repeat far more often than the rest
+            paste = pastes[min(int(rng.paretovariate(1.2)) - 1, COMMON_PASTES - 1)]
+            text = paste.encode().decode()  # A fresh copy, as from a request
+        else:
+            text = f"note {i}: " + " ".join(str(rng.random()) for _ in range(10))
+        store.create(f"note-{i}", text, f"user-{i % 500}", i % 10 == 0)
+
+
+def measure(count, dedup_threshold):
+    rng = random.Random(0)
+    tracemalloc.start()
+    store = MemoryNoteStore(dedup_threshold=dedup_threshold)
+    fill(store, count, rng)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return store.memory_stats(), allocated
+
+
+def time_sanitize(pastebin, text, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        pastebin.sanitize_cache.clear()  # As if evicted by other traffic
+        pastebin.sanitize_note_text(text)
+    return (time.perf_counter() - start) / runs * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NOTES
+    print(
+        f"{'dedup':>5}  {'blobs':>6}  {'ratio':>6}  {'raw MB':>7}  {'unique MB':>9}"
+        f"  {'allocated MB':>12}"
+    )
+    for label, threshold in (("off", None), ("on", 512)):
+        stats, allocated = measure(count, threshold)
+        print(
+            f"{label:>5}  {stats['blobs']:>6}  {stats['dedup_ratio']:>6.2f}"
+            f"  {stats['raw_bytes'] / 2**20:>7.1f}  {stats['unique_bytes'] / 2**20:>9.1f}"
+            f"  {allocated / 2**20:>12.1f}"
+        )
+
+    logging.disable(logging.INFO)
+    import pastebin
+
+    pastebin.create_app()
+    pastebin.notes.clear()
+    text = "<pre>" + common_paste(0, random.Random(1)) + "</pre>"
+    sanitizer_us = time_sanitize(pastebin, text, SANITIZE_RUNS)
+    sanitized, source = pastebin.sanitize_note_text(text)
+    pastebin.notes.create("stored", sanitized, "bench", False, source)
+    stored_us = time_sanitize(pastebin, text, SANITIZE_RUNS)
+    pastebin.notes.clear()
+    print(
+        f"\nsanitize a {len(text)}-byte repeated paste: {sanitizer_us:.0f} us,"
+        f" {stored_us:.0f} us with a stored note made from it"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Show that sweeping expired notes costs O(expired), not O(notes).
+
+Fills an in-memory store where one note in ten has an expiry, moves its
+clock so that 1,000 of them (or all of them, in smaller stores) are due,
+and times one ``ExpirySweeper.sweep``
+against a full scan of the store looking for the same notes. Also times a
+read of an expired note, which must 404 before any sweep.
+
+Usage:
+    python benchmarks/bench_expiry.py [NOTES ...]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import ExpirySweeper, MemoryNoteStore  # noqa: E402
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DUE = 1_000  # Capped at the number of notes with an expiry
+READS = 100_000
+
+
+def fill(size):
+    now = 0.0
+    store = MemoryNoteStore(clock=lambda: now)
+    for i in range(size):
+        expires_at = float(i // 10) if i % 10 == 0 else None
+        store.create(
+            f"note-{i:08d}", "text", f"user-{i % 500}", False, None, expires_at
+        )
+    return store
+
+
+def full_scan(store, now):
+    return [note_id for note_id, note in store.items() if note.expired(now)]
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    if min(sizes) < 1:
+        sys.exit("store sizes must be at least 1")
+    print(
+        f"{'notes':>9}  {'sweep ms':>9}  {'full scan ms':>12}  {'expired get ns':>14}"
+    )
+    for size in sizes:
+        store = fill(size)
+        due = min(DUE, (size + 9) // 10)
+        now = float(due - 1)  # Notes 0, 10, 20, ... expire at 0, 1, 2, ...
+        store._clock = lambda: now
+
+        start = time.perf_counter()
+        scanned = full_scan(store, now)
+        scan_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for _ in range(READS):
+            assert store.get("note-00000000") is None
+        get_ns = (time.perf_counter() - start) / READS * 1e9
+
+        sweeper = ExpirySweeper(store, interval=0)
+        start = time.perf_counter()
+        swept = sweeper.sweep()
+        sweep_ms = (time.perf_counter() - start) * 1000
+        assert swept == len(scanned) == due, (swept, len(scanned))
+        print(f"{size:>9}  {sweep_ms:>9.2f}  {scan_ms:>12.1f}  {get_ns:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
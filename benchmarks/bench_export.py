@@ -0,0 +1,77 @@
+"""Measure the time and peak memory of NDJSON export and import.
+
+Exports a user's notes through GET /api/notes/export to a temporary file,
+consuming the streamed body chunk by chunk, then imports the file back
+through POST /api/notes/import. "Transient" is the peak memory tracemalloc
+saw during the request minus what was still allocated after it (the imported
+notes themselves); apart from the export's one sorted list of note IDs, it
+should stay flat as the number of notes grows.
+
+Usage:
+    python benchmarks/bench_export.py [NOTES ...]
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pastebin  # noqa: E402
+from pastebin import app, generate_jwt_token, notes  # noqa: E402
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak - current, result
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    logging.disable(logging.INFO)
+    app.config["RATE_LIMITS"] = {}
+    headers = {"Authorization": f"Bearer {generate_jwt_token('bench')}"}
+    client = app.test_client()
+
+    def export(archive):
+        response = client.get("/api/notes/export", headers=headers, buffered=False)
+        for chunk in response.response:
+            archive.write(chunk if isinstance(chunk, bytes) else chunk.encode())
+
+    def restore(archive):
+        return client.post("/api/notes/import", data=archive, headers=headers).json
+
+    print(
+        f"{'notes':>8}  {'export s':>9}  {'transient':>11}"
+        f"  {'import s':>9}  {'transient':>11}"
+    )
+    for size in sizes:
+        notes.clear()
+        for i in range(size):
+            notes.create(f"note-{i:08d}", f"Note number {i} " * 8, "bench", i % 2)
+        with tempfile.TemporaryFile() as archive:
+            export_s, export_peak, _ = measure(lambda: export(archive))
+            notes.clear()
+            archive.seek(0)
+            import_s, import_peak, result = measure(lambda: restore(archive))
+        assert result["imported"] == size, result
+        print(
+            f"{size:>8}  {export_s:>9.2f}  {export_peak / 2**20:>9.1f}MB"
+            f"  {import_s:>9.2f}  {import_peak / 2**20:>9.1f}MB"
+        )
+    notes.clear()
+    pastebin.search_index.rebuild([])
+
+
+if __name__ == "__main__":
+    main()
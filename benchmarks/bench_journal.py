@@ -0,0 +1,83 @@
+"""Measure journaled write throughput and restart time.
+
+For each store size, writes that many notes through a journaled store,
+compacts them into a snapshot, appends a tail of journal records on top (an
+update of each of the first TAIL notes) and times a restart (snapshot load plus journal replay). Write throughput is
+measured with an fsync per write and with batched fsyncs.
+
+Usage:
+    python benchmarks/bench_journal.py [STORE_SIZE ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import open_stores  # noqa: E402
+
+DEFAULT_SIZES = [100_000, 1_000_000]
+TAIL = 10_000
+WRITES = 2_000
+
+
+def open_journaled(directory, fsync_interval):
+    return open_stores(
+        f"journal:///{directory}",
+        journal_options={"fsync_interval": fsync_interval, "snapshot_every": 0},
+    )
+
+
+def write_rate(fsync_interval):
+    with tempfile.TemporaryDirectory() as directory:
+        notes, _ = open_journaled(directory, fsync_interval)
+        start = time.perf_counter()
+        for i in range(WRITES):
+            notes.create(f"note-{i}", "note body " * 8, f"user-{i % 1000}", False)
+        elapsed = time.perf_counter() - start
+        notes.journal.close()
+    return WRITES / elapsed
+
+
+def restart_time(size):
+    with tempfile.TemporaryDirectory() as directory:
+        notes, users = open_journaled(directory, 1.0)
+        for i in range(size):
+            notes.create(
+                f"note-{i:07d}", "note body " * 8, f"user-{i % 1000}", i % 100 == 0
+            )
+        for i in range(1000):
+            users.create(f"user-{i}", "password", f"key-{i}")
+        notes.journal.snapshot()
+        for i in range(min(TAIL, size)):
+            notes.update(f"note-{i:07d}", "updated body " * 8, False)
+        notes.journal.close()
+        snapshot_mb = (
+            sum(
+                os.path.getsize(os.path.join(directory, name))
+                for name in os.listdir(directory)
+            )
+            / 2**20
+        )
+
+        notes, users = open_journaled(directory, 1.0)
+        recovery = notes.journal.recovery
+        notes.journal.close()
+        assert len(notes) == size
+    return recovery["seconds"], snapshot_mb
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    print(f"fsync per write:  {write_rate(0):>10.0f} writes/s")
+    print(f"fsync batched 1s: {write_rate(1.0):>10.0f} writes/s")
+    print(f"\n{'notes':>9}  {'files MB':>9}  {'restart s':>9}")
+    for size in sizes:
+        seconds, size_mb = restart_time(size)
+        print(f"{size:>9}  {size_mb:>9.1f}  {seconds:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
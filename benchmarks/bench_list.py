@@ -0,0 +1,89 @@
+"""Compare GET /api/notes throughput with and without cached note JSON.
+
+Fills the store with public notes, then requests a 1,000-note page from the
+middle of the listing and the whole listing, straight through WSGI. "cached"
+joins the JSON serialized when each note was written; "rebuilt" bypasses
+the cache, so every request builds a dict for each note and serializes it,
+as the route did before. Both columns also pay for the in-memory store's
+visible_ids, which collects every visible ID on each request (a page only
+partially sorts them); on large stores that dominates the time of a page.
+
+Usage:
+    python benchmarks/bench_list.py [NOTES ...]
+"""
+
+import logging
+import os
+import sys
+import time
+from unittest import mock
+from wsgiref.util import setup_testing_defaults
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pastebin  # noqa: E402
+from pastebin import encode_cursor, generate_jwt_token, json, note_as_dict  # noqa: E402
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+PAGE_SIZE = 1_000
+MIN_SECONDS = 1.0
+
+
+def request(app, token, query):
+    environ = {
+        "PATH_INFO": "/api/notes",
+        "QUERY_STRING": query,
+        "HTTP_AUTHORIZATION": f"Bearer {token}",
+    }
+    setup_testing_defaults(environ)
+    statuses = []
+    body = b"".join(app(environ, lambda status, headers: statuses.append(status)))
+    assert statuses[0].startswith("200"), statuses
+    return body
+
+
+def throughput(app, token, query):
+    """Return requests per second and the body size, over at least MIN_SECONDS."""
+    count = 0
+    start = time.perf_counter()
+    while True:
+        body = request(app, token, query)
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_SECONDS:
+            return count / elapsed, len(body)
+
+
+def rebuild(note_id, note):
+    return json.dumps(note_as_dict(note_id, note)).encode("utf-8")
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    logging.disable(logging.INFO)
+    app = pastebin.create_app({"RATE_LIMITS": {}})
+    token = generate_jwt_token("bench")
+    notes = pastebin.notes
+
+    print(
+        f"{'notes':>9}  {'listing':>13}  {'body MB':>8}"
+        f"  {'cached req/s':>12}  {'rebuilt req/s':>13}  {'speedup':>7}"
+    )
+    for size in sizes:
+        notes.clear()
+        for i in range(size):
+            notes.create(f"note-{i:08d}", f"Note number {i}: some text", "bench", True)
+        page = f"limit={PAGE_SIZE}&cursor={encode_cursor(f'note-{size // 2:08d}')}"
+        for label, query in ((f"page of {PAGE_SIZE}", page), ("all notes", "")):
+            cached, body_size = throughput(app, token, query)
+            with mock.patch.object(pastebin, "note_json", rebuild):
+                rebuilt, _ = throughput(app, token, query)
+            print(
+                f"{size:>9}  {label:>13}  {body_size / 2**20:>8.1f}"
+                f"  {cached:>12.1f}  {rebuilt:>13.1f}  {cached / rebuilt:>6.1f}x"
+            )
+    notes.clear()
+
+
+if __name__ == "__main__":
+    main()
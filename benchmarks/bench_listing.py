@@ -0,0 +1,56 @@
+"""Measure how note listing latency scales with the total store size.
+
+The caller always sees the same number of notes (its own plus the public
+ones), while the number of notes owned by other users grows. With the
+per-author and public-note indexes, listing latency should stay roughly flat.
+
+Usage:
+    python benchmarks/bench_listing.py [STORE_SIZE ...]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pastebin import app, generate_jwt_token, notes  # noqa: E402
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+VISIBLE_NOTES = 100
+REPEAT = 50
+
+
+def populate(store_size):
+    notes.clear()
+    for i in range(VISIBLE_NOTES // 2):
+        notes.create(f"own-{i}", "note body", "bench", False)
+        notes.create(f"public-{i}", "note body", "someone", True)
+    for i in range(store_size - VISIBLE_NOTES):
+        notes.create(f"other-{i}", "note body", f"user-{i % 1000}", False)
+
+
+def bench(store_size):
+    populate(store_size)
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {generate_jwt_token('bench')}"}
+
+    client.get("/api/notes", headers=headers)  # warm up
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        response = client.get("/api/notes", headers=headers)
+    elapsed = time.perf_counter() - start
+
+    assert len(response.json) == VISIBLE_NOTES
+    return elapsed / REPEAT * 1000
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    print(f"{'total notes':>12}  {'ms / list':>10}")
+    for size in sizes:
+        print(f"{size:>12}  {bench(size):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
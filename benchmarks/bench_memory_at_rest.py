@@ -0,0 +1,82 @@
+"""Report the memory held by note bodies with and without compression.
+
+Fills an in-memory store with a mix of small notes and a few large pasted
+logs, then prints the store's own accounting alongside what tracemalloc saw
+allocated, and the cost of reading a large note back.
+
+Usage:
+    python benchmarks/bench_memory_at_rest.py [LARGE_NOTE_MB ...]
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import MemoryNoteStore  # noqa: E402
+
+DEFAULT_SIZES = [1, 4]
+SMALL_NOTES = 10_000
+LARGE_NOTES = 20
+LEVELS = ["DEBUG", "INFO", "INFO", "INFO", "WARNING", "ERROR"]
+READS = 50
+
+
+def log_text(size, rng):
+    lines = []
+    total = 0
+    while total < size:
+        line = (
+            f"2024-05-{rng.randint(1, 28):02d} 12:{rng.randint(0, 59):02d}:"
+            f"{rng.randint(0, 59):02d} {rng.choice(LEVELS)} worker-{rng.randint(1, 8)}"
+            f" request {rng.getrandbits(32):08x} took {rng.randint(1, 999)} ms\n"
+        )
+        lines.append(line)
+        total += len(line)
+    return "".join(lines)[:size]
+
+
+def fill(store, large_size, rng):
+    for i in range(SMALL_NOTES):
+        store.create(f"small-{i}", f"note {i} " * 10, f"user-{i % 100}", i % 10 == 0)
+    for i in range(LARGE_NOTES):
+        store.create(f"large-{i}", log_text(large_size, rng), "user-0", False)
+
+
+def measure(threshold, large_size):
+    rng = random.Random(0)
+    tracemalloc.start()
+    store = MemoryNoteStore(compress_threshold=threshold)
+    fill(store, large_size, rng)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for i in range(READS):
+        store[f"large-{i % LARGE_NOTES}"].text
+    read_ms = (time.perf_counter() - start) / READS * 1000
+    return store.memory_stats(), allocated, read_ms
+
+
+def main():
+    sizes = [float(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    print(
+        f"{'large note':>10}  {'compression':>11}  {'raw MB':>8}  {'stored MB':>9}"
+        f"  {'allocated MB':>12}  {'read ms':>8}"
+    )
+    for size_mb in sizes:
+        large_size = int(size_mb * 1024 * 1024)
+        for label, threshold in (("off", None), ("on", 64 * 1024)):
+            stats, allocated, read_ms = measure(threshold, large_size)
+            print(
+                f"{size_mb:>8.1f}MB  {label:>11}  {stats['raw_bytes'] / 2**20:>8.1f}"
+                f"  {stats['stored_bytes'] / 2**20:>9.1f}  {allocated / 2**20:>12.1f}"
+                f"  {read_ms:>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
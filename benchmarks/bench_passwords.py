@@ -0,0 +1,96 @@
+"""Measure API login throughput at each scrypt cost.
+
+Concurrent clients log in through POST /api/login while, for contrast, other
+clients keep reading a note; the read latency shows whether logins starve
+cheap requests. Rate limits are turned off for the run.
+
+Usage:
+    python benchmarks/bench_passwords.py [LOG2_N ...]
+"""
+
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pastebin  # noqa: E402
+from pastebin import app, generate_jwt_token, notes, users  # noqa: E402
+
+DEFAULT_LOG2_N = [12, 13, 14, 15]
+LOGIN_CLIENTS = 8
+READ_CLIENTS = 2
+DURATION = 3.0
+
+
+def login_client(stop, counts):
+    client = app.test_client()
+    while not stop.is_set():
+        response = client.post(
+            "/api/login", json={"user_id": "bench", "password": "bench-password"}
+        )
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+
+def read_client(stop, latencies):
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {generate_jwt_token('bench')}"}
+    while not stop.is_set():
+        start = time.perf_counter()
+        client.get("/api/notes/bench-note", headers=headers)
+        latencies.append(time.perf_counter() - start)
+
+
+def run(log2_n):
+    pastebin.password_hasher.n = 2**log2_n
+    users.clear()
+    users.create("bench", pastebin.password_hasher.hash("bench-password"), "key")
+    counts, latencies = {}, []
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=login_client, args=(stop, counts))
+        for _ in range(LOGIN_CLIENTS)
+    ] + [
+        threading.Thread(target=read_client, args=(stop, latencies))
+        for _ in range(READ_CLIENTS)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return counts, latencies
+
+
+def main():
+    log2_ns = [int(arg) for arg in sys.argv[1:]] or DEFAULT_LOG2_N
+    logging.disable(logging.INFO)
+    app.config["RATE_LIMITS"] = {}
+    pastebin.in_flight.limit = 0
+    notes.clear()
+    notes.create("bench-note", "note body", "bench", True)
+    print(
+        f"{'scrypt N':>9}  {'logins/s':>9}  {'ms/login':>9}  {'503s':>6}"
+        f"  {'read p50 ms':>11}  {'read p99 ms':>11}"
+    )
+    for log2_n in log2_ns:
+        counts, latencies = run(log2_n)
+        ok = counts.get(200, 0)
+        latencies.sort()
+        print(
+            f"{2**log2_n:>9}  {ok / DURATION:>9.1f}"
+            f"  {DURATION * LOGIN_CLIENTS / max(ok, 1) * 1000:>9.1f}"
+            f"  {counts.get(503, 0):>6}"
+            f"  {statistics.median(latencies) * 1000:>11.2f}"
+            f"  {latencies[int(len(latencies) * 0.99)] * 1000:>11.2f}"
+        )
+    notes.clear()
+    users.clear()
+
+
+if __name__ == "__main__":
+    main()
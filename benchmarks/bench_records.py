@@ -0,0 +1,68 @@
+"""Compare the memory cost per note of dict records and slotted records.
+
+"dict" is the layout the stores used to keep: one dict per note and per
+user, with a separate author string for every note. "slotted" is the
+``Note``/``User`` records with interned author names that the stores use
+now. Texts are the same in both and are left out of the per-note figures.
+
+Usage:
+    python benchmarks/bench_records.py [NOTE_COUNT ...]
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import Note, User  # noqa: E402
+
+DEFAULT_COUNTS = [10_000, 100_000, 1_000_000]
+AUTHORS = 1_000
+TEXT = "note body " * 8
+
+
+def author_name(i):
+    # Built at runtime, like an author taken from a request
+    return "".join(["user-", str(i % AUTHORS)])
+
+
+def dict_records(count):
+    notes = [
+        {"text": TEXT, "author": author_name(i), "isPublic": i % 100 == 0, "version": i}
+        for i in range(count)
+    ]
+    users = [{"password": "secret", "api_key": "key"} for _ in range(AUTHORS)]
+    return notes, users
+
+
+def slotted_records(count):
+    notes = [
+        Note(TEXT, sys.intern(author_name(i)), i % 100 == 0, i) for i in range(count)
+    ]
+    users = [User("secret", "key") for _ in range(AUTHORS)]
+    return notes, users
+
+
+def measure(build, count):
+    tracemalloc.start()
+    records = build(count)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return allocated
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or DEFAULT_COUNTS
+    print(f"{'notes':>9}  {'dict B/note':>11}  {'slotted B/note':>14}  {'saved':>6}")
+    for count in counts:
+        before = measure(dict_records, count) / count
+        after = measure(slotted_records, count) / count
+        print(
+            f"{count:>9}  {before:>11.1f}  {after:>14.1f}  {1 - after / before:>6.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Measure full-text search latency as the corpus grows.
+
+Each note is 20 words drawn from a 5,000-word vocabulary with a Zipf-like
+distribution, so some terms are common and others rare, as in real pastes.
+
+Usage:
+    python benchmarks/bench_search.py [CORPUS_SIZE ...]
+"""
+
+import itertools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import SearchIndex  # noqa: E402
+from storage import Note  # noqa: E402
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+VOCABULARY = [f"word{i}" for i in range(5_000)]
+CUM_WEIGHTS = list(
+    itertools.accumulate(1 / (rank + 1) for rank in range(len(VOCABULARY)))
+)
+QUERIES = {
+    "common term": "word1",
+    "rare term": "word4000",
+    "two terms": "word1 word50",
+}
+REPEAT = 20
+
+
+def build(corpus_size, rng):
+    corpus = [
+        Note(
+            " ".join(rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=20)),
+            f"user-{i % 1000}",
+            i % 10 == 0,
+            i,
+        )
+        for i in range(corpus_size)
+    ]
+    index = SearchIndex()
+    start = time.perf_counter()
+    for i, note in enumerate(corpus):
+        index.update(f"note-{i}", note)
+    return index, time.perf_counter() - start
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    rng = random.Random(0)
+    print(
+        f"{'corpus':>8}  {'index us/note':>13}  "
+        + "  ".join(f"{q:>12}" for q in QUERIES)
+    )
+    for size in sizes:
+        index, build_time = build(size, rng)
+        timings = []
+        for query in QUERIES.values():
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                index.search(query, "user-0", limit=20)
+            timings.append((time.perf_counter() - start) / REPEAT * 1000)
+        print(
+            f"{size:>8}  {build_time / size * 1_000_000:>13.1f}  "
+            + "  ".join(f"{t:>9.3f} ms" for t in timings)
+        )
+
+
+if __name__ == "__main__":
+    main()
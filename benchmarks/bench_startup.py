@@ -0,0 +1,147 @@
+"""Measure how long a new process takes to serve its first request.
+
+cold start
+    A fresh interpreter imports pastebin, creates the app and serves its
+    first page (what every ``flask run`` or non-preloaded worker pays).
+fork, not preloaded
+    A worker forked from a master that has not loaded the app, so the
+    worker does all of the above itself (gunicorn without ``preload_app``).
+fork, preloaded
+    A worker forked from a master that already created the app and ran the
+    lazy imports (``warm_up``, as gunicorn.conf.py does); it only restarts
+    its threads.
+
+Fork times run from just before ``os.fork`` to the worker answering its first
+request. "Private" is the worker's private memory at that point, from
+/proc/<pid>/smaps_rollup; the rest is shared with the master.
+
+Usage:
+    python benchmarks/bench_startup.py [RUNS]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+from wsgiref.util import setup_testing_defaults
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_RUNS = 10
+
+COLD_START = """
+import time
+start = time.perf_counter()
+import pastebin
+imported = time.perf_counter()
+pastebin.app = pastebin.create_app()
+created = time.perf_counter()
+from benchmarks.bench_startup import first_request
+first_request()
+print(imported - start, created - imported, time.perf_counter() - created)
+"""
+
+
+def private_kib():
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return float("nan")
+    return sum(
+        int(line.split()[1])
+        for line in lines
+        if line.startswith(("Private_Clean:", "Private_Dirty:"))
+    )
+
+
+def first_request():
+    # Called straight through WSGI: Flask's test client is slow to import
+    import pastebin
+
+    app = pastebin.__dict__.get("app") or pastebin.create_app()
+    environ = {"PATH_INFO": "/login"}
+    setup_testing_defaults(environ)
+    body = b"".join(app(environ, lambda status, headers: None))
+    assert b"<form" in body
+    pastebin.sanitize_input("<b>ready</b>")
+
+
+def fork_to_ready():
+    """Fork a worker; return (seconds until it served a request, private KiB)."""
+    read_fd, write_fd = os.pipe()
+    start = time.monotonic()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            first_request()
+            ready = time.monotonic()
+            os.write(write_fd, f"{ready} {private_kib()}".encode())
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        ready, private = f.read().split()
+    os.waitpid(pid, 0)
+    return float(ready) - start, float(private)
+
+
+def cold_start():
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", COLD_START],
+        cwd=ROOT,
+        env={**os.environ, "LOG_LEVEL": "ERROR"},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    phases = [float(value) for value in output.split()[-3:]]
+    return time.perf_counter() - start, phases
+
+
+def report(name, seconds, private=None):
+    line = (
+        f"{name:<22}  {statistics.median(seconds) * 1000:>8.1f}"
+        f"  {min(seconds) * 1000:>8.1f}"
+    )
+    if private is not None:
+        line += f"  {statistics.median(private) / 1024:>10.1f}"
+    print(line)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RUNS
+    os.environ["LOG_LEVEL"] = "ERROR"
+
+    cold = [cold_start() for _ in range(runs)]
+    # Before this process imports pastebin, so the workers load it themselves
+    not_preloaded = [fork_to_ready() for _ in range(runs)]
+
+    import pastebin
+
+    pastebin.app = pastebin.create_app()
+    pastebin.warm_up(pastebin.app)
+    preloaded = [fork_to_ready() for _ in range(runs)]
+
+    print(f"{'':<22}  {'p50 ms':>8}  {'min ms':>8}  {'private MiB':>10}")
+    report("cold start", [total for total, _ in cold])
+    for i, phase in enumerate(["  import pastebin", "  create_app", "  first request"]):
+        report(phase, [phases[i] for _, phases in cold])
+    report(
+        "fork, not preloaded",
+        [seconds for seconds, _ in not_preloaded],
+        [private for _, private in not_preloaded],
+    )
+    report(
+        "fork, preloaded",
+        [seconds for seconds, _ in preloaded],
+        [private for _, private in preloaded],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""Microbenchmark suite for the pastebin hot paths.
+
+Runs every benchmark over the requested store and payload sizes, prints a
+table, and optionally writes the results as JSON. With --compare, the run is
+checked against a saved baseline and the exit status is 1 if any benchmark
+got slower than the allowed threshold.
+
+Usage:
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --compare baseline.json --threshold 0.15
+    python benchmarks/suite.py --only sanitize --payload-sizes 100 10000
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+
+from flask import request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pastebin  # noqa: E402
+from pastebin import (  # noqa: E402
+    app,
+    generate_jwt_token,
+    notes,
+    sanitize_cache,
+    sanitize_input,
+    token_required,
+    users,
+)
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """Register a benchmark.
+
+    The decorated function receives the parsed arguments and yields
+    ``(case, fn)`` pairs; each ``fn`` is timed as one operation.
+    """
+
+    def register(cases):
+        BENCHMARKS.append((name, cases))
+        return cases
+
+    return register
+
+
+def reset_store(store_size, author_count=1000):
+    """Fill the store with ``store_size`` notes, 1% of them public."""
+    notes.clear()
+    users.clear()
+    for i in range(store_size):
+        notes.create(
+            f"note-{i}", "note body " * 8, f"user-{i % author_count}", i % 100 == 0
+        )
+
+
+def make_payload(size, markup):
+    unit = "<p>Some <b>bold</b> text</p>\n" if markup else "Plain log line here\n"
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def auth_headers(user_id="user-0"):
+    return {"Authorization": f"Bearer {generate_jwt_token(user_id)}"}
+
+
+# ----------------------------
+# Benchmarks
+# ----------------------------
+
+
+@benchmark("sanitize_input")
+def bench_sanitize(args):
+    for size in args.payload_sizes:
+        plain = make_payload(size, markup=False)
+        markup = make_payload(size, markup=True)
+        counter = itertools.count()
+        yield f"plain-{size}", lambda: sanitize_input(plain)
+        yield f"markup-cached-{size}", lambda: sanitize_input(markup)
+        yield f"markup-uncached-{size}", lambda: sanitize_input(
+            f"{next(counter)}{markup}"
+        )
+
+
+@benchmark("generate_jwt_token")
+def bench_generate_token(args):
+    yield "default", lambda: generate_jwt_token("user-0")
+
+
+@benchmark("token_required")
+def bench_token_required(args):
+    protected = token_required(lambda current_user: current_user)
+
+    def new_request():
+        # The verified token is memoized per request: drop it, so each call
+        # verifies the token as a new request would
+        request.environ.pop("pastebin.verified_token", None)
+        return protected()
+
+    headers = auth_headers()
+    maxsize = pastebin.token_cache.maxsize
+    ctx = app.test_request_context(headers=headers)
+    ctx.push()
+    try:
+        pastebin.token_cache.clear()
+        pastebin.token_cache.maxsize = 0
+        yield "cache-off", new_request
+        pastebin.token_cache.maxsize = maxsize or 10_000
+        yield "cache-on", new_request
+    finally:
+        ctx.pop()
+        pastebin.token_cache.maxsize = maxsize
+
+
+@benchmark("api_list_notes")
+def bench_api_list_notes(args):
+    client = app.test_client()
+    headers = auth_headers()
+    for size in args.store_sizes:
+        reset_store(size)
+        yield f"store-{size}", lambda: client.get("/api/notes", headers=headers)
+        yield f"store-{size}-page-100", lambda: client.get(
+            "/api/notes?limit=100", headers=headers
+        )
+
+
+@benchmark("api_create_note")
+def bench_api_create_note(args):
+    client = app.test_client()
+    headers = auth_headers()
+    reset_store(0)
+    counter = itertools.count()
+    for size in args.payload_sizes:
+        text = make_payload(size, markup=True)
+        yield f"payload-{size}", lambda: client.post(
+            "/api/notes",
+            json={"id": f"bench-{next(counter)}", "text": text, "isPublic": True},
+            headers=headers,
+        )
+
+
+@benchmark("api_search_notes")
+def bench_api_search_notes(args):
+    client = app.test_client()
+    headers = auth_headers()
+    for size in args.store_sizes:
+        reset_store(size)
+        yield f"store-{size}-common", lambda: client.get(
+            "/api/notes/search?q=note+body", headers=headers
+        )
+        yield f"store-{size}-rare", lambda: client.get(
+            "/api/notes/search?q=missing", headers=headers
+        )
+
+
+@benchmark("list_notes")
+def bench_list_notes(args):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = "user-0"
+    for size in args.store_sizes:
+        reset_store(size)
+        yield f"store-{size}", lambda: client.get("/notes")
+        yield f"store-{size}-uncached", lambda: (
+            pastebin.notes_page_cache.clear(),
+            client.get("/notes"),
+        )
+
+
+# ----------------------------
+# Runner
+# ----------------------------
+
+
+def time_case(fn, min_time, rounds):
+    """Return per-operation timings in microseconds, one per round."""
+    fn()  # Warm up
+    number = 1
+    while True:  # Calibrate so that one round takes at least min_time
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    timings = [elapsed / number]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) / number)
+    return [t * 1_000_000 for t in timings], number
+
+
+def run(args):
+    results = {}
+    for name, cases in BENCHMARKS:
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        for case, fn in cases(args):
+            timings, number = time_case(fn, args.min_time, args.rounds)
+            key = f"{name}[{case}]"
+            results[key] = {
+                "median_us": statistics.median(timings),
+                "min_us": min(timings),
+                "max_us": max(timings),
+                "rounds": args.rounds,
+                "iterations": number,
+            }
+            print(f"{key:<50} {results[key]['median_us']:>12.2f} us")
+    notes.clear()
+    users.clear()
+    sanitize_cache.clear()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change against a baseline and return the regressed keys."""
+    regressions = []
+    print(f"\n{'benchmark':<50} {'baseline':>12} {'current':>12} {'change':>8}")
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key]["median_us"]
+        change = result["median_us"] / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(
+            f"{key:<50} {before:>12.2f} {result['median_us']:>12.2f}"
+            f" {change:>+8.1%}{flag}"
+        )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--store-sizes", type=int, nargs="+", default=[100, 1_000, 10_000]
+    )
+    parser.add_argument(
+        "--payload-sizes", type=int, nargs="+", default=[100, 1_000, 10_000]
+    )
+    parser.add_argument(
+        "--only", nargs="+", help="Only run benchmarks whose name contains these"
+    )
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument(
+        "--min-time", type=float, default=0.05, help="Minimum seconds per round"
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Allowed slowdown before flagging a regression (0.10 = 10%%)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.disable(logging.INFO)  # Keep per-request log lines out of the timings
+    results = run(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "meta": {
+                        "python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "timestamp": time.time(),
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
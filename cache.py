@@ -0,0 +1,88 @@
+"""Small in-process caches shared by the pastebin routes."""
+
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """A thread-safe, size-bounded least-recently-used cache.
+
+    Keeps hit and miss counters so cache effectiveness can be monitored.
+
+    With ``maxbytes`` set, the cache also evicts until the total size of its
+    values is at most ``maxbytes``; values larger than that are not cached
+    at all. A value's size is ``sizeof(value)``, by default its ``len()``.
+    """
+
+    def __init__(self, maxsize=1024, maxbytes=None, sizeof=len):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _weigh(self, value):
+        return self.sizeof(value) if self.maxbytes is not None else 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        size = self._weigh(value)
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, _MISSING)
+            if old is not _MISSING:
+                self._bytes -= self._weigh(old)
+            self._data[key] = value
+            self._bytes += size
+            while len(self._data) > self.maxsize or (
+                self.maxbytes is not None and self._bytes > self.maxbytes
+            ):
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= self._weigh(evicted)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self._bytes -= self._weigh(value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return the current size and hit/miss counters."""
+        stats = {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+        if self.maxbytes is not None:
+            stats.update(bytes=self._bytes, maxbytes=self.maxbytes)
+        return stats
@@ -0,0 +1,62 @@
+"""Flask-WTF forms for the HTML pages.
+
+Only the HTML routes use these, and Flask-WTF/WTForms are slow to import, so
+``pastebin`` imports this module on first use rather than at startup.
+"""
+
+from flask_wtf import FlaskForm
+from wtforms import (
+    BooleanField,
+    IntegerField,
+    PasswordField,
+    StringField,
+    SubmitField,
+    TextAreaField,
+)
+from wtforms.validators import (
+    DataRequired,
+    Length,
+    NumberRange,
+    Optional,
+    ValidationError,
+)
+
+# Longest note lifetime, in seconds (pastebin.MAX_EXPIRES_IN for the API)
+MAX_EXPIRES_IN = 365 * 24 * 3600
+
+
+class RegistrationForm(FlaskForm):
+    user_id = StringField("User ID", validators=[DataRequired(), Length(min=3, max=25)])
+    password = PasswordField("Password", validators=[DataRequired(), Length(min=6)])
+    submit = SubmitField("Register")
+
+    def __init__(self, *args, users, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.users = users  # The user store, to reject taken IDs
+
+    def validate_user_id(self, field):
+        if field.data in self.users:
+            raise ValidationError("User ID already exists.")
+
+
+class LoginForm(FlaskForm):
+    user_id = StringField("User ID", validators=[DataRequired()])
+    password = PasswordField("Password", validators=[DataRequired()])
+    submit = SubmitField("Login")
+
+
+class NoteForm(FlaskForm):
+    note_id = StringField("Note ID", validators=[DataRequired(), Length(min=1, max=50)])
+    text = TextAreaField("Note Text", validators=[DataRequired()])
+    is_public = BooleanField("Public")
+    expires_in = IntegerField(
+        "Expires in (seconds)",
+        validators=[Optional(), NumberRange(min=1, max=MAX_EXPIRES_IN)],
+    )
+    submit = SubmitField("Submit")
+
+
+class EditNoteForm(FlaskForm):
+    text = TextAreaField("Note Text", validators=[DataRequired()])
+    is_public = BooleanField("Public")
+    submit = SubmitField("Update")
@@ -0,0 +1,47 @@
+"""gunicorn settings: ``gunicorn -c gunicorn.conf.py``.
+
+With ``sqlite://`` storage the app is created once in the master
+(``preload_app``), before the workers fork, so every worker starts with the
+modules, templates and database settings already loaded and shares their
+memory copy-on-write. pastebin restarts its background threads in each worker
+(see ``pastebin._after_fork_in_child``); the expiry sweep, which writes to the
+stores, only starts in a worker, with its first request.
+
+``memory://`` and ``journal://`` storage keep the notes in the process that
+opened the stores. Opened in the master, they would be copied into every
+worker at fork time, and a worker forked to replace one that died would start
+from the master's stale copy (and, with a journal, keep writing to journal
+files that compaction already deleted). So with those stores nothing is
+preloaded: each worker creates the app, and opens the stores, itself.
+"""
+
+import os
+
+wsgi_app = "pastebin:create_app()"
+preload_app = os.environ.get("PASTEBIN_STORAGE", "memory://").startswith("sqlite:")
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+
+# memory:// and journal:// storage keep the notes in the process, so they
+# need a single worker; with sqlite:// storage, workers can share the database.
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+# API requests past API_MAX_IN_FLIGHT are only shed with a 503 if a thread
+# is free to take them, so a worker has 8 more threads than the cap: they
+# answer the 503s and serve the HTML pages while the API is saturated.
+api_max_in_flight = int(os.environ.get("API_MAX_IN_FLIGHT", "16"))
+threads = int(os.environ.get("GUNICORN_THREADS", api_max_in_flight + 8))
+
+
+def when_ready(server):
+    # Without preload_app, loading the app here would open the stores in the
+    # master; the workers warm up in post_worker_init instead
+    if preload_app:
+        import pastebin
+
+        pastebin.warm_up(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    if not preload_app:
+        import pastebin
+
+        pastebin.warm_up(worker.wsgi)
@@ -0,0 +1,329 @@
+"""Durable in-memory storage: an append-only journal plus compacted snapshots.
+
+The memory stores stay the source of truth while the process runs; every
+write to them is also appended to a journal file as one JSON line. Every
+``snapshot_every`` records the journal is compacted: a new journal file is
+started, the current state is written to a snapshot beside it, and older
+files are deleted. On startup the newest snapshot is read through ``mmap``
+and the journals written since are replayed on top of it.
+
+Files in the journal directory, by generation ``N``:
+
+* ``snapshot-N.jsonl``: the full state when journal ``N`` was started.
+* ``journal-N.jsonl``: every write since then.
+
+Records are idempotent state assignments (put a note, delete a note, put a
+user, clear a store), so replaying a write the snapshot already contains is
+harmless. That is what lets a snapshot be taken without stopping writers.
+
+Only one process may use a journal directory at a time.
+"""
+
+import atexit
+import json
+import mmap
+import os
+import re
+import threading
+import time
+
+_FILE = re.compile(r"(snapshot|journal)-(\d+)\.jsonl")
+_decode = json.JSONDecoder().decode  # Skips json.loads' per-call encoding sniffing
+
+
+def _encode(record):
+    line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+    return line.encode("utf-8") + b"\n"
+
+
+def _note_record(note_id, note):
+    record = ["note", note_id, note.text, note.author, note.is_public]
+    if note.expires_at is not None:  # Left out otherwise, as older journals do
+        record.append(note.expires_at)
+    return record
+
+
+def _user_record(user_id, user):
+    return ["user", user_id, user.password, user.api_key]
+
+
+def _apply(record, notes, users):
+    kind = record[0]
+    if kind == "note":
+        _, note_id, text, author, is_public, *expiry = record
+        if note_id in notes:
+            notes.update(note_id, text, is_public)
+        else:
+            notes.create(
+                note_id,
+                text,
+                author,
+                is_public,
+                expires_at=expiry[0] if expiry else None,
+            )
+    elif kind == "delete":
+        if record[1] in notes:
+            notes.delete(record[1])
+    elif kind == "user":
+        users.create(*record[1:])
+    elif kind == "clear_notes":
+        notes.clear()
+    elif kind == "clear_users":
+        users.clear()
+    else:
+        raise ValueError(f"Unknown journal record: {kind!r}")
+
+
+def _read(path):
+    """Yield ``(record, end offset)`` for every complete record of a file.
+
+    Reading stops at the first torn or corrupt line, such as a write cut
+    short by a crash.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    record = _decode(line.decode("utf-8"))
+                except ValueError:
+                    return
+                yield record, mm.tell()
+
+
+def _load_snapshot(path, notes, users, batch_size=10_000):
+    """Load a snapshot into empty stores and return the number of records.
+
+    A snapshot only holds puts of distinct notes and users, so notes are
+    added in batches through ``notes.load`` rather than one by one.
+    """
+    count = 0
+    batch = []
+    for record, _ in _read(path):
+        count += 1
+        if record[0] == "note":
+            batch.append(record[1:])
+            if len(batch) >= batch_size:
+                notes.load(batch)
+                batch.clear()
+        else:
+            _apply(record, notes, users)
+    notes.load(batch)
+    return count
+
+
+def _replay(path, notes, users):
+    """Apply every complete record of a journal file to the stores.
+
+    Returns ``(records applied, offset after the last complete record)``.
+    """
+    count = offset = 0
+    for record, offset in _read(path):
+        _apply(record, notes, users)
+        count += 1
+    return count, offset
+
+
+class Journal:
+    """Journal the writes of a note store and a user store to a directory.
+
+    With ``fsync_interval`` > 0, a background thread flushes and fsyncs the
+    journal at most that many seconds after a write, so a crash can lose up
+    to that much of the latest writes. With 0, every write is fsynced before
+    it returns. ``snapshot_every`` journal records trigger a compaction in
+    the background; 0 disables automatic snapshots.
+    """
+
+    def __init__(self, directory, fsync_interval=1.0, snapshot_every=100_000):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        self.generation = 0
+        self.recovery = {}
+        self.fsyncs = 0
+        self.snapshots = 0
+        self._notes = self._users = None
+        self._file = None
+        self._records = 0  # Records in the current journal file
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._compacting = threading.Lock()  # Held while a snapshot is written
+        self._closed = threading.Event()
+
+    def _path(self, kind, generation):
+        return os.path.join(self.directory, f"{kind}-{generation:06d}.jsonl")
+
+    def _generations(self, kind):
+        generations = []
+        for name in os.listdir(self.directory):
+            match = _FILE.fullmatch(name)
+            if match and match.group(1) == kind:
+                generations.append(int(match.group(2)))
+        return sorted(generations)
+
+    def open(self, notes, users):
+        """Recover the stores from disk, then journal every later write.
+
+        The stores should be empty. Returns the recovery statistics, which
+        are also kept in ``recovery``.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):  # A snapshot interrupted by a crash
+                os.remove(os.path.join(self.directory, name))
+
+        start = time.perf_counter()
+        snapshots = self._generations("snapshot")
+        base = snapshots[-1] if snapshots else 0
+        snapshot_records = 0
+        if snapshots:
+            snapshot_records = _load_snapshot(
+                self._path("snapshot", base), notes, users
+            )
+        journal_records = 0
+        journals = [g for g in self._generations("journal") if g >= base]
+        for generation in journals:
+            path = self._path("journal", generation)
+            count, end = _replay(path, notes, users)
+            journal_records += count
+            if end < os.path.getsize(path):
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+        self.generation = max([base, *journals])
+        self._records = journal_records
+        self._remove_before(base)
+        self.recovery = {
+            "generation": self.generation,
+            "snapshot_records": snapshot_records,
+            "journal_records": journal_records,
+            "seconds": time.perf_counter() - start,
+        }
+
+        self._notes, self._users = notes, users
+        self._file = open(self._path("journal", self.generation), "ab")
+        notes.subscribe(self._note_written)
+        users.subscribe(self._user_written)
+        self._start_flushing()
+        atexit.register(self.close)
+        return self.recovery
+
+    def _start_flushing(self):
+        if self.fsync_interval > 0:
+            threading.Thread(
+                target=self._flush_loop, name="journal-flush", daemon=True
+            ).start()
+
+    def after_fork(self):
+        """Restart the flush thread in a forked child.
+
+        Only the child should go on writing: the parent and the child would
+        otherwise interleave records in the same file.
+        """
+        self._lock = threading.Lock()
+        self._compacting = threading.Lock()
+        self._start_flushing()
+
+    def _note_written(self, note_id, note):
+        if note_id is None:
+            self.append(["clear_notes"])
+        elif note is None:
+            self.append(["delete", note_id])
+        else:
+            self.append(_note_record(note_id, note))
+
+    def _user_written(self, user_id, user):
+        if user_id is None:
+            self.append(["clear_users"])
+        else:
+            self.append(_user_record(user_id, user))
+
+    def append(self, record):
+        data = _encode(record)
+        with self._lock:
+            if self._file is None:
+                raise ValueError("Journal is closed")
+            self._file.write(data)
+            self._records += 1
+            if self.fsync_interval > 0:
+                self._dirty = True
+            else:
+                self._sync()
+            compact = 0 < self.snapshot_every <= self._records
+        if compact and self._compacting.acquire(blocking=False):
+            threading.Thread(
+                target=self._snapshot_and_release, name="journal-snapshot", daemon=True
+            ).start()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._dirty = False
+        self.fsyncs += 1
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            with self._lock:
+                if self._dirty and self._file is not None:
+                    self._sync()
+
+    def snapshot(self):
+        """Compact the journal into a snapshot of the current state."""
+        with self._compacting:
+            self._write_snapshot()
+
+    def _snapshot_and_release(self):
+        try:
+            self._write_snapshot()
+        finally:
+            self._compacting.release()
+
+    def _write_snapshot(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._sync()
+            self._file.close()
+            self.generation += 1
+            generation = self.generation
+            self._file = open(self._path("journal", generation), "ab")
+            self._records = 0
+        # Every write from here on goes to the new journal, so the state read
+        # below holds every write of the older files (and maybe a few newer
+        # ones, which replaying the new journal repeats harmlessly).
+        path = self._path("snapshot", generation)
+        with open(path + ".tmp", "wb") as f:
+            for note_id, note in self._notes.items():
+                f.write(_encode(_note_record(note_id, note)))
+            for user_id, user in self._users.items():
+                f.write(_encode(_user_record(user_id, user)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self._fsync_directory()
+        self._remove_before(generation)
+        self.snapshots += 1
+
+    def _fsync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _remove_before(self, generation):
+        for kind in ("snapshot", "journal"):
+            for old in self._generations(kind):
+                if old < generation:
+                    os.remove(self._path(kind, old))
+
+    def close(self):
+        """Flush and fsync the journal; later writes raise ValueError."""
+        self._closed.set()
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
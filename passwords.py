@@ -0,0 +1,133 @@
+"""Salted scrypt password hashing on a bounded worker pool.
+
+Stored hashes look like ``scrypt$<n>$<r>$<p>$<salt>$<key>`` (salt and key in
+base64), so each one records the cost it was made with and can be upgraded
+when the configured cost changes. Values without that prefix are treated as
+legacy plaintext passwords: they still verify, and always need a rehash.
+
+scrypt is deliberately slow and memory-hungry. ``PasswordHasher`` runs it on
+a small thread pool (hashlib releases the GIL while it works), so however
+many logins arrive at once, only ``workers`` hashes are computed at a time
+and the other request threads keep serving cheap requests. When more than
+``max_pending`` hashes are waiting, new ones fail fast with
+``HasherBusy`` instead of queueing.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PREFIX = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class HasherBusy(Exception):
+    """Raised when too many password hashes are already waiting."""
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode("utf-8"),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=128 * r * (n + p + 2) + 2**20,  # What OpenSSL needs, plus slack
+        dklen=KEY_BYTES,
+    )
+
+
+def hash_password(password, n, r, p):
+    """Return a salted scrypt hash of ``password`` in the stored format."""
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, n, r, p)
+    return "$".join(
+        [
+            PREFIX,
+            str(n),
+            str(r),
+            str(p),
+            base64.b64encode(salt).decode("ascii"),
+            base64.b64encode(key).decode("ascii"),
+        ]
+    )
+
+
+def parse_hash(stored):
+    """Return ``(n, r, p, salt, key)`` for a stored hash, or None if plaintext."""
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != PREFIX:
+        return None
+    _, n, r, p, salt, key = parts
+    return int(n), int(r), int(p), base64.b64decode(salt), base64.b64decode(key)
+
+
+def verify_password(password, stored):
+    """Check ``password`` against a stored hash in constant time."""
+    parsed = parse_hash(stored)
+    if parsed is None:
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+    n, r, p, salt, key = parsed
+    return hmac.compare_digest(_scrypt(password, salt, n, r, p), key)
+
+
+class PasswordHasher:
+    """Hash and verify passwords at a configurable cost on a bounded pool."""
+
+    def __init__(self, n=2**14, r=8, p=1, workers=2, max_pending=32):
+        self.n = n
+        self.r = r
+        self.p = p
+        self.workers = workers
+        self.max_pending = max_pending
+        self._start()
+        self._dummy_hash = None
+
+    def _start(self):
+        self._pool = ThreadPoolExecutor(
+            self.workers, thread_name_prefix="password-hash"
+        )
+        self._pending = threading.BoundedSemaphore(self.max_pending)
+
+    def after_fork(self):
+        """Replace the pool in a forked child, which has none of its threads."""
+        self._start()
+
+    def _run(self, fn, *args):
+        if not self._pending.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            self._pending.release()
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.n, self.r, self.p)
+
+    def verify(self, password, stored):
+        """Return ``(valid, new_hash)``.
+
+        ``new_hash`` is a fresh hash at the current cost when the password is
+        valid but ``stored`` is plaintext or was made with another cost, and
+        None otherwise. Pass ``stored=None`` for unknown users: a hash is
+        still checked, so the response time does not reveal which users
+        exist.
+        """
+        if stored is None:
+            if self._dummy_hash is None or self.needs_rehash(self._dummy_hash):
+                self._dummy_hash = self.hash("dummy password")
+            self._run(verify_password, password, self._dummy_hash)
+            return False, None
+        if not self._run(verify_password, password, stored):
+            return False, None
+        if self.needs_rehash(stored):
+            return True, self.hash(password)
+        return True, None
+
+    def needs_rehash(self, stored):
+        parsed = parse_hash(stored)
+        return parsed is None or parsed[:3] != (self.n, self.r, self.p)
@@ -1,15 +1,27 @@
+import base64
+import binascii
 import datetime
+import gzip
+import hashlib
+import hmac
+import html
+import io
 import json
 import logging
+import math
 import os
+import re
 import secrets
-from functools import wraps
-from logging.config import dictConfig
+import time
+import zlib
+from functools import partial, wraps
 
 import jwt
 from flask import (
     Flask,
     Response,
+    current_app,
+    g,
     request,
     render_template,
     redirect,
@@ -17,53 +29,341 @@ from flask import (
     flash,
     session,
 )
-from flask_wtf import FlaskForm
-from html_sanitizer import Sanitizer
-from wtforms import StringField, TextAreaField, BooleanField, SubmitField, PasswordField
-from wtforms.validators import DataRequired, Length, ValidationError
-
-
-# Configure logging
-dictConfig(
-    {
-        "version": 1,
-        "formatters": {
-            "default": {
-                "format": "[%(asctime)s] %(levelname)s in %(module)s: %(message)s",
-            }
-        },
-        "handlers": {
-            "wsgi": {
-                "class": "logging.StreamHandler",
-                "stream": "ext://sys.stdout",
-                "formatter": "default",
-            }
-        },
-        "root": {"level": "INFO", "handlers": ["wsgi"]},
-    }
+
+from cache import LRUCache
+from metrics import CONTENT_TYPE, REGISTRY, CallbackMetric, Counter, Gauge, Histogram
+from passwords import HasherBusy, PasswordHasher
+from ratelimit import (
+    ConcurrencyLimiter,
+    RateLimiter,
+    parse_rate_limits,
+    retry_after,
 )
+from search import SearchIndex
+from storage import CompressedNote, ExpirySweeper, open_stores
+from structured_logging import configure_logging, parse_sample_rates
+
+# Importing this module only defines things; the work of starting the app
+# (configuring logging, opening the stores, building the Flask app) happens in
+# create_app. ``pastebin.app`` is created on first access, for ``flask run``.
 
 logger = logging.getLogger(__name__)
+log_handler = None  # The root logger's queue handler, set by init_logging
+_log_settings = None  # init_logging's arguments, to restart it after a fork
 
 # Retrieve or generate SECRET_KEY
-SECRET_KEY = os.environ.get("SECRET_KEY")
-if not SECRET_KEY:
-    SECRET_KEY = secrets.token_urlsafe(32)
-    logger.warning(
-        "No SECRET_KEY set for Flask application; using a temporary key. "
-        "Set the SECRET_KEY environment variable for production."
+SECRET_KEY = os.environ.get("SECRET_KEY") or secrets.token_urlsafe(32)
+
+# Verified JWT tokens: token -> (user ID, expiry timestamp)
+token_cache = LRUCache(int(os.environ.get("TOKEN_CACHE_SIZE", "10000")))
+token_cache_secret = SECRET_KEY  # The key the cached tokens were verified with
+
+# Compressed bodies of responses with an ETag:
+# (path, ETag, encoding, level) -> bytes, bounded by count and by total size
+compress_cache = LRUCache(
+    int(os.environ.get("COMPRESS_CACHE_SIZE", "1024")),
+    maxbytes=int(os.environ.get("COMPRESS_CACHE_BYTES", 32 * 1024 * 1024)),
+)
+
+# The HTML sanitizer, built on first use (html_sanitizer is slow to import)
+_sanitizer = None
+
+# Memoized sanitizer output, keyed on the SHA-256 of the raw input and
+# bounded by count and by total size
+sanitize_cache = LRUCache(
+    int(os.environ.get("SANITIZE_CACHE_SIZE", "4096")),
+    maxbytes=int(os.environ.get("SANITIZE_CACHE_BYTES", 64 * 1024 * 1024)),
+)
+SANITIZE_CACHE_MAX_INPUT = 1024 * 1024  # Larger inputs are not cached
+sanitize_fast_path_hits = 0
+# Input the sanitizer does more to than collapse whitespace (NUL becomes U+FFFD)
+_MARKUP_CHARS = re.compile(r"[<>&\x00]")
+_WHITESPACE = re.compile(r"\s+")
+
+# Rendered /notes pages: user -> (listing version, HTML), bounded by count
+# and by total size
+notes_page_cache = LRUCache(
+    int(os.environ.get("NOTES_PAGE_CACHE_SIZE", "1024")),
+    maxbytes=int(os.environ.get("NOTES_PAGE_CACHE_BYTES", 64 * 1024 * 1024)),
+    sizeof=lambda entry: len(entry[1]),
+)
+# Plain-text previews of note versions: (note ID, version) -> preview
+preview_cache = LRUCache(int(os.environ.get("PREVIEW_CACHE_SIZE", "65536")))
+PREVIEW_LENGTH = 50
+# JSON of each note as the API returns it: note ID -> (version, UTF-8 bytes).
+# Filled as notes are written, so reads and listings join cached bytes;
+# notes large enough to be stored compressed only when they are read.
+note_json_cache = LRUCache(
+    int(os.environ.get("NOTE_JSON_CACHE_SIZE", "1000000")),
+    maxbytes=int(os.environ.get("NOTE_JSON_CACHE_BYTES", 32 * 1024 * 1024)),
+    sizeof=lambda entry: len(entry[1]),
+)
+# UTF-8 bodies of raw note reads: (note ID, version) -> bytes, bounded by
+# count and by total size
+raw_cache = LRUCache(
+    int(os.environ.get("RAW_CACHE_SIZE", "1024")),
+    maxbytes=int(os.environ.get("RAW_CACHE_BYTES", 64 * 1024 * 1024)),
+)
+# Tags, including one cut off at the end of a truncated text
+_TAGS = re.compile(r"<[^>]*(?:>|$)")
+
+# NDJSON import reports at most IMPORT_MAX_ERRORS failed lines in full (the
+# rest are only counted)
+IMPORT_MAX_ERRORS = 100
+IMPORT_READ_BUFFER = 64 * 1024
+
+# Longest note lifetime accepted in expiresIn, in seconds (forms.NoteForm
+# enforces the same bound)
+MAX_EXPIRES_IN = 365 * 24 * 3600
+
+# Passwords are hashed with scrypt at this cost, on a pool of
+# PASSWORD_HASH_WORKERS threads; stored hashes are upgraded at the next login
+# after the cost changes.
+password_hasher = PasswordHasher(
+    n=int(os.environ.get("PASSWORD_SCRYPT_N", 2**14)),
+    r=int(os.environ.get("PASSWORD_SCRYPT_R", "8")),
+    p=int(os.environ.get("PASSWORD_SCRYPT_P", "1")),
+    workers=int(os.environ.get("PASSWORD_HASH_WORKERS", "2")),
+    max_pending=int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "32")),
+)
+# Token-bucket limits per API endpoint and client, as endpoint=requests/seconds;
+# "default" covers the endpoints not listed. RATE_LIMITS overrides entries.
+DEFAULT_RATE_LIMITS = (
+    "default=50/1,api_login=10/60,api_register=10/60,"
+    "api_create_note=20/1,api_batch_notes=5/1"
+)
+
+
+def default_config():
+    """Return the app settings, read from the environment."""
+    return {
+        "SECRET_KEY": SECRET_KEY,
+        "WTF_CSRF_TIME_LIMIT": None,  # Disable CSRF token expiration for simplicity
+        "API_NOTES_MAX_LIMIT": 1000,  # Upper bound for ?limit= on GET /api/notes
+        "API_BATCH_MAX_SIZE": int(os.environ.get("API_BATCH_MAX_SIZE", "100")),
+        # Notes inserted per store transaction by POST /api/notes/import, and
+        # the longest line (in bytes) it accepts
+        "API_IMPORT_CHUNK_SIZE": int(os.environ.get("API_IMPORT_CHUNK_SIZE", "500")),
+        "API_IMPORT_MAX_LINE": int(os.environ.get("API_IMPORT_MAX_LINE", 1024 * 1024)),
+        # Responses smaller than this many bytes are sent uncompressed
+        "COMPRESS_MIN_SIZE": int(os.environ.get("COMPRESS_MIN_SIZE", "1024")),
+        "COMPRESS_LEVEL": int(os.environ.get("COMPRESS_LEVEL", "6")),
+        "RATE_LIMITS": {
+            **parse_rate_limits(DEFAULT_RATE_LIMITS),
+            **parse_rate_limits(os.environ.get("RATE_LIMITS", "")),
+        },
+        # Note and user storage; in memory unless PASTEBIN_STORAGE points at a
+        # journal directory or a database, e.g. PASTEBIN_STORAGE=journal:////data
+        # or PASTEBIN_STORAGE=sqlite:////data/pastebin.db
+        "PASTEBIN_STORAGE": os.environ.get("PASTEBIN_STORAGE", "memory://"),
+        "JOURNAL_FSYNC_INTERVAL": float(
+            os.environ.get("JOURNAL_FSYNC_INTERVAL", "1.0")
+        ),
+        "JOURNAL_SNAPSHOT_EVERY": int(
+            os.environ.get("JOURNAL_SNAPSHOT_EVERY", "100000")
+        ),
+        # Large note bodies are kept zlib-compressed by the in-memory store
+        "NOTE_COMPRESS_THRESHOLD": int(
+            os.environ.get("NOTE_COMPRESS_THRESHOLD", 64 * 1024)
+        ),
+        # Identical note texts of at least this many bytes are stored once
+        "NOTE_DEDUP_THRESHOLD": int(os.environ.get("NOTE_DEDUP_THRESHOLD", "512")),
+        # Expired notes are deleted every NOTE_EXPIRY_SWEEP_INTERVAL seconds,
+        # NOTE_EXPIRY_SWEEP_BATCH per store transaction (0 disables the sweep;
+        # expired notes are hidden from reads either way)
+        "NOTE_EXPIRY_SWEEP_INTERVAL": float(
+            os.environ.get("NOTE_EXPIRY_SWEEP_INTERVAL", "1.0")
+        ),
+        "NOTE_EXPIRY_SWEEP_BATCH": int(
+            os.environ.get("NOTE_EXPIRY_SWEEP_BATCH", "1000")
+        ),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "INFO"),
+        # High-volume events can be sampled,
+        # e.g. LOG_SAMPLE_RATES="note.read=0.01,note.list=0.01"
+        "LOG_SAMPLE_RATES": parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", "")),
+        # /metrics answers only requests with "Authorization: Bearer <token>";
+        # it is not served at all without a token
+        "METRICS_TOKEN": os.environ.get("METRICS_TOKEN", ""),
+    }
+
+
+# Request, sanitizer and token verification metrics, served at /metrics
+REQUEST_SECONDS = Histogram(
+    "pastebin_request_duration_seconds",
+    "Time spent handling a request.",
+    ["endpoint", "method", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "pastebin_requests_in_flight", "Requests currently being handled."
+)
+REQUESTS_SHED = Counter(
+    "pastebin_requests_shed_total",
+    "API requests refused by admission control, by reason.",
+    ["reason"],
+)
+SANITIZE_SECONDS = Histogram(
+    "pastebin_sanitize_duration_seconds",
+    "Time spent sanitizing input.",
+)
+WRITE_CONFLICTS = Counter(
+    "pastebin_write_conflicts_total",
+    "Note writes refused because the note changed after it was checked, by op.",
+    ["op"],
+)
+JWT_VERIFY_SECONDS = Histogram(
+    "pastebin_jwt_verify_duration_seconds",
+    "Time spent verifying API tokens, by source (cache or decode).",
+    ["source"],
+)
+CACHE_LOOKUPS = CallbackMetric(
+    "pastebin_cache_lookups_total",
+    "Cache lookups by cache and result.",
+    lambda: {
+        (name, result): cache.stats()[result]
+        for name, cache in (
+            ("sanitize", sanitize_cache),
+            ("token", token_cache),
+            ("compress", compress_cache),
+            ("notes_page", notes_page_cache),
+            ("preview", preview_cache),
+            ("raw", raw_cache),
+            ("note_json", note_json_cache),
+        )
+        for result in ("hits", "misses")
+    },
+    ["cache", "result"],
+    type="counter",
+)
+LOG_RECORDS_DROPPED = CallbackMetric(
+    "pastebin_log_records_dropped_total",
+    "Log records dropped because the log queue was full.",
+    lambda: {(): log_handler.dropped if log_handler is not None else 0},
+    type="counter",
+)
+
+
+# ----------------------------
+# Startup
+# ----------------------------
+
+
+def init_logging(level, sample_rates):
+    """Log JSON lines through a background writer thread."""
+    global log_handler, _log_settings
+    _log_settings = (level, sample_rates)
+    log_handler = configure_logging(level=level, sample_rates=sample_rates)
+
+
+def init_stores(config):
+    """Open the note and user stores and the search index.
+
+    The stores are shared by every app in the process, so only the first
+    call opens them; later calls (and later apps) reuse them.
+    """
+    global notes, users, search_index, expiry_sweeper
+    if "notes" in globals():
+        return
+    notes, users = open_stores(
+        config["PASTEBIN_STORAGE"],
+        journal_options={
+            "fsync_interval": config["JOURNAL_FSYNC_INTERVAL"],
+            "snapshot_every": config["JOURNAL_SNAPSHOT_EVERY"],
+        },
+        compress_threshold=config["NOTE_COMPRESS_THRESHOLD"],
+        dedup_threshold=config["NOTE_DEDUP_THRESHOLD"],
+    )
+    journal = getattr(notes, "journal", None)
+    if journal is not None:
+        logger.info(
+            "Recovered %d notes and %d users in %.2fs",
+            len(notes),
+            len(users),
+            journal.recovery["seconds"],
+            extra={"event": "storage.recover", **journal.recovery},
+        )
+
+    if hasattr(notes, "memory_stats"):
+        CallbackMetric(
+            "pastebin_note_text_bytes",
+            "Bytes of note text: all of it (raw), counting identical texts "
+            "once (unique), and as kept after compression (stored).",
+            lambda: {
+                (kind,): notes.memory_stats()[f"{kind}_bytes"]
+                for kind in ("raw", "unique", "stored")
+            },
+            labelnames=["kind"],
+        )
+
+    # Full-text search. A SQLite store searches its database, which every
+    # worker process writes to; the memory stores get an index in this
+    # process, updated by every note write
+    if hasattr(notes, "search"):
+        search_index = notes
+    else:
+        search_index = SearchIndex()
+        search_index.rebuild(notes.items())
+        notes.subscribe(search_index.update)
+    notes.subscribe(partial(serialize_note, max_size=config["NOTE_COMPRESS_THRESHOLD"]))
+
+    expiry_sweeper = ExpirySweeper(
+        notes,
+        interval=config["NOTE_EXPIRY_SWEEP_INTERVAL"],
+        batch_size=config["NOTE_EXPIRY_SWEEP_BATCH"],
+    )  # Started by the first request; see start_expiry_sweeper
+    CallbackMetric(
+        "pastebin_notes_expired_total",
+        "Expired notes deleted by the background sweep.",
+        lambda: {(): expiry_sweeper.expired},
+        type="counter",
     )
 
-# Initialize the HTML sanitizer
-sanitizer = Sanitizer()
 
-app = Flask(__name__)
-app.config["SECRET_KEY"] = SECRET_KEY
-app.config["WTF_CSRF_TIME_LIMIT"] = None  # Disable CSRF token expiration for simplicity
+class Views:
+    """Routes, hooks and error handlers, recorded at import.
+
+    The module defines its views with ``@views.route(...)`` and friends, the
+    way it would with ``@app.route``; ``create_app`` then registers them all,
+    in order, on each app it builds. Unlike a Blueprint, endpoint names stay
+    unprefixed, so ``url_for("list_notes")`` and the RATE_LIMITS keys keep
+    working.
+    """
+
+    def __init__(self):
+        self._setup = []  # (Flask method name, args, kwargs, function)
+
+    def _record(self, method, *args, **kwargs):
+        def decorator(f):
+            self._setup.append((method, args, kwargs, f))
+            return f
+
+        return decorator
+
+    def route(self, rule, **options):
+        return self._record("route", rule, **options)
+
+    def errorhandler(self, code_or_exception):
+        return self._record("errorhandler", code_or_exception)
+
+    def before_request(self, f):
+        return self._record("before_request")(f)
+
+    def after_request(self, f):
+        return self._record("after_request")(f)
+
+    def teardown_request(self, f):
+        return self._record("teardown_request")(f)
+
+    def init_app(self, app):
+        for method, args, kwargs, f in self._setup:
+            register = getattr(app, method)
+            if args or kwargs:
+                register(*args, **kwargs)(f)
+            else:
+                register(f)
+
+
+views = Views()
 
-# In-memory storage (use a database for production)
-notes = {}
-users = {}
 
 # ----------------------------
 # Authentication Decorators
@@ -85,8 +385,7 @@ def token_required(f):
             return Response("Token is missing", 401)
 
         try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            current_user = data["sub"]
+            current_user = verify_request_token(token)
         except jwt.ExpiredSignatureError:
             return Response("Token has expired", 401)
         except jwt.InvalidTokenError:
@@ -108,40 +407,6 @@ def login_required(f):
     return decorated
 
 
-# ----------------------------
-# Flask-WTF Forms
-# ----------------------------
-
-
-class RegistrationForm(FlaskForm):
-    user_id = StringField("User ID", validators=[DataRequired(), Length(min=3, max=25)])
-    password = PasswordField("Password", validators=[DataRequired(), Length(min=6)])
-    submit = SubmitField("Register")
-
-    def validate_user_id(self, field):
-        if field.data in users:
-            raise ValidationError("User ID already exists.")
-
-
-class LoginForm(FlaskForm):
-    user_id = StringField("User ID", validators=[DataRequired()])
-    password = PasswordField("Password", validators=[DataRequired()])
-    submit = SubmitField("Login")
-
-
-class NoteForm(FlaskForm):
-    note_id = StringField("Note ID", validators=[DataRequired(), Length(min=1, max=50)])
-    text = TextAreaField("Note Text", validators=[DataRequired()])
-    is_public = BooleanField("Public")
-    submit = SubmitField("Submit")
-
-
-class EditNoteForm(FlaskForm):
-    text = TextAreaField("Note Text", validators=[DataRequired()])
-    is_public = BooleanField("Public")
-    submit = SubmitField("Update")
-
-
 # ----------------------------
 # Helper Functions
 # ----------------------------
@@ -167,25 +432,445 @@ def generate_jwt_token(user_id):
             token = token.decode("utf-8")
         return token
     except Exception as e:
-        logger.error(f"Error generating token: {e}")
+        logger.error("Error generating token: %s", e, extra={"event": "token.error"})
+        return None
+
+
+def verify_jwt_token(token):
+    """Return the user a JWT token was issued to, or raise jwt.InvalidTokenError.
+
+    Verified tokens are cached until they expire, so repeat requests with the
+    same token skip signature verification and claim parsing. The cache is
+    dropped whenever SECRET_KEY changes.
+    """
+    global token_cache_secret
+    if token_cache_secret != SECRET_KEY:
+        token_cache.clear()
+        token_cache_secret = SECRET_KEY
+
+    start = time.perf_counter()
+    cached = token_cache.get(token)
+    if cached is not None:
+        user_id, expires_at = cached
+        JWT_VERIFY_SECONDS.observe(time.perf_counter() - start, "cache")
+        if time.time() < expires_at:
+            return user_id
+        token_cache.pop(token)
+        raise jwt.ExpiredSignatureError("Signature has expired")
+
+    try:
+        data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    finally:
+        JWT_VERIFY_SECONDS.observe(time.perf_counter() - start, "decode")
+    user_id = data["sub"]
+    if "exp" in data:
+        token_cache.set(token, (user_id, data["exp"]))
+    return user_id
+
+
+def verify_request_token(token):
+    """verify_jwt_token, remembered for the rest of the current request.
+
+    Admission control and token_required both need the token's user; this
+    verifies it (or fails to) once per request.
+    """
+    verified = request.environ.get("pastebin.verified_token")
+    if verified is None or verified[0] != token:
+        try:
+            verified = (token, verify_jwt_token(token), None)
+        except jwt.InvalidTokenError as e:
+            verified = (token, None, e)
+        request.environ["pastebin.verified_token"] = verified
+    if verified[2] is not None:
+        raise verified[2]
+    return verified[1]
+
+
+def authenticate(user_id, password):
+    """Return the user if the password is right, else None.
+
+    A hash made with an outdated cost (or a legacy plaintext password) is
+    replaced with one at the current cost.
+    """
+    user = users.get(user_id)
+    valid, new_hash = password_hasher.verify(
+        password, user.password if user is not None else None
+    )
+    if not valid:
         return None
+    if new_hash is not None:
+        users.create(user_id, new_hash, user.api_key)
+        logger.info(
+            "Upgraded the password hash of user '%s'",
+            user_id,
+            extra={"event": "user.rehash", "user": user_id},
+        )
+    return user
+
+
+@views.errorhandler(HasherBusy)
+def password_hasher_busy(e):
+    REQUESTS_SHED.inc("password_hasher_busy")
+    return Response(
+        "Server is busy, try again", status=503, headers={"Retry-After": "1"}
+    )
+
+
+def get_sanitizer():
+    """Return the HTML sanitizer, importing and building it on first use."""
+    global _sanitizer
+    if _sanitizer is None:
+        from html_sanitizer import Sanitizer
+
+        _sanitizer = Sanitizer()
+    return _sanitizer
 
 
 def can_user_read(user, note_id):
     """Check if the user can read the note."""
-    if notes[note_id]["isPublic"] or user == notes[note_id]["author"]:
+    note = notes.get(note_id)
+    if note is not None and (note.is_public or user == note.author):
         return True
     return False
 
 
 def can_user_modify(user, note_id):
     """Check if the user can modify the note."""
-    return user == notes[note_id]["author"]
+    note = notes.get(note_id)
+    return note is not None and user == note.author
 
 
 def sanitize_input(data):
-    """Sanitize user input to prevent XSS."""
-    return sanitizer.sanitize(data)
+    """Sanitize user input to prevent XSS.
+
+    Plain ASCII text without markup characters only needs the sanitizer's
+    whitespace normalization, so it skips the HTML parser entirely. Other
+    input is memoized by content hash, since identical pastes are common.
+    """
+    return sanitize_note_text(data)[0]
+
+
+def sanitize_note_text(text):
+    """Sanitize a note's text, returning ``(sanitized, source)``.
+
+    ``source`` is the SHA-256 of the raw text, for the note store to record
+    with the note (None when the text skipped the sanitizer). While a note
+    made from the same raw text is stored, its text is reused instead of
+    running the sanitizer again, even for inputs too large to memoize.
+    """
+    start = time.perf_counter()
+    sanitized, source = _sanitize(text)
+    SANITIZE_SECONDS.observe(time.perf_counter() - start)
+    return sanitized, source
+
+
+def _sanitize(data):
+    """Sanitize ``data``, returning the result and the SHA-256 of ``data``
+    (or None if it was not needed)."""
+    global sanitize_fast_path_hits
+    if not isinstance(data, str):
+        return get_sanitizer().sanitize(data), None
+    if data.isascii() and not _MARKUP_CHARS.search(data):
+        sanitize_fast_path_hits += 1
+        return _WHITESPACE.sub(" ", data), None
+
+    key = hashlib.sha256(data.encode("utf-8", "surrogatepass")).digest()
+    cacheable = len(data) <= SANITIZE_CACHE_MAX_INPUT
+    if cacheable:
+        sanitized = sanitize_cache.get(key)
+        if sanitized is not None:
+            return sanitized, key
+    sanitized = notes.text_for_source(key)
+    if sanitized is None:
+        sanitized = get_sanitizer().sanitize(data)
+    if cacheable:
+        sanitize_cache.set(key, sanitized)
+    return sanitized, key
+
+
+def note_as_dict(note_id, note):
+    """Return the public JSON representation of a note."""
+    result = {
+        "id": note_id,
+        "text": note.text,
+        "author": note.author,
+        "isPublic": note.is_public,
+    }
+    if note.expires_at is not None:
+        result["expiresAt"] = note.expires_at
+    return result
+
+
+def text_size(note):
+    """Return the length of a note's text without decompressing it."""
+    if isinstance(note, CompressedNote):
+        return note.raw_size
+    return len(note.text)
+
+
+def note_json(note_id, note):
+    """Return ``note_as_dict(note_id, note)`` as JSON, in UTF-8 bytes.
+
+    Most notes are serialized when they are written (see ``serialize_note``),
+    so this is usually a cache lookup; large notes, and writes from other
+    processes sharing the store, are serialized on their first read here.
+    """
+    cached = note_json_cache.get(note_id)
+    if cached is not None and cached[0] == note.version:
+        return cached[1]
+    body = json.dumps(note_as_dict(note_id, note)).encode("utf-8")
+    note_json_cache.set(note_id, (note.version, body))
+    return body
+
+
+def serialize_note(note_id, note, max_size=None):
+    """Store listener that keeps ``note_json_cache`` in step with writes.
+
+    Notes of ``max_size`` bytes or more, the size the store compresses
+    texts at, are only dropped from the cache: keeping the JSON of every
+    such note would undo the compression, so they are serialized when read.
+    """
+    if note_id is None:
+        note_json_cache.clear()
+    elif note is None:
+        note_json_cache.pop(note_id)
+    elif max_size is not None and text_size(note) >= max_size:
+        note_json_cache.pop(note_id)
+    else:
+        body = json.dumps(note_as_dict(note_id, note)).encode("utf-8")
+        note_json_cache.set(note_id, (note.version, body))
+
+
+def parse_expires_in(value):
+    """Return ``(expires_at, error)`` for an optional ``expiresIn`` value.
+
+    ``value`` is a lifetime in whole seconds, or None for a note that never
+    expires. ``error`` is a message for an invalid value, and None otherwise.
+    """
+    if value is None:
+        return None, None
+    if (
+        not isinstance(value, int)
+        or isinstance(value, bool)
+        or not 0 < value <= MAX_EXPIRES_IN
+    ):
+        return None, f"'expiresIn' must be between 1 and {MAX_EXPIRES_IN} seconds"
+    return time.time() + value, None
+
+
+def note_preview(note_id, note):
+    """Return the start of a note's text as plain text, for listings.
+
+    Previews are computed once per note version.
+    """
+    key = (note_id, note.version)
+    preview = preview_cache.get(key)
+    if preview is None:
+        # Usually enough source text for the preview once markup is removed
+        text = _TAGS.sub(" ", note.text[: PREVIEW_LENGTH * 20])
+        text = _WHITESPACE.sub(" ", html.unescape(text)).strip()
+        if len(text) > PREVIEW_LENGTH:
+            text = text[:PREVIEW_LENGTH] + "..."
+        preview = text
+        preview_cache.set(key, preview)
+    return preview
+
+
+def encode_cursor(note_id):
+    """Encode a note ID as an opaque, URL-safe pagination cursor."""
+    return base64.urlsafe_b64encode(note_id.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Decode a pagination cursor, raising ValueError if it is malformed."""
+    try:
+        raw = base64.b64decode(cursor.encode("ascii"), altchars=b"-_", validate=True)
+        return raw.decode("utf-8")
+    except (UnicodeError, binascii.Error) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def not_modified(etag):
+    """Return a 304 response if the request's If-None-Match matches ``etag``."""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def stream_json_array(items):
+    """Yield a JSON array chunk by chunk from an iterable of serialized values.
+
+    ``items`` are JSON texts in UTF-8 bytes, such as ``note_json`` returns.
+    """
+    yield b"["
+    for i, item in enumerate(items):
+        if i:
+            yield b", "  # Same bytes as json.dumps
+        yield item
+    yield b"]"
+
+
+# ----------------------------
+# Request Metrics
+# ----------------------------
+
+# Registered before the other after_request hooks, so it runs after them
+# (Flask runs them in reverse) and the latency includes their work.
+
+
+@views.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+
+@views.before_request
+def start_expiry_sweeper():
+    # Only the process serving requests sweeps: with preload_app the stores
+    # are opened in the gunicorn master, which must not write to them
+    expiry_sweeper.start()
+
+
+@views.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@views.teardown_request
+def record_request_metrics(exc):
+    start = g.pop("request_start", None)
+    if start is None:
+        return
+    REQUESTS_IN_FLIGHT.dec()
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        request.endpoint or "unmatched",
+        request.method,
+        g.pop("response_status", 500),
+    )
+
+
+@views.route("/metrics")
+def prometheus_metrics():
+    expected = current_app.config["METRICS_TOKEN"]
+    if not expected:
+        return Response("Not Found", status=404)
+    _, _, token = request.headers.get("Authorization", "").partition(" ")
+    if not hmac.compare_digest(token.encode(), expected.encode()):
+        return Response("Invalid token", status=401)
+    return Response(REGISTRY.render(), status=200, content_type=CONTENT_TYPE)
+
+
+# ----------------------------
+# Admission Control
+# ----------------------------
+
+# API requests over their rate limit get a 429, and those arriving while
+# API_MAX_IN_FLIGHT are already being handled a 503, instead of queueing.
+# That needs more server threads than the cap; see gunicorn.conf.py.
+rate_limiter = RateLimiter()
+in_flight = ConcurrencyLimiter(int(os.environ.get("API_MAX_IN_FLIGHT", "16")))
+
+
+def rate_limit_key():
+    """Identify the client: the user of a valid API token, else its IP address."""
+    auth_header = request.headers.get("Authorization", "")
+    _, _, token = auth_header.partition(" ")
+    if token:
+        try:
+            return f"user:{verify_request_token(token)}"
+        except jwt.InvalidTokenError:
+            pass
+    return f"ip:{request.remote_addr}"
+
+
+@views.before_request
+def admit_request():
+    if not request.path.startswith("/api/"):
+        return None
+    limits = current_app.config["RATE_LIMITS"]
+    limit = limits.get(request.endpoint, limits.get("default"))
+    if limit is not None:
+        rate, burst = limit
+        wait = rate_limiter.acquire((request.endpoint, rate_limit_key()), rate, burst)
+        if wait:
+            REQUESTS_SHED.inc("rate_limited")
+            return Response(
+                "Rate limit exceeded",
+                status=429,
+                headers={"Retry-After": retry_after(wait)},
+            )
+    if not in_flight.try_acquire():
+        REQUESTS_SHED.inc("overloaded")
+        return Response(
+            "Server is overloaded", status=503, headers={"Retry-After": "1"}
+        )
+    g.admitted = True
+    return None
+
+
+@views.teardown_request
+def release_admission(exc):
+    if g.pop("admitted", False):
+        in_flight.release()
+
+
+# ----------------------------
+# Response Compression
+# ----------------------------
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/plain", "text/css"}
+
+
+def compress_body(data, encoding, level):
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    return zlib.compress(data, level)  # HTTP "deflate" is the zlib format
+
+
+@views.after_request
+def compress_response(response):
+    """Compress large responses with gzip or deflate, per Accept-Encoding.
+
+    A URL always returns the same body for the same ETag, so compressed
+    bodies are cached by path and ETag and only compressed once. ETags are
+    only unique per URL: two notes can share one.
+    """
+    response.vary.add("Accept-Encoding")
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or response.content_length is None
+        or response.content_length < current_app.config["COMPRESS_MIN_SIZE"]
+    ):
+        return response
+    encoding = request.accept_encodings.best_match(["gzip", "deflate"])
+    if encoding is None:
+        return response
+
+    level = current_app.config["COMPRESS_LEVEL"]
+    etag, weak = response.get_etag()
+    if etag:
+        key = (request.path, etag, encoding, level)
+        body = compress_cache.get(key)
+        if body is None:
+            body = compress_body(response.get_data(), encoding, level)
+            compress_cache.set(key, body)
+        # The compressed bytes differ from the identity encoding, so only a
+        # weak ETag still holds; If-None-Match uses weak comparison anyway
+        response.set_etag(etag, weak=True)
+    else:
+        body = compress_body(response.get_data(), encoding, level)
+
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    return response
 
 
 # ----------------------------
@@ -193,29 +878,34 @@ def sanitize_input(data):
 # ----------------------------
 
 
-@app.route("/")
+@views.route("/")
 def home():
     return render_template("home.html")
 
 
 # User Registration
-@app.route("/register", methods=["GET", "POST"])
+@views.route("/register", methods=["GET", "POST"])
 def register():
-    form = RegistrationForm()
+    from forms import RegistrationForm
+
+    form = RegistrationForm(users=users)
     if form.validate_on_submit():
         user_id = sanitize_input(form.user_id.data)
-        password = form.password.data  # In production, hash the password
+        password = password_hasher.hash(form.password.data)
 
         # Generate API key
         api_key = generate_api_key()
 
-        # Store user
-        users[user_id] = {
-            "password": password,  # Store hashed password in production
-            "api_key": api_key,
-        }
+        # Store user, unless another request took the ID since validation
+        if not users.insert_if_absent(user_id, password, api_key):
+            flash("User ID already exists.", "danger")
+            return render_template("register.html", form=form)
 
-        logger.info(f"Registered new user '{user_id}'")
+        logger.info(
+            "Registered new user '%s'",
+            user_id,
+            extra={"event": "user.register", "user": user_id},
+        )
 
         flash("Registration successful! Please log in.", "success")
         return redirect(url_for("login"))
@@ -223,18 +913,20 @@ def register():
 
 
 # User Login
-@app.route("/login", methods=["GET", "POST"])
+@views.route("/login", methods=["GET", "POST"])
 def login():
+    from forms import LoginForm
+
     form = LoginForm()
     if form.validate_on_submit():
         user_id = sanitize_input(form.user_id.data)
         password = form.password.data
 
-        user = users.get(user_id)
-        if user and user["password"] == password:
+        user = authenticate(user_id, password)
+        if user is not None:
             # Successful login
             session["user_id"] = user_id
-            session["api_key"] = user["api_key"]
+            session["api_key"] = user.api_key
             flash("Logged in successfully!", "success")
             return redirect(url_for("list_notes"))
         else:
@@ -243,7 +935,7 @@ def login():
 
 
 # User Logout
-@app.route("/logout")
+@views.route("/logout")
 def logout():
     session.pop("user_id", None)
     session.pop("api_key", None)
@@ -252,46 +944,60 @@ def logout():
 
 
 # List Notes
-@app.route("/notes")
+@views.route("/notes")
 @login_required
 def list_notes(current_user):
-    user_notes = []
-    for note_id, note in notes.items():
-        if can_user_read(current_user, note_id):
-            user_notes.append(
-                {
-                    "id": note_id,
-                    "text": note["text"],
-                    "author": note["author"],
-                    "isPublic": note["isPublic"],
-                }
-            )
+    if session.get("_flashes"):  # Flashed messages are rendered into the page
+        return render_notes_page(current_user)
+    # Read the version first: a write during rendering then invalidates the page
+    version = notes.listing_version(current_user)
+    cached = notes_page_cache.get(current_user)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    page = render_notes_page(current_user)
+    notes_page_cache.set(current_user, (version, page))
+    return page
+
+
+def render_notes_page(current_user):
+    user_notes = [
+        {
+            "id": note_id,
+            "preview": note_preview(note_id, note),
+            "isPublic": note.is_public,
+        }
+        for note_id, note in notes.visible(current_user)
+    ]
     return render_template("notes.html", notes=user_notes, user=current_user)
 
 
 # Create Note
-@app.route("/notes/create", methods=["GET", "POST"])
+@views.route("/notes/create", methods=["GET", "POST"])
 @login_required
 def create_note_route(current_user):
+    from forms import NoteForm
+
     form = NoteForm()
     if form.validate_on_submit():
         note_id = form.note_id.data
         text = form.text.data
         is_public = form.is_public.data
+        expires_at, _ = parse_expires_in(form.expires_in.data)  # Validated above
+
+        sanitized_text, source = sanitize_note_text(text)
 
-        if note_id in notes:
+        if not notes.insert_if_absent(
+            note_id, sanitized_text, current_user, is_public, source, expires_at
+        ):
             flash("Note ID already exists.", "danger")
             return render_template("create_note.html", form=form)
 
-        sanitized_text = sanitize_input(text)
-
-        notes[note_id] = {
-            "text": sanitized_text,
-            "author": current_user,
-            "isPublic": is_public,
-        }
-
-        logger.info(f"User '{current_user}' created note '{note_id}'")
+        logger.info(
+            "User '%s' created note '%s'",
+            current_user,
+            note_id,
+            extra={"event": "note.create", "user": current_user, "note_id": note_id},
+        )
 
         flash("Note created successfully!", "success")
         return redirect(url_for("list_notes"))
@@ -299,7 +1005,7 @@ def create_note_route(current_user):
 
 
 # View Note
-@app.route("/notes/<note_id>")
+@views.route("/notes/<note_id>")
 @login_required
 def view_note_route(current_user, note_id):
     note = notes.get(note_id)
@@ -307,12 +1013,7 @@ def view_note_route(current_user, note_id):
         if can_user_read(current_user, note_id):
             return render_template(
                 "view_note.html",
-                note={
-                    "id": note_id,
-                    "text": note["text"],
-                    "author": note["author"],
-                    "isPublic": note["isPublic"],
-                },
+                note=note_as_dict(note_id, note),
             )
         else:
             flash("You are not authorized to view this note.", "danger")
@@ -323,7 +1024,7 @@ def view_note_route(current_user, note_id):
 
 
 # Edit Note
-@app.route("/notes/<note_id>/edit", methods=["GET", "POST"])
+@views.route("/notes/<note_id>/edit", methods=["GET", "POST"])
 @login_required
 def edit_note_route(current_user, note_id):
     note = notes.get(note_id)
@@ -334,28 +1035,40 @@ def edit_note_route(current_user, note_id):
         flash("You are not authorized to edit this note.", "danger")
         return redirect(url_for("list_notes"))
 
+    from forms import EditNoteForm
+
     form = EditNoteForm()
     if form.validate_on_submit():
         text = form.text.data
         is_public = form.is_public.data
 
-        sanitized_text = sanitize_input(text)
+        sanitized_text, source = sanitize_note_text(text)
 
-        notes[note_id]["text"] = sanitized_text
-        notes[note_id]["isPublic"] = is_public
+        # Only if the note is still the one checked above
+        if not notes.compare_and_set(
+            note_id, note.version, sanitized_text, is_public, source
+        ):
+            WRITE_CONFLICTS.inc("update")
+            flash("The note was changed meanwhile; please try again.", "warning")
+            return redirect(url_for("view_note_route", note_id=note_id))
 
-        logger.info(f"User '{current_user}' updated note '{note_id}'")
+        logger.info(
+            "User '%s' updated note '%s'",
+            current_user,
+            note_id,
+            extra={"event": "note.update", "user": current_user, "note_id": note_id},
+        )
 
         flash("Note updated successfully!", "success")
         return redirect(url_for("view_note_route", note_id=note_id))
     elif request.method == "GET":
-        form.text.data = note["text"]
-        form.is_public.data = note["isPublic"]
+        form.text.data = note.text
+        form.is_public.data = note.is_public
     return render_template("edit_note.html", form=form, note_id=note_id)
 
 
 # Delete Note
-@app.route("/notes/<note_id>/delete", methods=["POST"])
+@views.route("/notes/<note_id>/delete", methods=["POST"])
 @login_required
 def delete_note_route(current_user, note_id):
     note = notes.get(note_id)
@@ -366,9 +1079,17 @@ def delete_note_route(current_user, note_id):
         flash("You are not authorized to delete this note.", "danger")
         return redirect(url_for("list_notes"))
 
-    del notes[note_id]
+    if not notes.compare_and_delete(note_id, note.version):
+        WRITE_CONFLICTS.inc("delete")
+        flash("The note was changed meanwhile; please try again.", "warning")
+        return redirect(url_for("list_notes"))
 
-    logger.info(f"User '{current_user}' deleted note '{note_id}'")
+    logger.info(
+        "User '%s' deleted note '%s'",
+        current_user,
+        note_id,
+        extra={"event": "note.delete", "user": current_user, "note_id": note_id},
+    )
 
     flash("Note deleted successfully!", "success")
     return redirect(url_for("list_notes"))
@@ -380,32 +1101,39 @@ def delete_note_route(current_user, note_id):
 
 
 # Create Note via API
-@app.route("/api/notes", methods=["POST"])
+@views.route("/api/notes", methods=["POST"])
 @token_required
 def api_create_note(current_user):
     data = request.get_json()
-    if not data:
+    if not data or not isinstance(data, dict):
         return Response("Invalid JSON data", status=400)
 
     note_id = data.get("id")
     text = data.get("text")
     is_public = data.get("isPublic", False)
 
-    if not note_id or not text:
+    if not note_id or not isinstance(note_id, str) or not text:
         return Response("Missing 'id' or 'text' fields", status=400)
+    if not isinstance(text, str):
+        return Response("Invalid 'text' field", status=400)
 
-    if note_id in notes:
-        return Response("Note ID already exists", status=409)
+    expires_at, error = parse_expires_in(data.get("expiresIn"))
+    if error is not None:
+        return Response(error, status=400)
 
-    sanitized_text = sanitize_input(text)
+    sanitized_text, source = sanitize_note_text(text)
 
-    notes[note_id] = {
-        "text": sanitized_text,
-        "author": current_user,
-        "isPublic": is_public,
-    }
+    if not notes.insert_if_absent(
+        note_id, sanitized_text, current_user, is_public, source, expires_at
+    ):
+        return Response("Note ID already exists", status=409)
 
-    logger.info(f"User '{current_user}' created note '{note_id}' via API")
+    logger.info(
+        "User '%s' created note '%s' via API",
+        current_user,
+        note_id,
+        extra={"event": "note.create", "user": current_user, "note_id": note_id},
+    )
 
     return Response(
         json.dumps({"id": note_id}), status=201, mimetype="application/json"
@@ -413,34 +1141,109 @@ def api_create_note(current_user):
 
 
 # Read Note via API
-@app.route("/api/notes/<note_id>", methods=["GET"])
+@views.route("/api/notes/<note_id>", methods=["GET"])
 @token_required
 def api_read_note(current_user, note_id):
     note = notes.get(note_id)
     if note:
         if can_user_read(current_user, note_id):
-            resp = {
-                "id": note_id,
-                "text": note["text"],
-                "author": note["author"],
-                "isPublic": note["isPublic"],
-            }
-            logger.info(f"User '{current_user}' read note '{note_id}' via API")
-            return Response(json.dumps(resp), status=200, mimetype="application/json")
+            etag = f"{notes.epoch}.{note.version}"
+            cached = not_modified(etag)
+            if cached:
+                return cached
+            logger.info(
+                "User '%s' read note '%s' via API",
+                current_user,
+                note_id,
+                extra={"event": "note.read", "user": current_user, "note_id": note_id},
+            )
+            response = Response(
+                note_json(note_id, note), status=200, mimetype="application/json"
+            )
+            response.set_etag(etag)
+            return response
         else:
             logger.warning(
-                f"User '{current_user}' unauthorized to read note '{note_id}' via API"
+                "User '%s' unauthorized to read note '%s' via API",
+                current_user,
+                note_id,
+                extra={
+                    "event": "note.forbidden",
+                    "user": current_user,
+                    "note_id": note_id,
+                },
             )
             return Response("Forbidden", status=403)
     else:
         logger.info(
-            f"User '{current_user}' attempted to read non-existent note '{note_id}' via API"
+            "User '%s' attempted to read non-existent note '%s' via API",
+            current_user,
+            note_id,
+            extra={"event": "note.not_found", "user": current_user, "note_id": note_id},
         )
         return Response("Not Found", status=404)
 
 
+def raw_note_response(note_id, note):
+    """Return a note's text as text/plain, honouring Range and If-None-Match.
+
+    The UTF-8 body is encoded once per note version, so tailing or resuming
+    a large paste with Range requests only slices cached bytes. HEAD
+    requests get the same headers without the body.
+    """
+    key = (note_id, note.version)
+    body = raw_cache.get(key)
+    if body is None:
+        body = note.text.encode("utf-8")
+        raw_cache.set(key, body)
+    response = Response(body, status=200, mimetype="text/plain")
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    response.accept_ranges = "bytes"  # Werkzeug only adds it to 206 responses
+    # Not the JSON representation's ETag: a cache (or If-None-Match) must
+    # never take one representation for the other
+    response.set_etag(f"{notes.epoch}.{note.version}.raw")
+    # Answers 304, 206 or 416 as the conditional and Range headers require
+    return response.make_conditional(
+        request, accept_ranges=True, complete_length=len(body)
+    )
+
+
+# Read Raw Note via API
+@views.route("/api/notes/<note_id>/raw", methods=["GET"])
+@token_required
+def api_read_raw_note(current_user, note_id):
+    note = notes.get(note_id)
+    if not note:
+        return Response("Not Found", status=404)
+    if not can_user_read(current_user, note_id):
+        return Response("Forbidden", status=403)
+
+    logger.info(
+        "User '%s' read raw note '%s' via API",
+        current_user,
+        note_id,
+        extra={"event": "note.read", "user": current_user, "note_id": note_id},
+    )
+    return raw_note_response(note_id, note)
+
+
+# Read Raw Public Note, without a token
+@views.route("/api/public/notes/<note_id>/raw", methods=["GET"])
+def api_read_raw_public_note(note_id):
+    note = notes.get(note_id)
+    if not note or not note.is_public:  # Private notes are not disclosed
+        return Response("Not Found", status=404)
+
+    logger.info(
+        "Read public raw note '%s' via API",
+        note_id,
+        extra={"event": "note.read", "note_id": note_id},
+    )
+    return raw_note_response(note_id, note)
+
+
 # Update Note via API
-@app.route("/api/notes/<note_id>", methods=["PUT"])
+@views.route("/api/notes/<note_id>", methods=["PUT"])
 @token_required
 def api_update_note(current_user, note_id):
     note = notes.get(note_id)
@@ -450,7 +1253,7 @@ def api_update_note(current_user, note_id):
         return Response("Forbidden", status=403)
 
     data = request.get_json()
-    if not data:
+    if not data or not isinstance(data, dict):
         return Response("Invalid JSON data", status=400)
 
     text = data.get("text")
@@ -458,13 +1261,24 @@ def api_update_note(current_user, note_id):
 
     if text is None or is_public is None:
         return Response("Missing 'text' or 'isPublic' fields", status=400)
-
-    sanitized_text = sanitize_input(text)
-
-    notes[note_id]["text"] = sanitized_text
-    notes[note_id]["isPublic"] = is_public
-
-    logger.info(f"User '{current_user}' updated note '{note_id}' via API")
+    if not isinstance(text, str):
+        return Response("Invalid 'text' field", status=400)
+
+    sanitized_text, source = sanitize_note_text(text)
+
+    # Only if the note is still the one checked above
+    if not notes.compare_and_set(
+        note_id, note.version, sanitized_text, is_public, source
+    ):
+        WRITE_CONFLICTS.inc("update")
+        return Response("Note was modified concurrently", status=409)
+
+    logger.info(
+        "User '%s' updated note '%s' via API",
+        current_user,
+        note_id,
+        extra={"event": "note.update", "user": current_user, "note_id": note_id},
+    )
 
     return Response(
         json.dumps({"id": note_id}), status=200, mimetype="application/json"
@@ -472,7 +1286,7 @@ def api_update_note(current_user, note_id):
 
 
 # Delete Note via API
-@app.route("/api/notes/<note_id>", methods=["DELETE"])
+@views.route("/api/notes/<note_id>", methods=["DELETE"])
 @token_required
 def api_delete_note(current_user, note_id):
     note = notes.get(note_id)
@@ -481,52 +1295,401 @@ def api_delete_note(current_user, note_id):
     if not can_user_modify(current_user, note_id):
         return Response("Forbidden", status=403)
 
-    del notes[note_id]
+    if not notes.compare_and_delete(note_id, note.version):
+        WRITE_CONFLICTS.inc("delete")
+        return Response("Note was modified concurrently", status=409)
 
-    logger.info(f"User '{current_user}' deleted note '{note_id}' via API")
+    logger.info(
+        "User '%s' deleted note '%s' via API",
+        current_user,
+        note_id,
+        extra={"event": "note.delete", "user": current_user, "note_id": note_id},
+    )
 
     return Response(
         json.dumps({"id": note_id}), status=200, mimetype="application/json"
     )
 
 
+def prepare_batch_operation(op):
+    """Validate and sanitize one batch operation before the store is locked.
+
+    Returns ``(kind, note_id, fields, error)`` where ``error`` is a result dict
+    for an invalid operation, or None.
+    """
+    if not isinstance(op, dict):
+        return None, None, None, {"status": 400, "error": "Invalid operation"}
+    kind = op.get("op")
+    note_id = op.get("id")
+    if kind not in ("create", "read", "update", "delete"):
+        return kind, note_id, None, {"status": 400, "error": "Invalid 'op' field"}
+    if not note_id or not isinstance(note_id, str):
+        return kind, note_id, None, {"status": 400, "error": "Missing 'id' field"}
+
+    fields = {}
+    if kind == "create":
+        text = op.get("text")
+        if not text:
+            return kind, note_id, None, {"status": 400, "error": "Missing 'text' field"}
+        if not isinstance(text, str):
+            return kind, note_id, None, {"status": 400, "error": "Invalid 'text' field"}
+        expires_at, error = parse_expires_in(op.get("expiresIn"))
+        if error is not None:
+            return kind, note_id, None, {"status": 400, "error": error}
+        text, source = sanitize_note_text(text)
+        fields = {
+            "text": text,
+            "source": source,
+            "isPublic": op.get("isPublic", False),
+            "expiresAt": expires_at,
+        }
+    elif kind == "update":
+        text = op.get("text")
+        is_public = op.get("isPublic")
+        if text is None or is_public is None:
+            error = "Missing 'text' or 'isPublic' fields"
+            return kind, note_id, None, {"status": 400, "error": error}
+        if not isinstance(text, str):
+            return kind, note_id, None, {"status": 400, "error": "Invalid 'text' field"}
+        text, source = sanitize_note_text(text)
+        fields = {"text": text, "source": source, "isPublic": is_public}
+    return kind, note_id, fields, None
+
+
+def apply_batch_operation(current_user, kind, note_id, fields):
+    """Apply one prepared batch operation; the caller holds the store lock."""
+    if kind == "create":
+        if not notes.insert_if_absent(
+            note_id,
+            fields["text"],
+            current_user,
+            fields["isPublic"],
+            fields["source"],
+            fields["expiresAt"],
+        ):
+            return {"status": 409, "error": "Note ID already exists"}
+        return {"status": 201}
+
+    note = notes.get(note_id)
+    if not note:
+        return {"status": 404, "error": "Not Found"}
+    if kind == "read":
+        if not can_user_read(current_user, note_id):
+            return {"status": 403, "error": "Forbidden"}
+        return {"status": 200, "note": note_as_dict(note_id, note)}
+    if not can_user_modify(current_user, note_id):
+        return {"status": 403, "error": "Forbidden"}
+    if kind == "update":
+        done = notes.compare_and_set(
+            note_id, note.version, fields["text"], fields["isPublic"], fields["source"]
+        )
+    else:
+        done = notes.compare_and_delete(note_id, note.version)
+    if not done:
+        WRITE_CONFLICTS.inc(kind)
+        return {"status": 409, "error": "Note was modified concurrently"}
+    return {"status": 200}
+
+
+# Batch Note Operations via API
+@views.route("/api/notes/batch", methods=["POST"])
+@token_required
+def api_batch_notes(current_user):
+    data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get("operations"), list):
+        return Response("Missing 'operations' list", status=400)
+
+    operations = data["operations"]
+    if len(operations) > current_app.config["API_BATCH_MAX_SIZE"]:
+        return Response(
+            f"Batch exceeds {current_app.config['API_BATCH_MAX_SIZE']} operations",
+            status=413,
+        )
+
+    # Sanitize everything up front so the store lock is held only for the
+    # checks and writes, and is taken once for the whole batch
+    prepared = [prepare_batch_operation(op) for op in operations]
+    results = []
+    with notes.transaction():
+        for kind, note_id, fields, error in prepared:
+            result = error or apply_batch_operation(current_user, kind, note_id, fields)
+            results.append({"op": kind, "id": note_id, **result})
+
+    logger.info(
+        "User '%s' ran a batch of %d operations via API",
+        current_user,
+        len(results),
+        extra={"event": "note.batch", "user": current_user, "size": len(results)},
+    )
+
+    return Response(
+        json.dumps({"results": results}), status=200, mimetype="application/json"
+    )
+
+
+def export_lines(user):
+    """Yield ``user``'s own notes as NDJSON lines.
+
+    The note IDs are taken once, sorted, and walked in one pass: paging
+    through them with ``author_ids`` would copy all of the author's IDs for
+    every page, which made large exports quadratic.
+    """
+    for note_id in notes.author_ids(user):
+        note = notes.get(note_id)
+        if note is not None:  # Skip notes deleted since the IDs were taken
+            yield note_json(note_id, note) + b"\n"
+
+
+def read_ndjson(stream, max_line):
+    """Yield ``(line number, value, error)`` for each line of an NDJSON body.
+
+    The body is read one line at a time, however large it is. ``error`` is a
+    result dict for a line that is too long or not valid JSON, and None
+    otherwise. Blank lines are skipped.
+    """
+    reader = io.BufferedReader(stream, IMPORT_READ_BUFFER)
+    number = 0
+    while True:
+        line = reader.readline(max_line + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > max_line and not line.endswith(b"\n"):
+            while line and not line.endswith(b"\n"):  # Skip the rest of it
+                line = reader.readline(IMPORT_READ_BUFFER)
+            error = f"Line exceeds {max_line} bytes"
+            yield number, None, {"status": 413, "error": error}
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line), None
+        except ValueError:
+            yield number, None, {"status": 400, "error": "Invalid JSON"}
+
+
+def import_operation(note):
+    """Turn an exported note into a batch create operation.
+
+    An exported ``expiresAt`` becomes the ``expiresIn`` left until then; a
+    note that has already expired fails validation.
+    """
+    op = {**note, "op": "create"}
+    expires_at = op.pop("expiresAt", None)
+    if isinstance(expires_at, (int, float)) and not isinstance(expires_at, bool):
+        op["expiresIn"] = math.ceil(expires_at - time.time())
+    elif expires_at is not None:
+        op["expiresIn"] = expires_at  # Rejected as invalid
+    return op
+
+
+# Export Notes via API
+@views.route("/api/notes/export", methods=["GET"])
+@token_required
+def api_export_notes(current_user):
+    logger.info(
+        "User '%s' exported their notes via API",
+        current_user,
+        extra={"event": "note.export", "user": current_user},
+    )
+    return Response(
+        export_lines(current_user),
+        status=200,
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="notes.ndjson"'},
+    )
+
+
+# Import Notes via API
+@views.route("/api/notes/import", methods=["POST"])
+@token_required
+def api_import_notes(current_user):
+    chunk_size = current_app.config["API_IMPORT_CHUNK_SIZE"]
+    imported = failed = 0
+    errors = []
+
+    def fail(number, note_id, result):
+        nonlocal failed
+        failed += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({"line": number, "id": note_id, **result})
+
+    def insert(chunk):
+        # Sanitized before the store lock is taken, as in api_batch_notes
+        nonlocal imported
+        with notes.transaction():
+            results = [
+                (number, note_id, apply_batch_operation(current_user, *op))
+                for number, note_id, op in chunk
+            ]
+        for number, note_id, result in results:
+            if result["status"] == 201:
+                imported += 1
+            else:
+                fail(number, note_id, result)
+
+    chunk = []
+    lines = read_ndjson(request.stream, current_app.config["API_IMPORT_MAX_LINE"])
+    for number, value, error in lines:
+        note_id = None
+        if error is None:
+            # Each line is a note as exported; it is imported as the caller's
+            if isinstance(value, dict):
+                value = import_operation(value)
+            kind, note_id, fields, error = prepare_batch_operation(value)
+        if error is not None:
+            fail(number, note_id, error)
+            continue
+        chunk.append((number, note_id, (kind, note_id, fields)))
+        if len(chunk) >= chunk_size:
+            insert(chunk)
+            chunk = []
+    if chunk:
+        insert(chunk)
+    errors.sort(key=lambda error: error["line"])  # Conflicts surface per chunk
+
+    logger.info(
+        "User '%s' imported %d notes via API (%d failed)",
+        current_user,
+        imported,
+        failed,
+        extra={
+            "event": "note.import",
+            "user": current_user,
+            "imported": imported,
+            "failed": failed,
+        },
+    )
+
+    return Response(
+        json.dumps({"imported": imported, "failed": failed, "errors": errors}),
+        status=200,
+        mimetype="application/json",
+    )
+
+
+# Search Notes via API
+@views.route("/api/notes/search", methods=["GET"])
+@token_required
+def api_search_notes(current_user):
+    query = request.args.get("q", "").strip()
+    if not query:
+        return Response("Missing 'q' parameter", status=400)
+    try:
+        limit = int(request.args.get("limit", 20))
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return Response("Invalid 'limit' or 'offset' parameter", status=400)
+    if limit < 1 or offset < 0:
+        return Response("Invalid 'limit' or 'offset' parameter", status=400)
+    limit = min(limit, current_app.config["API_NOTES_MAX_LIMIT"])
+
+    total, hits = search_index.search(query, current_user, offset, limit)
+    results = []
+    for note_id, score in hits:
+        note = notes.get(note_id)
+        if note and can_user_read(current_user, note_id):
+            results.append({**note_as_dict(note_id, note), "score": round(score, 4)})
+
+    return Response(
+        json.dumps({"total": total, "results": results}),
+        status=200,
+        mimetype="application/json",
+    )
+
+
 # List Public Notes via API
-@app.route("/api/notes", methods=["GET"])
+@views.route("/api/notes", methods=["GET"])
 @token_required
 def api_list_notes(current_user):
-    public_notes = [
-        {
-            "id": nid,
-            "text": note["text"],
-            "author": note["author"],
-            "isPublic": note["isPublic"],
-        }
-        for nid, note in notes.items()
-        if note["isPublic"] or note["author"] == current_user
-    ]
-    return Response(json.dumps(public_notes), status=200, mimetype="application/json")
+    # Optional keyset pagination: ?limit=N&cursor=<X-Next-Cursor from last page>
+    limit = request.args.get("limit")
+    cursor = request.args.get("cursor")
+    stream = request.args.get("stream", "").lower() in ("1", "true")
+
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return Response("Invalid 'limit' parameter", status=400)
+        if limit < 1:
+            return Response("Invalid 'limit' parameter", status=400)
+        limit = min(limit, current_app.config["API_NOTES_MAX_LIMIT"])
+
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            return Response("Invalid 'cursor' parameter", status=400)
+
+    # Taken before reading the notes, so a concurrent write can only make
+    # the ETag older than the body, never newer
+    etag = f"{notes.listing_version(current_user)}.{limit or ''}.{cursor or ''}"
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    # Fetch one extra ID to know whether another page follows
+    note_ids = notes.visible_ids(
+        current_user, after, limit + 1 if limit is not None else None
+    )
+    headers = {"ETag": f'"{etag}"'}
+    if limit is not None and len(note_ids) > limit:
+        note_ids = note_ids[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(note_ids[-1])
+
+    def visible_notes():
+        for nid in note_ids:
+            note = notes.get(nid)
+            # Skip notes deleted, or made private, since the IDs were taken
+            if note is not None and (note.is_public or note.author == current_user):
+                yield note_json(nid, note)
+
+    if stream:
+        return Response(
+            stream_json_array(visible_notes()),
+            status=200,
+            mimetype="application/json",
+            headers=headers,
+        )
+    return Response(
+        b"[" + b", ".join(visible_notes()) + b"]",
+        status=200,
+        mimetype="application/json",
+        headers=headers,
+    )
 
 
 # User Registration via API
-@app.route("/api/register", methods=["POST"])
+@views.route("/api/register", methods=["POST"])
 def api_register():
     data = request.get_json()
-    if not data:
+    if not data or not isinstance(data, dict):
         return Response("Invalid JSON data", status=400)
 
-    user_id = sanitize_input(data.get("user_id"))
+    user_id = data.get("user_id")
     password = data.get("password")
+    # Hashing (and sanitizing) other JSON types would fail with a 500
+    if not isinstance(user_id, str) or not isinstance(password, str):
+        return Response("Missing 'user_id' or 'password'", status=400)
+    user_id = sanitize_input(user_id)
 
     if not user_id or not password:
         return Response("Missing 'user_id' or 'password'", status=400)
 
-    if user_id in users:
+    if user_id in users:  # Checked again on insert; this skips the hashing
         return Response("User ID already exists", status=409)
 
     api_key = generate_api_key()
-    users[user_id] = {"password": password, "api_key": api_key}  # Hash in production
+    if not users.insert_if_absent(user_id, password_hasher.hash(password), api_key):
+        return Response("User ID already exists", status=409)
 
-    logger.info(f"Registered new user '{user_id}' via API")
+    logger.info(
+        "Registered new user '%s' via API",
+        user_id,
+        extra={"event": "user.register", "user": user_id},
+    )
 
     return Response(
         json.dumps({"api_key": api_key}), status=201, mimetype="application/json"
@@ -534,23 +1697,31 @@ def api_register():
 
 
 # User Login via API
-@app.route("/api/login", methods=["POST"])
+@views.route("/api/login", methods=["POST"])
 def api_login():
     data = request.get_json()
-    if not data:
+    if not data or not isinstance(data, dict):
         return Response("Invalid JSON data", status=400)
 
-    user_id = sanitize_input(data.get("user_id"))
+    user_id = data.get("user_id")
     password = data.get("password")
+    # Hashing (and sanitizing) other JSON types would fail with a 500
+    if not isinstance(user_id, str) or not isinstance(password, str):
+        return Response("Missing 'user_id' or 'password'", status=400)
+    user_id = sanitize_input(user_id)
 
     if not user_id or not password:
         return Response("Missing 'user_id' or 'password'", status=400)
 
-    user = users.get(user_id)
-    if user and user["password"] == password:
+    user = authenticate(user_id, password)
+    if user is not None:
         token = generate_jwt_token(user_id)
         if token:
-            logger.info(f"User '{user_id}' logged in via API")
+            logger.info(
+                "User '%s' logged in via API",
+                user_id,
+                extra={"event": "user.login", "user": user_id},
+            )
             return Response(
                 json.dumps({"token": token}), status=200, mimetype="application/json"
             )
@@ -561,7 +1732,7 @@ def api_login():
 
 
 # Get User Info via API
-@app.route("/api/users/<user_id>", methods=["GET"])
+@views.route("/api/users/<user_id>", methods=["GET"])
 @token_required
 def api_get_user(current_user, user_id):
     if current_user != user_id:
@@ -571,7 +1742,7 @@ def api_get_user(current_user, user_id):
     if user:
         safe_user_data = {
             "user_id": user_id,
-            # "api_key": user["api_key"],
+            # "api_key": user.api_key,
         }
         return Response(
             json.dumps(safe_user_data), status=200, mimetype="application/json"
@@ -581,8 +1752,81 @@ def api_get_user(current_user, user_id):
 
 
 # ----------------------------
-# Run the Application
+# App Factory
 # ----------------------------
 
+
+def create_app(config=None):
+    """Create the pastebin app.
+
+    ``config`` overrides the settings from ``default_config``. The first call
+    in a process also configures logging and opens the stores, which later
+    apps share. For gunicorn, ``create_app()`` is the entry point; with
+    ``preload_app`` it runs once in the master and forked workers inherit
+    the loaded stores (see gunicorn.conf.py).
+    """
+    global SECRET_KEY
+    settings = {**default_config(), **(config or {})}
+    if log_handler is None:
+        init_logging(settings["LOG_LEVEL"], settings["LOG_SAMPLE_RATES"])
+    if not os.environ.get("SECRET_KEY") and "SECRET_KEY" not in (config or {}):
+        logger.warning(
+            "No SECRET_KEY set for Flask application; using a temporary key. "
+            "Set the SECRET_KEY environment variable for production."
+        )
+    SECRET_KEY = settings["SECRET_KEY"]  # API tokens are signed with it
+    init_stores(settings)
+
+    app = Flask(__name__)
+    app.config.update(settings)
+    views.init_app(app)
+    return app
+
+
+def warm_up(app):
+    """Load what ``app`` would otherwise load on its first requests.
+
+    Run it in a preloading master before the workers fork: they then share
+    the lazily imported modules and the compiled templates instead of each
+    building its own.
+    """
+    import forms  # noqa: F401
+
+    get_sanitizer()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def _after_fork_in_child():
+    """Restart the background threads a forked worker did not inherit."""
+    if _log_settings is not None:
+        init_logging(*_log_settings)
+    password_hasher.after_fork()
+    if "notes" in globals():
+        notes.after_fork()
+        users.after_fork()
+        expiry_sweeper.after_fork()
+        journal = getattr(notes, "journal", None)
+        if journal is not None:
+            journal.after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def __getattr__(name):
+    """Create ``app`` (and the stores and sanitizer) when first accessed."""
+    global app
+    if name == "app":
+        app = create_app()
+        return app
+    if name in ("notes", "users", "search_index"):
+        init_stores(default_config())
+        return globals()[name]
+    if name == "sanitizer":
+        return get_sanitizer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,97 @@
+"""Admission control: token-bucket rate limits and a concurrency cap.
+
+Both answer immediately instead of queueing, so an overloaded process can
+shed load with a cheap 429 or 503 rather than letting latency grow.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """Token buckets, one per key, that refill at a steady rate.
+
+    A bucket holds up to ``burst`` tokens and gains ``rate`` tokens per
+    second; each admitted request spends one. At most ``maxsize`` buckets are
+    kept, least recently used first out: a dropped bucket comes back full,
+    which only ever errs on the side of admitting.
+    """
+
+    def __init__(self, maxsize=100_000, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._buckets = OrderedDict()  # key -> [tokens, last refill time]
+        self._lock = threading.Lock()
+
+    def acquire(self, key, rate, burst):
+        """Spend a token from ``key``'s bucket.
+
+        Returns 0 if the request is admitted, otherwise the number of seconds
+        until a token will be available.
+        """
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+                if len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ConcurrencyLimiter:
+    """A non-blocking cap on the number of requests handled at once."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.limit > 0 and self.active >= self.limit:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+def retry_after(seconds):
+    """Format a wait in seconds as a Retry-After header value."""
+    return str(max(1, math.ceil(seconds)))
+
+
+def parse_rate_limits(spec):
+    """Parse ``"endpoint=requests/seconds,..."`` into ``{endpoint: (rate, burst)}``.
+
+    ``api_login=10/60`` allows bursts of 10 requests, refilled at 10 per
+    minute.
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        endpoint, _, limit = item.partition("=")
+        requests, _, seconds = limit.partition("/")
+        burst = int(requests)
+        limits[endpoint.strip()] = (burst / float(seconds or 1), burst)
+    return limits
@@ -0,0 +1,148 @@
+"""In-process full-text search over notes.
+
+``SearchIndex`` is an inverted index (term -> note id -> term frequency) kept
+up to date incrementally: subscribe ``index.update`` to a note store and
+every write re-indexes just the note it touched. Queries match notes that
+contain every query term and rank them with BM25.
+
+``rank`` scores candidate notes found elsewhere (the SQLite store's FTS5
+index) with the same BM25, so search results agree across backends.
+"""
+
+import heapq
+import html
+import math
+import re
+import threading
+from collections import Counter
+
+_TAGS = re.compile(r"<[^>]*>")
+_TERMS = re.compile(r"\w+")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    """Split note text (sanitized HTML) into lowercase search terms."""
+    return _TERMS.findall(html.unescape(_TAGS.sub(" ", text)).lower())
+
+
+def rank(docs, doc_freqs, doc_count, avg_length, offset=0, limit=20):
+    """Rank the notes matching a query; return ``(total, [(note_id, score)])``.
+
+    ``docs`` yields ``(note_id, length, term_freqs)`` for every readable note
+    that contains all the query terms, where ``term_freqs`` counts each query
+    term in the note. ``doc_freqs`` has, for each query term, how many
+    indexed notes contain it, and ``doc_count``/``avg_length`` describe the
+    whole index. Results are ordered like ``SearchIndex.search``.
+    """
+    idf = [math.log(1 + (doc_count - n + 0.5) / (n + 0.5)) for n in doc_freqs]
+    scored = []
+    for note_id, length, term_freqs in docs:
+        norm = K1 * (1 - B + B * length / avg_length)
+        score = 0.0
+        for term_idf, tf in zip(idf, term_freqs):
+            score += term_idf * tf * (K1 + 1) / (tf + norm)
+        scored.append((score, note_id))
+    top = heapq.nsmallest(offset + limit, scored, key=lambda s: (-s[0], s[1]))
+    return len(scored), [(note_id, score) for score, note_id in top[offset:]]
+
+
+class SearchIndex:
+    def __init__(self):
+        self._postings = {}  # term -> {note_id: term frequency}
+        self._docs = {}  # note_id -> (terms, length, author, is_public)
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def update(self, note_id, note):
+        """Index a written note; ``note`` is None for deletes.
+
+        Matches the ``NoteStore.subscribe`` listener signature, so
+        ``update(None, None)`` (a cleared store) empties the index.
+        """
+        # Tokenized before taking the lock, so writes to different notes
+        # only serialize on the index update
+        terms = Counter(tokenize(note.text)) if note is not None else None
+        with self._lock:
+            if note_id is None:
+                self._postings.clear()
+                self._docs.clear()
+                self._total_length = 0
+                return
+            self._remove(note_id)
+            if note is None:
+                return
+            length = sum(terms.values())
+            self._docs[note_id] = (
+                tuple(terms),
+                length,
+                note.author,
+                bool(note.is_public),
+            )
+            self._total_length += length
+            for term, count in terms.items():
+                self._postings.setdefault(term, {})[note_id] = count
+
+    def _remove(self, note_id):
+        doc = self._docs.pop(note_id, None)
+        if doc is None:
+            return
+        terms, length, _, _ = doc
+        self._total_length -= length
+        for term in terms:
+            posting = self._postings[term]
+            del posting[note_id]
+            if not posting:
+                del self._postings[term]
+
+    def rebuild(self, items):
+        """Index every ``(note_id, note)`` pair from scratch."""
+        with self._lock:
+            self.update(None, None)
+            for note_id, note in items:
+                self.update(note_id, note)
+
+    def search(self, query, user, offset=0, limit=20):
+        """Return ``(total, [(note_id, score), ...])`` for a query.
+
+        Only notes ``user`` can read (public or their own) are considered.
+        Results are ordered by descending score, then note id.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return 0, []
+        with self._lock:
+            postings = [self._postings.get(term) for term in terms]
+            if not all(postings):
+                return 0, []
+            postings.sort(key=len)  # Intersect starting from the rarest term
+            doc_count = len(self._docs)
+            avg_length = self._total_length / doc_count
+            idf = [
+                math.log(1 + (doc_count - len(p) + 0.5) / (len(p) + 0.5))
+                for p in postings
+            ]
+
+            scored = []
+            for note_id, first_tf in postings[0].items():
+                _, length, author, is_public = self._docs[note_id]
+                if not (is_public or author == user):
+                    continue
+                score = 0.0
+                for i, posting in enumerate(postings):
+                    tf = first_tf if i == 0 else posting.get(note_id)
+                    if tf is None:
+                        break
+                    norm = K1 * (1 - B + B * length / avg_length)
+                    score += idf[i] * tf * (K1 + 1) / (tf + norm)
+                else:
+                    scored.append((score, note_id))
+
+        top = heapq.nsmallest(offset + limit, scored, key=lambda s: (-s[0], s[1]))
+        return len(scored), [(note_id, score) for score, note_id in top[offset:]]
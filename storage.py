@@ -0,0 +1,1453 @@
+"""Storage backends for notes and users.
+
+The routes in ``pastebin.py`` only talk to the ``NoteStore`` and ``UserStore``
+interfaces defined here. Two implementations are provided:
+
+* ``MemoryNoteStore`` / ``MemoryUserStore`` keep everything in process memory
+  (the default, and what the tests use).
+* ``SQLiteNoteStore`` / ``SQLiteUserStore`` keep everything in a SQLite
+  database in WAL mode, so several worker processes can share one consistent
+  store without an external database server.
+
+The memory stores can also be made durable with a ``journal.Journal``.
+
+Use ``open_stores`` to build a matching pair of stores from a storage URL.
+"""
+
+import contextlib
+import hashlib
+import heapq
+import itertools
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+
+from cache import LRUCache
+from journal import Journal
+from search import rank, tokenize
+
+# ----------------------------
+# Records
+# ----------------------------
+
+
+class Note:
+    """A stored note.
+
+    Slotted rather than a dict: with millions of notes in memory the per-note
+    overhead matters. Notes are immutable by convention; stores replace the
+    record on every write instead of mutating it.
+
+    ``expires_at`` is the Unix time the note expires at, or None.
+    """
+
+    __slots__ = ("text", "author", "is_public", "version", "expires_at")
+
+    def __init__(self, text, author, is_public, version, expires_at=None):
+        self.text = text
+        self.author = author
+        self.is_public = is_public
+        self.version = version
+        self.expires_at = expires_at
+
+    def expired(self, now):
+        return self.expires_at is not None and self.expires_at <= now
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}(author={self.author!r},"
+            f" is_public={self.is_public!r}, version={self.version!r})"
+        )
+
+
+class User:
+    """A registered user."""
+
+    __slots__ = ("password", "api_key")
+
+    def __init__(self, password, api_key):
+        self.password = password
+        self.api_key = api_key
+
+
+# ----------------------------
+# Interfaces
+# ----------------------------
+
+
+class Store:
+    """Write notifications shared by the note and user stores."""
+
+    _listeners = ()
+
+    def subscribe(self, listener):
+        """Call ``listener(key, record)`` after every write.
+
+        ``record`` is the record as written, or None when it was deleted.
+        Clearing the store calls ``listener(None, None)``.
+        """
+        self._listeners = (*self._listeners, listener)
+
+    def _notify(self, key, record):
+        for listener in self._listeners:
+            listener(key, record)
+
+    def after_fork(self):
+        """Reset per-process state in a forked child process."""
+
+
+class NoteStore(Store):
+    """Interface for note storage.
+
+    Notes are returned as ``Note`` records. Callers must not mutate them; all
+    changes go through ``create``/``update``/``delete``.
+
+    Every write takes the next value of a store-wide sequence: it becomes the
+    note's ``version`` and the version of every listing view the write
+    touches. Together with the store's random ``epoch`` these make ETags that
+    never repeat for different content.
+    """
+
+    epoch = ""
+
+    def get(self, note_id, default=None):
+        raise NotImplementedError
+
+    def create(self, note_id, text, author, is_public, source=None, expires_at=None):
+        """Store a note under ``note_id``, replacing an expired note with it.
+
+        ``source`` is an optional digest of the input ``text`` was derived
+        from, such as the text before sanitizing; see ``text_for_source``.
+        ``expires_at`` is the Unix time the note expires at, or None.
+        """
+        raise NotImplementedError
+
+    def update(self, note_id, text, is_public, source=None):
+        """Replace a note's text and visibility; its expiry is kept."""
+        raise NotImplementedError
+
+    def delete(self, note_id):
+        raise NotImplementedError
+
+    def insert_if_absent(
+        self, note_id, text, author, is_public, source=None, expires_at=None
+    ):
+        """Store a note unless one with the same id exists; return whether it did.
+
+        The check and the write are one atomic step, unlike ``note_id in
+        notes`` followed by ``create``, which lets a concurrent create slip
+        in between. An expired note counts as absent.
+        """
+        raise NotImplementedError
+
+    def compare_and_set(self, note_id, version, text, is_public, source=None):
+        """Update a note if it still has ``version``; return whether it did.
+
+        ``version`` is that of the note the caller checked (for instance that
+        the user may modify it), so the update never lands on a note deleted
+        or rewritten since the check.
+        """
+        raise NotImplementedError
+
+    def compare_and_delete(self, note_id, version):
+        """Delete a note if it still has ``version``; return whether it did."""
+        raise NotImplementedError
+
+    def text_for_source(self, source):
+        """Return the text of a stored note made from ``source``, or None.
+
+        Stores that do not track sources always return None.
+        """
+        return None
+
+    def expire(self, limit=None):
+        """Delete up to ``limit`` expired notes and return how many it deleted.
+
+        ``get`` already hides expired notes (so reads 404 as soon as a note
+        expires); this reclaims them, oldest expiry first, without scanning
+        the notes that have not expired.
+        """
+        raise NotImplementedError
+
+    def visible_ids(self, user, after=None, limit=None):
+        """Return the ids of the notes ``user`` can read, sorted by id.
+
+        ``after`` skips every id up to and including it, and ``limit`` caps
+        the number of ids returned, which gives stable keyset pagination.
+        """
+        raise NotImplementedError
+
+    def author_ids(self, author, after=None, limit=None):
+        """Return the ids of the notes written by ``author``, sorted by id.
+
+        ``after`` and ``limit`` page through them as in ``visible_ids``.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def listing_version(self, user):
+        """Return a string that changes whenever ``user``'s listing changes.
+
+        That includes a note in it expiring, before any sweep deletes it.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _expiry_mark(next_expiry, now):
+        """Return the part of a listing version that tracks expiry.
+
+        Until the next expiry passes, the mark is that expiry, so versions
+        hold steady. After it, and until the sweep deletes the note, it is
+        the current time: listings then hide the note but are not cached.
+        """
+        if next_expiry is None:
+            return ""
+        if next_expiry > now:
+            return f".{next_expiry!r}"
+        return f".due{now!r}"
+
+    def items(self):
+        """Yield ``(note_id, note)`` for every note in the store."""
+        raise NotImplementedError
+
+    def transaction(self):
+        """Return a context manager that holds the store's write lock.
+
+        Everything done inside it is applied as a unit: other writers wait
+        until it exits. Use it to take the lock once for a batch of changes.
+        """
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __contains__(self, note_id):
+        return self.get(note_id) is not None
+
+    def __getitem__(self, note_id):
+        note = self.get(note_id)
+        if note is None:
+            raise KeyError(note_id)
+        return note
+
+    def visible(self, user, after=None, limit=None):
+        """Yield ``(note_id, note)`` for every note ``user`` can read."""
+        for note_id in self.visible_ids(user, after, limit):
+            note = self.get(note_id)
+            # Deleted, or made private, while a stream was in progress
+            if note is not None and (note.is_public or note.author == user):
+                yield note_id, note
+
+
+class UserStore(Store):
+    """Interface for user storage.
+
+    Users are returned as ``User`` records.
+    """
+
+    def get(self, user_id, default=None):
+        raise NotImplementedError
+
+    def create(self, user_id, password, api_key):
+        raise NotImplementedError
+
+    def insert_if_absent(self, user_id, password, api_key):
+        """Add a user unless the id is taken; return whether it did.
+
+        The check and the write are one atomic step, as in
+        ``NoteStore.insert_if_absent``.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def items(self):
+        """Yield ``(user_id, user)`` for every user in the store."""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+
+# ----------------------------
+# In-memory backend
+# ----------------------------
+
+
+class CompressedNote(Note):
+    """A stored note whose text is kept zlib-compressed.
+
+    ``note.text`` decompresses the body on demand, through the store's cache
+    of recently read bodies. Metadata reads (author, visibility, version)
+    never decompress.
+    """
+
+    __slots__ = ("body", "raw_size", "cache_key", "cache")
+
+    def __init__(
+        self,
+        body,
+        raw_size,
+        author,
+        is_public,
+        version,
+        cache_key,
+        cache,
+        expires_at=None,
+    ):
+        self.body = body
+        self.raw_size = raw_size
+        self.author = author
+        self.is_public = is_public
+        self.version = version
+        self.cache_key = cache_key
+        self.cache = cache
+        self.expires_at = expires_at
+
+    @property
+    def text(self):
+        text = self.cache.get(self.cache_key)
+        if text is None:
+            text = zlib.decompress(self.body).decode("utf-8")
+            self.cache.set(self.cache_key, text)
+        return text
+
+
+class Blob:
+    """A note text shared by every note with that content.
+
+    ``data`` is the text, or its zlib-compressed UTF-8 bytes. ``refs``
+    counts the notes using it, and ``sources`` holds the source digests
+    recorded for it (see ``NoteStore.text_for_source``).
+    """
+
+    __slots__ = ("data", "raw_size", "refs", "sources")
+
+    def __init__(self, data, raw_size):
+        self.data = data
+        self.raw_size = raw_size
+        self.refs = 0
+        self.sources = ()
+
+    @property
+    def stored_size(self):
+        return len(self.data) if isinstance(self.data, bytes) else self.raw_size
+
+
+class LockStripes:
+    """A fixed set of reentrant locks, one picked for each key by its hash.
+
+    Writes to different keys mostly take different locks and so run
+    concurrently, while writes to the same key are serialized. ``all()``
+    takes every lock, always in the same order, for operations that span
+    keys.
+    """
+
+    def __init__(self, count=64):
+        self._locks = tuple(threading.RLock() for _ in range(count))
+
+    def __len__(self):
+        return len(self._locks)
+
+    def lock(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    @contextlib.contextmanager
+    def all(self):
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
+
+
+class MemoryNoteStore(NoteStore):
+    """In-memory note storage with secondary indexes for listing.
+
+    Besides the primary ``note_id -> note`` mapping, the store keeps an
+    ``author -> note ids`` index and the set of public note ids, so listing
+    the notes visible to a user costs O(visible notes) instead of a scan of
+    every note.
+
+    Note texts of at least ``compress_threshold`` UTF-8 bytes are kept
+    compressed (see ``CompressedNote``); the last ``body_cache_size``
+    decompressed bodies are cached for repeat reads. Author names are
+    interned, so each author's name is stored once however many notes they
+    have.
+
+    Texts of at least ``dedup_threshold`` UTF-8 bytes are stored once
+    however many notes have them: they are kept in a table of reference
+    counted ``Blob`` entries keyed on their SHA-256, and dropped with the
+    last note using them. Shorter texts are not worth a table entry.
+
+    Notes with an expiry are also pushed on a min-heap of ``(expires_at,
+    note_id)``, so ``expire`` only ever looks at notes that are due. Entries
+    for notes replaced or deleted before they expired are skipped when they
+    come up.
+
+    Writes to a note are serialized by one of ``lock_stripes`` locks, picked
+    by hashing its id; encoding, hashing and compressing the text and
+    notifying listeners happen under that lock only, so writes to different
+    notes run concurrently. The indexes, blob table and listing versions
+    shared by all notes are guarded by one more lock, held just for their
+    updates. Locks are always taken in that order. Reads take no lock.
+    """
+
+    def __init__(
+        self,
+        compress_threshold=64 * 1024,
+        body_cache_size=8,
+        dedup_threshold=512,
+        clock=time.time,
+        lock_stripes=64,
+    ):
+        self.compress_threshold = compress_threshold
+        self.dedup_threshold = dedup_threshold
+        self._clock = clock
+        self._expiry = []  # Min-heap of (expires_at, note_id)
+        self._body_cache = LRUCache(body_cache_size)
+        self._raw_bytes = 0  # UTF-8 size of every note text
+        self._unique_bytes = 0  # The same, counting shared texts once
+        self._stored_bytes = 0  # Size actually kept, after dedup and compression
+        self._compressed = 0
+        self._blobs = {}  # SHA-256 of the text -> Blob
+        self._sources = {}  # Source digest -> SHA-256 of the text
+        self._notes = {}
+        self._by_author = {}
+        self._public = set()
+        self._stripes = LockStripes(lock_stripes)
+        self._lock = threading.RLock()  # Guards everything shared by all notes
+        # Write sequence and the last write seen by each listing view
+        self._seq = itertools.count(1)
+        self._public_version = 0
+        self._author_versions = {}
+        self.epoch = os.urandom(4).hex()
+
+    def __len__(self):
+        return len(self._notes)  # Including expired notes not yet deleted
+
+    def get(self, note_id, default=None):
+        note = self._notes.get(note_id)
+        if note is None or note.expired(self._clock()):
+            return default
+        return note
+
+    def items(self):
+        with self._lock:
+            items = list(self._notes.items())
+        return iter(items)
+
+    def after_fork(self):
+        # Locks other threads held at the fork would never be released
+        self._stripes = LockStripes(len(self._stripes))
+        self._lock = threading.RLock()
+
+    def clear(self):
+        with self._stripes.all(), self._lock:
+            self._notes.clear()
+            self._body_cache.clear()
+            self._blobs.clear()
+            self._sources.clear()
+            self._expiry.clear()
+            self._raw_bytes = self._unique_bytes = self._stored_bytes = 0
+            self._compressed = 0
+            self._by_author.clear()
+            self._public.clear()
+            self._public_version = next(self._seq)
+            self._author_versions.clear()
+            self._notify(None, None)
+
+    def transaction(self):
+        return self._stripes.all()
+
+    def listing_version(self, user):
+        with self._lock:
+            next_expiry = self._expiry[0][0] if self._expiry else None
+            return (
+                f"{self.epoch}.{self._public_version}"
+                f".{self._author_versions.get(user, 0)}"
+                f"{self._expiry_mark(next_expiry, self._clock())}"
+            )
+
+    def _bump(self, author, public):
+        version = next(self._seq)
+        self._author_versions[author] = version
+        if public:
+            self._public_version = version
+        return version
+
+    def _digest(self, raw):
+        """Return the blob table key for a UTF-8 text, or None if too short."""
+        if self.dedup_threshold is None or len(raw) < self.dedup_threshold:
+            return None
+        return hashlib.sha256(raw).digest()
+
+    def _blob(self, text, raw):
+        """Build the stored form of a text, compressing large texts."""
+        if self.compress_threshold is not None and len(raw) >= self.compress_threshold:
+            body = zlib.compress(raw)
+            if len(body) <= len(raw) * 0.9:  # Else not worth the CPU on every read
+                return Blob(body, len(raw))
+        return Blob(text, len(raw))
+
+    def _prepare(self, text):
+        """Return ``(digest, blob)`` for a text about to be written.
+
+        Called before the shared lock is taken, so hashing and compressing
+        a text never hold up writes to other notes. ``blob`` is None when
+        the blob table already has the text.
+        """
+        raw = text.encode("utf-8")
+        digest = self._digest(raw)
+        if digest is not None and digest in self._blobs:
+            return digest, None
+        return digest, self._blob(text, raw)
+
+    def _text_key(self, record):
+        """Return the ``(raw size, digest)`` of a stored record's text."""
+        if isinstance(record, CompressedNote):
+            digest = record.cache_key if isinstance(record.cache_key, bytes) else None
+            return record.raw_size, digest
+        raw = record.text.encode("utf-8")
+        return len(raw), self._digest(raw)
+
+    def _record(
+        self,
+        note_id,
+        text,
+        prepared,
+        author,
+        is_public,
+        version,
+        source=None,
+        expires_at=None,
+    ):
+        """Build the stored form of a note from ``_prepare(text)``.
+
+        The caller holds the shared lock.
+        """
+        digest, blob = prepared
+        shared = self._blobs.get(digest) if digest is not None else None
+        if shared is not None:
+            blob = shared
+        else:
+            if blob is None:  # The shared text was dropped since _prepare
+                blob = self._blob(text, text.encode("utf-8"))
+            self._unique_bytes += blob.raw_size
+            self._stored_bytes += blob.stored_size
+            if digest is not None:
+                self._blobs[digest] = blob
+        blob.refs += 1
+        if digest is not None and source is not None and source not in self._sources:
+            self._sources[source] = digest
+            blob.sources += (source,)
+        self._raw_bytes += blob.raw_size
+
+        if not isinstance(blob.data, bytes):
+            return Note(blob.data, author, is_public, version, expires_at)
+        self._compressed += 1
+        return CompressedNote(
+            blob.data,
+            blob.raw_size,
+            author,
+            is_public,
+            version,
+            digest or (note_id, version),  # Shared texts share a cache entry
+            self._body_cache,
+            expires_at,
+        )
+
+    def _forget(self, record, text_key):
+        """Release a replaced or deleted record's text, given its ``_text_key``.
+
+        The caller holds the shared lock.
+        """
+        raw_size, digest = text_key
+        if isinstance(record, CompressedNote):
+            self._compressed -= 1
+        self._raw_bytes -= raw_size
+
+        blob = self._blobs.get(digest) if digest is not None else None
+        if blob is not None:
+            blob.refs -= 1
+            if blob.refs:
+                return
+            del self._blobs[digest]
+            for source in blob.sources:
+                del self._sources[source]
+            stored_size = blob.stored_size
+        elif isinstance(record, CompressedNote):
+            stored_size = len(record.body)
+        else:
+            stored_size = raw_size
+        self._unique_bytes -= raw_size
+        self._stored_bytes -= stored_size
+
+    def text_for_source(self, source):
+        with self._lock:
+            digest = self._sources.get(source)
+            if digest is None:
+                return None
+            data = self._blobs[digest].data
+        if isinstance(data, bytes):
+            text = self._body_cache.get(digest)
+            if text is None:
+                text = zlib.decompress(data).decode("utf-8")
+                self._body_cache.set(digest, text)
+            return text
+        return data
+
+    def memory_stats(self):
+        """Report how much note text is stored and what dedup and compression save.
+
+        ``dedup_ratio`` is the note text size over the size of the distinct
+        texts; ``saved_bytes`` is what dedup and compression save together.
+        """
+        with self._lock:
+            return {
+                "notes": len(self._notes),
+                "compressed_notes": self._compressed,
+                "blobs": len(self._blobs),
+                "raw_bytes": self._raw_bytes,
+                "unique_bytes": self._unique_bytes,
+                "stored_bytes": self._stored_bytes,
+                "dedup_ratio": self._raw_bytes / (self._unique_bytes or 1) or 1.0,
+                "dedup_saved_bytes": self._raw_bytes - self._unique_bytes,
+                "saved_bytes": self._raw_bytes - self._stored_bytes,
+                "body_cache": self._body_cache.stats(),
+            }
+
+    def create(self, note_id, text, author, is_public, source=None, expires_at=None):
+        with self._stripes.lock(note_id):
+            self._put(note_id, text, author, is_public, source, expires_at)
+
+    def insert_if_absent(
+        self, note_id, text, author, is_public, source=None, expires_at=None
+    ):
+        with self._stripes.lock(note_id):
+            if self.get(note_id) is not None:
+                return False
+            self._put(note_id, text, author, is_public, source, expires_at)
+            return True
+
+    def _put(self, note_id, text, author, is_public, source, expires_at):
+        """Store a note, replacing any note with its id; the caller holds its stripe."""
+        author = sys.intern(author)
+        prepared = self._prepare(text)
+        old = self._notes.get(note_id)
+        old_key = self._text_key(old) if old is not None else None
+        with self._lock:
+            record = self._notes[note_id] = self._record(
+                note_id,
+                text,
+                prepared,
+                author,
+                is_public,
+                self._bump(author, is_public),
+                source,
+                expires_at,
+            )
+            if old is not None:
+                self._forget(old, old_key)
+                self._unindex(note_id, old)
+            self._index(note_id, author, is_public, expires_at)
+        self._notify(note_id, record)
+
+    def _index(self, note_id, author, is_public, expires_at):
+        self._by_author.setdefault(author, set()).add(note_id)
+        if is_public:
+            self._public.add(note_id)
+        if expires_at is not None:
+            heapq.heappush(self._expiry, (expires_at, note_id))
+
+    def _unindex(self, note_id, note):
+        author_ids = self._by_author.get(note.author)
+        if author_ids is not None:
+            author_ids.discard(note_id)
+            if not author_ids:
+                del self._by_author[note.author]
+        self._public.discard(note_id)
+
+    def load(self, rows):
+        """Add many new notes at once, as when recovering from disk.
+
+        ``rows`` are ``(note_id, text, author, is_public[, expires_at])``
+        tuples for ids not in the store yet. Listeners are not notified.
+        """
+        intern = sys.intern
+        with self._stripes.all(), self._lock:
+            for note_id, text, author, is_public, *expiry in rows:
+                author = intern(author)
+                expires_at = expiry[0] if expiry else None
+                self._notes[note_id] = self._record(
+                    note_id,
+                    text,
+                    self._prepare(text),
+                    author,
+                    is_public,
+                    self._bump(author, is_public),
+                    expires_at=expires_at,
+                )
+                self._index(note_id, author, is_public, expires_at)
+
+    def update(self, note_id, text, is_public, source=None):
+        with self._stripes.lock(note_id):
+            self._replace(note_id, self._notes[note_id], text, is_public, source)
+
+    def compare_and_set(self, note_id, version, text, is_public, source=None):
+        with self._stripes.lock(note_id):
+            note = self.get(note_id)
+            if note is None or note.version != version:
+                return False
+            self._replace(note_id, note, text, is_public, source)
+            return True
+
+    def _replace(self, note_id, note, text, is_public, source):
+        """Rewrite a stored note; the caller holds its stripe."""
+        prepared = self._prepare(text)
+        old_key = self._text_key(note)
+        with self._lock:
+            version = self._bump(note.author, note.is_public or is_public)
+            # Recorded before the old text is released, so an unchanged
+            # text keeps its blob
+            record = self._notes[note_id] = self._record(
+                note_id,
+                text,
+                prepared,
+                note.author,
+                is_public,
+                version,
+                source,
+                note.expires_at,
+            )
+            self._forget(note, old_key)
+            if is_public:
+                self._public.add(note_id)
+            else:
+                self._public.discard(note_id)
+        self._notify(note_id, record)
+
+    def delete(self, note_id):
+        with self._stripes.lock(note_id):
+            self._remove(note_id, self._notes[note_id])
+
+    def compare_and_delete(self, note_id, version):
+        with self._stripes.lock(note_id):
+            note = self.get(note_id)
+            if note is None or note.version != version:
+                return False
+            self._remove(note_id, note)
+            return True
+
+    def _remove(self, note_id, note):
+        """Delete a stored note; the caller holds its stripe."""
+        text_key = self._text_key(note)
+        with self._lock:
+            del self._notes[note_id]
+            self._forget(note, text_key)
+            self._bump(note.author, note.is_public)
+            self._unindex(note_id, note)
+        self._notify(note_id, None)
+
+    def expire(self, limit=None):
+        now = self._clock()
+        due = []
+        with self._lock:
+            expiry = self._expiry
+            while (
+                expiry and expiry[0][0] <= now and (limit is None or len(due) < limit)
+            ):
+                due.append(heapq.heappop(expiry))
+        deleted = 0
+        for expires_at, note_id in due:
+            with self._stripes.lock(note_id):
+                note = self._notes.get(note_id)
+                # Else replaced or deleted since the entry was pushed
+                if note is not None and note.expires_at == expires_at:
+                    self._remove(note_id, note)
+                    deleted += 1
+        return deleted
+
+    def visible_ids(self, user, after=None, limit=None):
+        with self._lock:
+            own = self._by_author.get(user, ())
+            ids = self._public.union(own)
+        if after is not None:
+            ids = [note_id for note_id in ids if note_id > after]
+        if limit is None:
+            return sorted(ids)
+        # As in author_ids: a page costs O(notes) rather than a full sort
+        return heapq.nsmallest(limit, ids)
+
+    def author_ids(self, author, after=None, limit=None):
+        with self._lock:
+            own = list(self._by_author.get(author, ()))
+        if after is not None:
+            own = [note_id for note_id in own if note_id > after]
+        if limit is None:
+            return sorted(own)
+        # A page of an author's notes costs O(notes) rather than a full sort
+        return heapq.nsmallest(limit, own)
+
+
+class ExpirySweeper:
+    """Delete expired notes from a note store in the background.
+
+    Every ``interval`` seconds a daemon thread calls ``notes.expire`` in
+    batches of ``batch_size`` until nothing is due, so each pass costs
+    O(expired notes) and the store lock is released between batches.
+    Reads hide expired notes on their own; the sweep only reclaims them and
+    drops them from listings.
+    """
+
+    def __init__(self, notes, interval=1.0, batch_size=1000):
+        self.notes = notes
+        self.interval = interval
+        self.batch_size = batch_size
+        self.expired = 0  # Notes deleted since the sweeper was created
+        self._stopped = threading.Event()
+        self._starting = threading.Lock()
+        self._pid = None  # Process the sweep thread runs in
+
+    def start(self):
+        """Start the sweep thread in this process, unless it already runs.
+
+        Call it from the process that serves requests, not from one that
+        forks workers: a preloading master would sweep its own stale copy
+        of the store and append the deletions to its workers' journal.
+        """
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._starting:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped = threading.Event()
+            threading.Thread(
+                target=self._sweep_loop, name="expiry-sweep", daemon=True
+            ).start()
+
+    def after_fork(self):
+        """Reset the start lock; the sweep thread did not survive the fork.
+
+        The next ``start`` call in the child starts a new one.
+        """
+        self._starting = threading.Lock()
+
+    def stop(self):
+        self._stopped.set()
+
+    def sweep(self):
+        """Delete every expired note now and return how many were deleted."""
+        total = 0
+        while True:
+            deleted = self.notes.expire(self.batch_size)
+            total += deleted
+            if deleted < self.batch_size:
+                break
+        self.expired += total
+        return total
+
+    def _sweep_loop(self):
+        while not self._stopped.wait(self.interval):
+            self.sweep()
+
+
+class MemoryUserStore(UserStore):
+    """In-memory user storage."""
+
+    def __init__(self, lock_stripes=64):
+        self._users = {}
+        self._stripes = LockStripes(lock_stripes)
+
+    def after_fork(self):
+        self._stripes = LockStripes(len(self._stripes))
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, user_id, default=None):
+        return self._users.get(user_id, default)
+
+    def create(self, user_id, password, api_key):
+        with self._stripes.lock(user_id):
+            user = self._users[user_id] = User(password, api_key)
+            self._notify(user_id, user)
+
+    def insert_if_absent(self, user_id, password, api_key):
+        with self._stripes.lock(user_id):
+            if user_id in self._users:
+                return False
+            self.create(user_id, password, api_key)
+            return True
+
+    def clear(self):
+        with self._stripes.all():
+            self._users.clear()
+            self._notify(None, None)
+
+    def items(self):
+        return iter(list(self._users.items()))
+
+
+# ----------------------------
+# SQLite backend
+# ----------------------------
+
+
+class SQLiteDatabase:
+    """A SQLite database file shared by the SQLite note and user stores.
+
+    Each thread gets its own connection, opened on first use and reused for
+    every later query from that thread. Statements are constant SQL strings,
+    so sqlite3's per-connection statement cache keeps them prepared.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS notes (
+            id TEXT PRIMARY KEY,
+            text TEXT NOT NULL,
+            author TEXT NOT NULL,
+            is_public INTEGER NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            expires_at REAL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS notes_author ON notes (author, id)",
+        "CREATE INDEX IF NOT EXISTS notes_public ON notes (id) WHERE is_public = 1",
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            api_key TEXT NOT NULL
+        ) WITHOUT ROWID
+        """,
+        # Write sequence ("seq"), store epoch ("epoch"), the last write seen
+        # by each listing view ("public", "author:<user id>") and the size of
+        # the search index ("search_docs", "search_length")
+        """
+        CREATE TABLE IF NOT EXISTS versions (
+            name TEXT PRIMARY KEY,
+            value NOT NULL
+        ) WITHOUT ROWID
+        """,
+        # Full-text search: each note's terms (see search.tokenize) in an FTS5
+        # table, whose rowids search_docs maps to note ids
+        """
+        CREATE TABLE IF NOT EXISTS search_docs (
+            doc INTEGER PRIMARY KEY,
+            note_id TEXT NOT NULL UNIQUE,
+            length INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_terms USING fts5(
+            terms, tokenize = "unicode61 remove_diacritics 0 tokenchars '_'"
+        )
+        """,
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_vocab"
+        " USING fts5vocab(search_terms, 'row')",
+    )
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        conn = self.connection()
+        with self.transaction():
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            conn.executemany(
+                "INSERT OR IGNORE INTO versions (name, value) VALUES (?, ?)",
+                [
+                    ("seq", 0),
+                    ("epoch", os.urandom(4).hex()),
+                    ("search_docs", 0),
+                    ("search_length", 0),
+                ],
+            )
+            self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn):
+        """Bring databases created by older versions up to the current schema."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(notes)")}
+        if "version" not in columns:
+            conn.execute(
+                "ALTER TABLE notes ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+            )
+        if "expires_at" not in columns:
+            conn.execute("ALTER TABLE notes ADD COLUMN expires_at REAL")
+        # Notes written before versions existed all got version 0, so they
+        # would share one ETag: number them past the write sequence instead
+        unversioned = [
+            row[0] for row in conn.execute("SELECT id FROM notes WHERE version = 0")
+        ]
+        if unversioned:
+            (seq,) = conn.execute(
+                "SELECT value FROM versions WHERE name = 'seq'"
+            ).fetchone()
+            conn.executemany(
+                "UPDATE notes SET version = ? WHERE id = ?",
+                enumerate(unversioned, seq + 1),
+            )
+            conn.execute(
+                "UPDATE versions SET value = ? WHERE name = 'seq'",
+                (seq + len(unversioned),),
+            )
+        # Created here rather than in SCHEMA, after the column is known to exist
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS notes_expiry ON notes (expires_at)"
+            " WHERE expires_at IS NOT NULL"
+        )
+        # Notes written before the search index existed
+        if not conn.execute("SELECT 1 FROM search_docs LIMIT 1").fetchone():
+            for note_id, text in conn.execute("SELECT id, text FROM notes"):
+                _index_note(conn, note_id, tokenize(text))
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None,  # Autocommit; transactions are explicit
+                check_same_thread=False,
+                cached_statements=256,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        """Drop the connections inherited from the parent process.
+
+        A SQLite connection must not be used across a fork, so the child
+        opens its own on first use.
+        """
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run the enclosed statements in one write transaction.
+
+        Nested calls join the outer transaction.
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        """Close the calling thread's connection, if any."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _index_note(conn, note_id, terms):
+    """Add a note's search ``terms`` to the index, replacing its old ones."""
+    _unindex_note(conn, note_id)
+    doc = conn.execute(
+        "INSERT INTO search_docs (note_id, length) VALUES (?, ?)",
+        (note_id, len(terms)),
+    ).lastrowid
+    conn.execute(
+        "INSERT INTO search_terms (rowid, terms) VALUES (?, ?)", (doc, " ".join(terms))
+    )
+    conn.executemany(
+        "UPDATE versions SET value = value + ? WHERE name = ?",
+        [(1, "search_docs"), (len(terms), "search_length")],
+    )
+
+
+def _unindex_note(conn, note_id):
+    """Drop a note from the search index, if it is there."""
+    row = conn.execute(
+        "SELECT doc, length FROM search_docs WHERE note_id = ?", (note_id,)
+    ).fetchone()
+    if row is None:
+        return
+    conn.execute("DELETE FROM search_terms WHERE rowid = ?", (row[0],))
+    conn.execute("DELETE FROM search_docs WHERE doc = ?", (row[0],))
+    conn.executemany(
+        "UPDATE versions SET value = value + ? WHERE name = ?",
+        [(-1, "search_docs"), (-row[1], "search_length")],
+    )
+
+
+class SQLiteNoteStore(NoteStore):
+    """Note storage backed by the ``notes`` table of a SQLite database.
+
+    Expired notes are found through a partial index on ``expires_at``. The
+    search index is kept in the database too, written in the same
+    transactions as the notes, so ``search`` finds the notes every process
+    sharing the database wrote.
+    """
+
+    def __init__(self, db, clock=time.time):
+        self.db = db
+        self._clock = clock
+        self.epoch = (
+            db.connection()
+            .execute("SELECT value FROM versions WHERE name = 'epoch'")
+            .fetchone()[0]
+        )
+
+    def after_fork(self):
+        self.db.after_fork()
+
+    def __len__(self):
+        return self.db.connection().execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    def get(self, note_id, default=None):
+        row = (
+            self.db.connection()
+            .execute(
+                "SELECT text, author, is_public, version, expires_at FROM notes"
+                " WHERE id = ?",
+                (note_id,),
+            )
+            .fetchone()
+        )
+        if row is None or (row[4] is not None and row[4] <= self._clock()):
+            return default
+        return Note(row[0], row[1], bool(row[2]), row[3], row[4])
+
+    @staticmethod
+    def _bump(conn, author, public):
+        """Take the next write sequence value for a write by ``author``."""
+        conn.execute("UPDATE versions SET value = value + 1 WHERE name = 'seq'")
+        version = conn.execute(
+            "SELECT value FROM versions WHERE name = 'seq'"
+        ).fetchone()[0]
+        views = [(f"author:{author}", version)] if author is not None else []
+        if public:
+            views.append(("public", version))
+        conn.executemany(
+            "INSERT OR REPLACE INTO versions (name, value) VALUES (?, ?)", views
+        )
+        return version
+
+    def create(self, note_id, text, author, is_public, source=None, expires_at=None):
+        if not self.insert_if_absent(
+            note_id, text, author, is_public, source, expires_at
+        ):
+            raise ValueError(f"Note {note_id!r} already exists")
+
+    def insert_if_absent(
+        self, note_id, text, author, is_public, source=None, expires_at=None
+    ):
+        terms = tokenize(text)  # Before taking the database write lock
+        # BEGIN IMMEDIATE takes the database write lock, so the check and the
+        # insert are atomic across threads and processes
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT author, is_public, expires_at FROM notes WHERE id = ?",
+                (note_id,),
+            ).fetchone()
+            if row is not None:
+                if row[2] is None or row[2] > self._clock():
+                    return False
+                self._bump(conn, row[0], row[1])  # Replaces the expired note
+                conn.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+            version = self._bump(conn, author, is_public)
+            conn.execute(
+                "INSERT INTO notes (id, text, author, is_public, version, expires_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (note_id, text, author, bool(is_public), version, expires_at),
+            )
+            _index_note(conn, note_id, terms)
+        self._notify(note_id, Note(text, author, bool(is_public), version, expires_at))
+        return True
+
+    def _current(self, conn, note_id, version):
+        """Return the ``(author, is_public, expires_at)`` of a live note.
+
+        Returns None if the note is missing or expired, or if ``version`` is
+        given and the note has another version.
+        """
+        row = conn.execute(
+            "SELECT author, is_public, expires_at, version FROM notes WHERE id = ?",
+            (note_id,),
+        ).fetchone()
+        if row is None or (row[2] is not None and row[2] <= self._clock()):
+            return None
+        if version is not None and row[3] != version:
+            return None
+        return row[:3]
+
+    def update(self, note_id, text, is_public, source=None):
+        if not self._update(note_id, None, text, is_public):
+            raise KeyError(note_id)
+
+    def compare_and_set(self, note_id, version, text, is_public, source=None):
+        return self._update(note_id, version, text, is_public)
+
+    def _update(self, note_id, version, text, is_public):
+        terms = tokenize(text)
+        with self.db.transaction() as conn:
+            row = self._current(conn, note_id, version)
+            if row is None:
+                return False
+            version = self._bump(conn, row[0], row[1] or is_public)
+            conn.execute(
+                "UPDATE notes SET text = ?, is_public = ?, version = ? WHERE id = ?",
+                (text, bool(is_public), version, note_id),
+            )
+            _index_note(conn, note_id, terms)
+        self._notify(note_id, Note(text, row[0], bool(is_public), version, row[2]))
+        return True
+
+    def delete(self, note_id):
+        if not self._delete(note_id, None):
+            raise KeyError(note_id)
+
+    def compare_and_delete(self, note_id, version):
+        return self._delete(note_id, version)
+
+    def _delete(self, note_id, version):
+        with self.db.transaction() as conn:
+            row = self._current(conn, note_id, version)
+            if row is None:
+                return False
+            self._bump(conn, row[0], row[1])
+            conn.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+            _unindex_note(conn, note_id)
+        self._notify(note_id, None)
+        return True
+
+    def expire(self, limit=None):
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, author, is_public FROM notes"
+                " WHERE expires_at <= ? ORDER BY expires_at LIMIT ?",
+                (self._clock(), -1 if limit is None else limit),
+            ).fetchall()
+            for note_id, author, is_public in rows:
+                self._bump(conn, author, is_public)
+                conn.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+                _unindex_note(conn, note_id)
+        for note_id, _, _ in rows:
+            self._notify(note_id, None)
+        return len(rows)
+
+    def items(self):
+        rows = self.db.connection().execute(
+            "SELECT id, text, author, is_public, version, expires_at FROM notes"
+            " ORDER BY id"
+        )
+        for row in rows:
+            yield row[0], Note(row[1], row[2], bool(row[3]), row[4], row[5])
+
+    def listing_version(self, user):
+        rows = self.db.connection().execute(
+            "SELECT name, value FROM versions WHERE name IN ('public', ?)",
+            (f"author:{user}",),
+        )
+        values = dict(rows)
+        (next_expiry,) = (
+            self.db.connection()
+            .execute("SELECT MIN(expires_at) FROM notes WHERE expires_at IS NOT NULL")
+            .fetchone()
+        )
+        return (
+            f"{self.epoch}.{values.get('public', 0)}"
+            f".{values.get(f'author:{user}', 0)}"
+            f"{self._expiry_mark(next_expiry, self._clock())}"
+        )
+
+    def visible_ids(self, user, after=None, limit=None):
+        # Two index range scans merged by the UNION, rather than an OR that
+        # would force a full table scan.
+        rows = self.db.connection().execute(
+            """
+            SELECT id FROM notes WHERE is_public = 1 AND id > ?
+            UNION
+            SELECT id FROM notes WHERE author = ? AND id > ?
+            ORDER BY id LIMIT ?
+            """,
+            (
+                "" if after is None else after,
+                user,
+                "" if after is None else after,
+                -1 if limit is None else limit,
+            ),
+        )
+        return [row[0] for row in rows]
+
+    def author_ids(self, author, after=None, limit=None):
+        rows = self.db.connection().execute(
+            "SELECT id FROM notes WHERE author = ? AND id > ? ORDER BY id LIMIT ?",
+            (author, "" if after is None else after, -1 if limit is None else limit),
+        )
+        return [row[0] for row in rows]
+
+    def search(self, query, user, offset=0, limit=20):
+        """Return ``(total, [(note_id, score), ...])`` for a query.
+
+        Same results as ``search.SearchIndex.search``: FTS5 finds the notes
+        ``user`` can read that contain every query term, and ``search.rank``
+        scores them. Expired notes are left out.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return 0, []
+        conn = self.db.connection()
+        stats = dict(
+            conn.execute(
+                "SELECT name, value FROM versions"
+                " WHERE name IN ('search_docs', 'search_length')"
+            )
+        )
+        if not stats["search_docs"]:
+            return 0, []
+        doc_freqs = []
+        for term in terms:
+            row = conn.execute(
+                "SELECT doc FROM search_vocab WHERE term = ?", (term,)
+            ).fetchone()
+            if row is None:
+                return 0, []
+            doc_freqs.append(row[0])
+        rows = conn.execute(
+            """
+            SELECT search_docs.note_id, search_terms.terms FROM search_terms
+            JOIN search_docs ON search_docs.doc = search_terms.rowid
+            JOIN notes ON notes.id = search_docs.note_id
+            WHERE search_terms MATCH ? AND (notes.is_public = 1 OR notes.author = ?)
+            AND (notes.expires_at IS NULL OR notes.expires_at > ?)
+            """,
+            (" ".join(f'"{term}"' for term in terms), user, self._clock()),
+        )
+        docs = []
+        for note_id, text in rows:
+            words = text.split()
+            counts = Counter(words)
+            docs.append((note_id, len(words), [counts[term] for term in terms]))
+        return rank(
+            docs,
+            doc_freqs,
+            stats["search_docs"],
+            stats["search_length"] / stats["search_docs"],
+            offset,
+            limit,
+        )
+
+    def clear(self):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM notes")
+            conn.execute("DELETE FROM search_docs")
+            conn.execute("DELETE FROM search_terms")
+            conn.execute(
+                "UPDATE versions SET value = 0"
+                " WHERE name IN ('search_docs', 'search_length')"
+            )
+            self._bump(conn, None, True)  # Invalidates every listing
+        self._notify(None, None)
+
+    def transaction(self):
+        return self.db.transaction()
+
+
+class SQLiteUserStore(UserStore):
+    """User storage backed by the ``users`` table of a SQLite database."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def after_fork(self):
+        self.db.after_fork()
+
+    def __len__(self):
+        return self.db.connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def get(self, user_id, default=None):
+        row = (
+            self.db.connection()
+            .execute("SELECT password, api_key FROM users WHERE id = ?", (user_id,))
+            .fetchone()
+        )
+        if row is None:
+            return default
+        return User(row[0], row[1])
+
+    def create(self, user_id, password, api_key):
+        self.db.connection().execute(
+            "INSERT OR REPLACE INTO users (id, password, api_key) VALUES (?, ?, ?)",
+            (user_id, password, api_key),
+        )
+        self._notify(user_id, User(password, api_key))
+
+    def insert_if_absent(self, user_id, password, api_key):
+        inserted = (
+            self.db.connection()
+            .execute(
+                "INSERT INTO users (id, password, api_key) VALUES (?, ?, ?)"
+                " ON CONFLICT (id) DO NOTHING",
+                (user_id, password, api_key),
+            )
+            .rowcount
+        )
+        if inserted:
+            self._notify(user_id, User(password, api_key))
+        return bool(inserted)
+
+    def clear(self):
+        self.db.connection().execute("DELETE FROM users")
+        self._notify(None, None)
+
+    def items(self):
+        rows = self.db.connection().execute(
+            "SELECT id, password, api_key FROM users ORDER BY id"
+        )
+        for row in rows:
+            yield row[0], User(row[1], row[2])
+
+
+def open_stores(url, journal_options=None, **memory_options):
+    """Return a ``(notes, users)`` store pair for a storage URL.
+
+    Supported URLs are ``memory://``, ``journal:///path/to/directory`` (memory
+    stores recovered from and journaled to that directory) and
+    ``sqlite:///path/to/pastebin.db``. ``journal_options`` are passed to
+    ``journal.Journal``, and ``memory_options`` to ``MemoryNoteStore``; the
+    SQLite backend ignores both. The journal of a journaled store is
+    available as ``notes.journal``.
+    """
+    if url in ("", "memory", "memory://"):
+        return MemoryNoteStore(**memory_options), MemoryUserStore()
+    if url.startswith("journal:///"):
+        notes, users = MemoryNoteStore(**memory_options), MemoryUserStore()
+        notes.journal = Journal(url[len("journal:///") :], **(journal_options or {}))
+        notes.journal.open(notes, users)
+        return notes, users
+    if url.startswith("sqlite:///"):
+        db = SQLiteDatabase(url[len("sqlite:///") :])
+        return SQLiteNoteStore(db), SQLiteUserStore(db)
+    raise ValueError(f"Unsupported storage URL: {url!r}")
@@ -0,0 +1,57 @@
+import unittest
+
+from cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")  # "b" is now the least recently used
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_stats(self):
+        cache = LRUCache(maxsize=10)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("missing")
+        self.assertEqual(
+            cache.stats(), {"size": 1, "maxsize": 10, "hits": 1, "misses": 1}
+        )
+
+    def test_byte_bound(self):
+        cache = LRUCache(maxsize=10, maxbytes=10)
+        cache.set("a", b"xxxx")
+        cache.set("b", b"yyyy")
+        cache.set("a", b"zzzz")  # Replacing a value does not count it twice
+        cache.set("c", b"wwww")  # Evicts "b", the least recently used
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"zzzz")
+        self.assertEqual(cache.stats()["bytes"], 8)
+        cache.set("huge", b"x" * 11)  # Over maxbytes on its own: not cached
+        self.assertIsNone(cache.get("huge"))
+        self.assertEqual(cache.pop("a"), b"zzzz")
+        self.assertEqual(cache.stats()["bytes"], 4)
+
+    def test_custom_sizeof(self):
+        cache = LRUCache(maxbytes=10, sizeof=lambda entry: len(entry[1]))
+        cache.set("a", (1, b"xxxxxx"))
+        cache.set("b", (2, b"yyyyyy"))
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["bytes"], 6)
+
+    def test_disabled(self):
+        cache = LRUCache(maxsize=0)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import tempfile
+import unittest
+
+from journal import Journal
+from storage import MemoryNoteStore, MemoryUserStore, open_stores
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.directory = tmpdir.name
+
+    def open(self, **options):
+        options.setdefault("fsync_interval", 0)
+        notes, users = open_stores(
+            f"journal:///{self.directory}", journal_options=options
+        )
+        self.addCleanup(notes.journal.close)
+        return notes, users
+
+    def restart(self, notes, **options):
+        notes.journal.close()
+        return self.open(**options)
+
+    def test_writes_survive_restart(self):
+        notes, users = self.open()
+        notes.create("a", "Hello", "alice", True)
+        notes.create("b", "Private", "alice", False)
+        notes.update("a", "Hello again", False)
+        notes.delete("b")
+        users.create("alice", "secret", "key")
+
+        notes, users = self.restart(notes)
+        self.assertEqual(list(notes.visible_ids("alice")), ["a"])
+        self.assertEqual(notes["a"].text, "Hello again")
+        self.assertFalse(notes["a"].is_public)
+        self.assertEqual(users.get("alice").api_key, "key")
+        self.assertEqual(notes.journal.recovery["journal_records"], 5)
+
+    def test_expiry_survives_restart(self):
+        notes, users = self.open()
+        notes.create("a", "Expires", "alice", True, expires_at=4102444800.0)
+        notes.create("b", "Kept", "alice", True)
+        notes.update("a", "Still expires", True)
+
+        notes, users = self.restart(notes)
+        self.assertEqual(notes["a"].expires_at, 4102444800.0)
+        self.assertIsNone(notes["b"].expires_at)
+        notes.journal.snapshot()
+        notes, users = self.restart(notes)
+        self.assertEqual(notes["a"].expires_at, 4102444800.0)
+
+        # Reloaded notes are found by expire() once due
+        notes._clock = lambda: 4102444800.0
+        self.assertEqual(notes.expire(), 1)
+
+    def test_snapshot_compacts_journal(self):
+        notes, users = self.open()
+        for i in range(10):
+            notes.create(f"n{i}", "text", "alice", False)
+        notes.clear()
+        notes.create("kept", "text", "alice", True)
+        notes.journal.snapshot()
+        notes.create("after", "text", "bob", False)
+
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            ["journal-000001.jsonl", "snapshot-000001.jsonl"],
+        )
+        notes, users = self.restart(notes)
+        self.assertEqual(sorted(notes.visible_ids("bob")), ["after", "kept"])
+        self.assertEqual(notes.journal.recovery["snapshot_records"], 1)
+        self.assertEqual(notes.journal.recovery["journal_records"], 1)
+
+    def test_automatic_snapshot(self):
+        notes, users = self.open(snapshot_every=5)
+        for i in range(5):
+            notes.create(f"n{i}", "text", "alice", False)
+        with notes.journal._compacting:  # Waits for the background snapshot
+            pass
+        self.assertEqual(notes.journal.snapshots, 1)
+
+        notes, users = self.restart(notes)
+        self.assertEqual(len(notes), 5)
+
+    def test_torn_write_truncated(self):
+        notes, users = self.open()
+        notes.create("a", "text", "alice", False)
+        notes.journal.close()
+        path = os.path.join(self.directory, "journal-000000.jsonl")
+        with open(path, "ab") as f:
+            f.write(b'["note","b","te')  # Crash in the middle of a write
+
+        notes, users = self.open()
+        self.assertEqual(list(notes.visible_ids("alice")), ["a"])
+        notes.create("c", "text", "alice", False)
+
+        notes, users = self.restart(notes)
+        self.assertEqual(list(notes.visible_ids("alice")), ["a", "c"])
+
+    def test_unfinished_compaction_recovered(self):
+        # A crash after the journal was rotated but before the snapshot was
+        # written leaves two journals on top of the last snapshot
+        notes, users = MemoryNoteStore(), MemoryUserStore()
+        journal = Journal(self.directory, fsync_interval=0)
+        journal.open(notes, users)
+        notes.create("a", "text", "alice", False)
+        with journal._lock:
+            journal._file.close()
+            journal.generation += 1
+            journal._file = open(journal._path("journal", journal.generation), "ab")
+        notes.create("b", "text", "alice", False)
+        with open(journal._path("snapshot", 1) + ".tmp", "wb") as f:
+            f.write(b'["note","a"')
+        journal.close()
+
+        notes, users = self.open()
+        self.assertEqual(list(notes.visible_ids("alice")), ["a", "b"])
+        self.assertNotIn("snapshot-000001.jsonl.tmp", os.listdir(self.directory))
+
+    def test_batched_fsync(self):
+        notes, users = self.open(fsync_interval=60)
+        for i in range(10):
+            notes.create(f"n{i}", "text", "alice", False)
+        self.assertEqual(notes.journal.fsyncs, 0)
+        notes.journal.close()
+        self.assertEqual(notes.journal.fsyncs, 1)
+
+        notes, users = self.open()
+        self.assertEqual(len(notes), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
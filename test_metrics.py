@@ -0,0 +1,43 @@
+import unittest
+
+from metrics import CallbackMetric, Counter, Histogram, Registry
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        registry = Registry()
+        histogram = Histogram(
+            "latency_seconds", "Latency.", ["endpoint"], [0.1, 1], registry
+        )
+        histogram.observe(0.05, "home")
+        histogram.observe(0.5, "home")
+        histogram.observe(5, "home")
+
+        lines = registry.render().splitlines()
+        self.assertEqual(lines[0], "# HELP latency_seconds Latency.")
+        self.assertEqual(lines[1], "# TYPE latency_seconds histogram")
+        self.assertEqual(
+            lines[2:],
+            [
+                'latency_seconds_bucket{endpoint="home",le="0.1"} 1',
+                'latency_seconds_bucket{endpoint="home",le="1"} 2',
+                'latency_seconds_bucket{endpoint="home",le="+Inf"} 3',
+                'latency_seconds_sum{endpoint="home"} 5.55',
+                'latency_seconds_count{endpoint="home"} 3',
+            ],
+        )
+
+    def test_counter_and_callback(self):
+        registry = Registry()
+        counter = Counter("events_total", "Events.", ["kind"], registry=registry)
+        counter.inc('say "hi"')
+        counter.inc('say "hi"', amount=2)
+        CallbackMetric("answer", "The answer.", lambda: {(): 42}, registry=registry)
+
+        body = registry.render()
+        self.assertIn('events_total{kind="say \\"hi\\""} 3', body)
+        self.assertIn("# TYPE answer gauge\nanswer 42", body)
+
+
+if __name__ == "__main__":
+    unittest.main()
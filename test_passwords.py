@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+from passwords import (
+    HasherBusy,
+    PasswordHasher,
+    hash_password,
+    parse_hash,
+    verify_password,
+)
+
+
+class TestPasswords(unittest.TestCase):
+    def test_hash_and_verify(self):
+        stored = hash_password("secret", n=16, r=8, p=1)
+        self.assertTrue(stored.startswith("scrypt$16$8$1$"))
+        self.assertTrue(verify_password("secret", stored))
+        self.assertFalse(verify_password("Secret", stored))
+
+        # Salted: the same password never hashes the same way twice
+        self.assertNotEqual(stored, hash_password("secret", n=16, r=8, p=1))
+
+    def test_parse_hash(self):
+        n, r, p, salt, key = parse_hash(hash_password("secret", n=16, r=8, p=1))
+        self.assertEqual((n, r, p, len(salt), len(key)), (16, 8, 1, 16, 32))
+        self.assertIsNone(parse_hash("plaintext"))
+        self.assertIsNone(parse_hash("pass$word"))
+
+    def test_legacy_plaintext(self):
+        self.assertTrue(verify_password("secret", "secret"))
+        self.assertFalse(verify_password("secret", "other"))
+
+
+class TestPasswordHasher(unittest.TestCase):
+    def setUp(self):
+        self.hasher = PasswordHasher(n=16, workers=1, max_pending=2)
+
+    def test_verify(self):
+        stored = self.hasher.hash("secret")
+        self.assertEqual(self.hasher.verify("secret", stored), (True, None))
+        self.assertEqual(self.hasher.verify("wrong", stored), (False, None))
+        self.assertEqual(self.hasher.verify("secret", None), (False, None))
+
+    def test_rehash_on_cost_change(self):
+        stored = self.hasher.hash("secret")
+        self.hasher.n = 32
+        self.assertTrue(self.hasher.needs_rehash(stored))
+        valid, new_hash = self.hasher.verify("secret", stored)
+        self.assertTrue(valid)
+        self.assertTrue(new_hash.startswith("scrypt$32$"))
+        self.assertFalse(self.hasher.needs_rehash(new_hash))
+
+        # A wrong password never produces a new hash
+        self.assertEqual(self.hasher.verify("wrong", stored), (False, None))
+
+        valid, new_hash = self.hasher.verify("secret", "secret")
+        self.assertTrue(valid)
+        self.assertTrue(new_hash.startswith("scrypt$32$"))
+
+    def test_busy(self):
+        with mock.patch.object(self.hasher._pending, "acquire", return_value=False):
+            with self.assertRaises(HasherBusy):
+                self.hasher.hash("secret")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,17 @@
+import gzip
+import os
+import random
+import select
+import subprocess
+import sys
+import zlib
+import time
 import unittest
+from unittest import mock
 from flask_testing import TestCase
-from pastebin import app, users, notes
+import pastebin
+from pastebin import app, users, notes, sanitize_input, sanitize_cache, sanitizer
+from pastebin import token_cache, compress_cache
 import json
 
 
@@ -13,6 +24,11 @@ class TestPastebin(TestCase):
         self.client = self.app.test_client()
         users.clear()
         notes.clear()
+        pastebin.rate_limiter.clear()
+        # The lowest scrypt cost, so registering and logging in stay fast
+        patcher = mock.patch.object(pastebin.password_hasher, "n", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def register_and_login(self, user_id="testuser", password="testpass"):
         self.client.post(
@@ -58,6 +74,18 @@ class TestPastebin(TestCase):
         )
         self.assertEqual(response.status_code, 401)
 
+    def test_credentials_must_be_strings(self):
+        self.register_and_login()
+        for credentials in (
+            {"user_id": "testuser", "password": 5},
+            {"user_id": "testuser", "password": ["testpass"]},
+            {"user_id": 5, "password": "testpass"},
+            {"user_id": {"id": "testuser"}, "password": "testpass"},
+        ):
+            for url in ("/api/register", "/api/login"):
+                response = self.client.post(url, json=credentials)
+                self.assertEqual(response.status_code, 400)
+
     def test_create_note(self):
         token = self.register_and_login()
         response = self.client.post(
@@ -89,6 +117,30 @@ class TestPastebin(TestCase):
 
         self.assertEqual(response.status_code, 409)
 
+    def test_create_note_with_non_string_id(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        for note_id in (5, ["a"], {"a": 1}):
+            response = self.client.post(
+                "/api/notes",
+                json={"id": note_id, "text": "Some text", "isPublic": True},
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(notes), 0)
+        self.assertEqual(self.client.get("/api/notes", headers=headers).json, [])
+
+        # Nor non-string texts, on create or update
+        response = self.client.post(
+            "/api/notes", json={"id": "a", "text": 5}, headers=headers
+        )
+        self.assertEqual(response.status_code, 400)
+        notes.create("a", "Text", "testuser", False)
+        response = self.client.put(
+            "/api/notes/a", json={"text": ["x"], "isPublic": True}, headers=headers
+        )
+        self.assertEqual(response.status_code, 400)
+
     def test_read_note(self):
         token = self.register_and_login()
         self.client.post(
@@ -169,6 +221,730 @@ class TestPastebin(TestCase):
         self.assertIn("note1", [note["id"] for note in response.json])
         self.assertIn("note2", [note["id"] for note in response.json])
 
+    def test_list_notes_visibility(self):
+        token = self.register_and_login()
+        other_token = self.register_and_login("otheruser", "otherpass")
+        self.client.post(
+            "/api/notes",
+            json={"id": "public", "text": "Public note", "isPublic": True},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        self.client.post(
+            "/api/notes",
+            json={"id": "private", "text": "Private note", "isPublic": False},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        self.client.post(
+            "/api/notes",
+            json={"id": "other", "text": "Other private note", "isPublic": False},
+            headers={"Authorization": f"Bearer {other_token}"},
+        )
+
+        response = self.client.get(
+            "/api/notes", headers={"Authorization": f"Bearer {other_token}"}
+        )
+        self.assertEqual([note["id"] for note in response.json], ["other", "public"])
+
+        # Making the public note private removes it from the other user's view
+        self.client.put(
+            "/api/notes/public",
+            json={"text": "Now private", "isPublic": False},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        response = self.client.get(
+            "/api/notes", headers={"Authorization": f"Bearer {other_token}"}
+        )
+        self.assertEqual([note["id"] for note in response.json], ["other"])
+
+        # Deleted notes disappear from the author's view
+        self.client.delete(
+            "/api/notes/private", headers={"Authorization": f"Bearer {token}"}
+        )
+        response = self.client.get(
+            "/api/notes", headers={"Authorization": f"Bearer {token}"}
+        )
+        self.assertEqual([note["id"] for note in response.json], ["public"])
+
+    def test_list_notes_pagination(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        for i in range(5):
+            self.client.post(
+                "/api/notes",
+                json={"id": f"note{i}", "text": f"Note {i}", "isPublic": False},
+                headers=headers,
+            )
+
+        seen = []
+        cursor = None
+        while True:
+            url = "/api/notes?limit=2" + (f"&cursor={cursor}" if cursor else "")
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(note["id"] for note in response.json)
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        self.assertEqual(seen, [f"note{i}" for i in range(5)])
+
+        response = self.client.get("/api/notes?limit=0", headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/notes?cursor=%%%", headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_notes_streamed(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        for i in range(3):
+            self.client.post(
+                "/api/notes",
+                json={"id": f"note{i}", "text": f"Note {i}", "isPublic": True},
+                headers=headers,
+            )
+
+        response = self.client.get("/api/notes?stream=true", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(
+            [note["id"] for note in json.loads(response.data)],
+            ["note0", "note1", "note2"],
+        )
+
+    def test_list_notes_rechecks_visibility(self):
+        token = self.register_and_login()
+        notes.create("mine", "Mine", "testuser", False)
+        notes.create("shared", "Shared", "otheruser", True)
+        visible_ids = notes.visible_ids
+
+        def made_private_meanwhile(*args):
+            ids = visible_ids(*args)
+            notes.update("shared", "Secret now", False)
+            return ids
+
+        for query in ("", "?stream=true"):
+            notes.update("shared", "Shared", True)
+            with mock.patch.object(notes, "visible_ids", made_private_meanwhile):
+                response = self.client.get(
+                    f"/api/notes{query}", headers={"Authorization": f"Bearer {token}"}
+                )
+            self.assertEqual([note["id"] for note in response.json], ["mine"])
+
+    def test_read_note_conditional_get(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        self.client.post(
+            "/api/notes",
+            json={"id": "testnote", "text": "This is a test note", "isPublic": True},
+            headers=headers,
+        )
+
+        response = self.client.get("/api/notes/testnote", headers=headers)
+        etag = response.headers["ETag"]
+        response = self.client.get(
+            "/api/notes/testnote", headers={**headers, "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+        self.client.put(
+            "/api/notes/testnote",
+            json={"text": "Updated", "isPublic": True},
+            headers=headers,
+        )
+        response = self.client.get(
+            "/api/notes/testnote", headers={**headers, "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_list_notes_conditional_get(self):
+        token = self.register_and_login()
+        other_token = self.register_and_login("otheruser", "otherpass")
+        headers = {"Authorization": f"Bearer {token}"}
+        self.client.post(
+            "/api/notes",
+            json={"id": "note1", "text": "This is note 1", "isPublic": False},
+            headers=headers,
+        )
+
+        etag = self.client.get("/api/notes", headers=headers).headers["ETag"]
+        response = self.client.get(
+            "/api/notes", headers={**headers, "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # Another user's private note does not change this user's listing
+        self.client.post(
+            "/api/notes",
+            json={"id": "other", "text": "Private", "isPublic": False},
+            headers={"Authorization": f"Bearer {other_token}"},
+        )
+        response = self.client.get(
+            "/api/notes", headers={**headers, "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # ...but a public one does
+        self.client.put(
+            "/api/notes/other",
+            json={"text": "Public", "isPublic": True},
+            headers={"Authorization": f"Bearer {other_token}"},
+        )
+        response = self.client.get(
+            "/api/notes", headers={**headers, "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json), 2)
+
+        # Each page has its own ETag
+        response = self.client.get(
+            "/api/notes?limit=1", headers={**headers, "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_response_compression(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        text = "A line of a very large log file\n" * 1000
+        self.client.post(
+            "/api/notes",
+            json={"id": "big", "text": text, "isPublic": True},
+            headers=headers,
+        )
+        plain = self.client.get("/api/notes/big", headers=headers)
+        self.assertNotIn("Content-Encoding", plain.headers)
+
+        compress_cache.clear()
+        response = self.client.get(
+            "/api/notes/big", headers={**headers, "Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+        self.assertLess(len(response.data), len(plain.data) // 10)
+
+        # The compressed body is cached, and the weak ETag still validates
+        response = self.client.get(
+            "/api/notes/big", headers={**headers, "Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(compress_cache.stats()["hits"], 1)
+        self.assertEqual(compress_cache.stats()["bytes"], len(response.data))
+        response = self.client.get(
+            "/api/notes/big",
+            headers={
+                **headers,
+                "Accept-Encoding": "gzip",
+                "If-None-Match": response.headers["ETag"],
+            },
+        )
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            "/api/notes", headers={**headers, "Accept-Encoding": "deflate"}
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "deflate")
+        self.assertEqual(json.loads(zlib.decompress(response.data))[0]["id"], "big")
+
+        # Small responses are sent as-is
+        response = self.client.get(
+            "/api/users/testuser", headers={**headers, "Accept-Encoding": "gzip"}
+        )
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_compressed_bodies_are_cached_per_url(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"}
+        for note_id in ("a", "b"):
+            self.client.post(
+                "/api/notes",
+                json={"id": note_id, "text": note_id * 4096, "isPublic": True},
+                headers=headers,
+            )
+        # ETags are only unique per URL: give both notes the same one
+        notes._notes["b"].version = notes["a"].version
+
+        first = self.client.get("/api/notes/a", headers=headers)
+        second = self.client.get("/api/notes/b", headers=headers)
+        self.assertEqual(first.headers["ETag"], second.headers["ETag"])
+        self.assertEqual(json.loads(gzip.decompress(second.data))["id"], "b")
+
+    def test_metrics(self):
+        token = self.register_and_login()
+        self.client.get("/api/notes", headers={"Authorization": f"Bearer {token}"})
+        self.client.get(
+            "/api/notes/missing", headers={"Authorization": f"Bearer {token}"}
+        )
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 404)
+
+        with mock.patch.dict(app.config, METRICS_TOKEN="scrape-secret"):
+            response = self.client.get("/metrics")
+            self.assertEqual(response.status_code, 401)
+            response = self.client.get(
+                "/metrics", headers={"Authorization": f"Bearer {token}"}
+            )
+            self.assertEqual(response.status_code, 401)
+            response = self.client.get(
+                "/metrics", headers={"Authorization": "Bearer scrape-secret"}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        body = response.get_data(as_text=True)
+        self.assertIn(
+            'pastebin_request_duration_seconds_count{endpoint="api_list_notes",'
+            'method="GET",status="200"}',
+            body,
+        )
+        self.assertIn('endpoint="api_read_note",method="GET",status="404"', body)
+        self.assertIn(
+            'pastebin_jwt_verify_duration_seconds_count{source="decode"}', body
+        )
+        self.assertIn("pastebin_sanitize_duration_seconds_count ", body)
+        self.assertNotIn("pastebin_sanitize_duration_seconds_count{", body)
+        self.assertIn('pastebin_cache_lookups_total{cache="token",result="hits"}', body)
+        self.assertIn("pastebin_requests_in_flight 1", body)  # The scrape itself
+
+    def test_search_notes(self):
+        token = self.register_and_login()
+        other_token = self.register_and_login("otheruser", "otherpass")
+        headers = {"Authorization": f"Bearer {token}"}
+        for note_id, text, is_public in [
+            ("trace1", "NullPointerException in Worker.run", True),
+            ("trace2", "NullPointerException NullPointerException in main", True),
+            ("config", "worker threads = 4", False),
+        ]:
+            self.client.post(
+                "/api/notes",
+                json={"id": note_id, "text": text, "isPublic": is_public},
+                headers=headers,
+            )
+
+        response = self.client.get(
+            "/api/notes/search?q=nullpointerexception", headers=headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["total"], 2)
+        self.assertEqual(
+            [note["id"] for note in response.json["results"]], ["trace2", "trace1"]
+        )
+
+        # Private notes are only found by their author
+        response = self.client.get("/api/notes/search?q=worker", headers=headers)
+        self.assertEqual(
+            sorted(note["id"] for note in response.json["results"]),
+            ["config", "trace1"],
+        )
+        response = self.client.get(
+            "/api/notes/search?q=worker",
+            headers={"Authorization": f"Bearer {other_token}"},
+        )
+        self.assertEqual([note["id"] for note in response.json["results"]], ["trace1"])
+
+        # The index follows updates and deletes
+        self.client.put(
+            "/api/notes/trace1",
+            json={"text": "Fixed", "isPublic": True},
+            headers=headers,
+        )
+        self.client.delete("/api/notes/config", headers=headers)
+        response = self.client.get("/api/notes/search?q=worker", headers=headers)
+        self.assertEqual(response.json["total"], 0)
+
+        response = self.client.get(
+            "/api/notes/search?q=nullpointerexception&limit=1&offset=1",
+            headers=headers,
+        )
+        self.assertEqual(response.json["results"], [])
+
+        response = self.client.get("/api/notes/search", headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_operations(self):
+        token = self.register_and_login()
+        other_token = self.register_and_login("otheruser", "otherpass")
+        self.client.post(
+            "/api/notes",
+            json={"id": "private", "text": "Other's note", "isPublic": False},
+            headers={"Authorization": f"Bearer {other_token}"},
+        )
+
+        response = self.client.post(
+            "/api/notes/batch",
+            json={
+                "operations": [
+                    {
+                        "op": "create",
+                        "id": "n1",
+                        "text": "<b>One</b><script>x</script>",
+                    },
+                    {"op": "create", "id": "n2", "text": "Two", "isPublic": True},
+                    {"op": "create", "id": "n1", "text": "Duplicate"},
+                    {"op": "update", "id": "n2", "text": "Two!", "isPublic": False},
+                    {"op": "read", "id": "n1"},
+                    {"op": "read", "id": "private"},
+                    {"op": "delete", "id": "private"},
+                    {"op": "delete", "id": "missing"},
+                    {"op": "update", "id": "n1", "text": "No isPublic"},
+                    {"op": "explode", "id": "n1"},
+                    {"op": "create", "id": "n3", "text": 5},
+                    {"op": "update", "id": "n2", "text": ["x"], "isPublic": True},
+                ]
+            },
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json["results"]
+        self.assertEqual(
+            [result["status"] for result in results],
+            [201, 201, 409, 200, 200, 403, 403, 404, 400, 400, 400, 400],
+        )
+        self.assertNotIn("<script>", results[4]["note"]["text"])
+        self.assertEqual(notes["n2"].text, "Two!")
+        self.assertIn("private", notes)
+        self.assertNotIn("n3", notes)
+
+    def test_batch_size_limit(self):
+        token = self.register_and_login()
+        operations = [{"op": "read", "id": "n"}] * (
+            app.config["API_BATCH_MAX_SIZE"] + 1
+        )
+        response = self.client.post(
+            "/api/notes/batch",
+            json={"operations": operations},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        self.assertEqual(response.status_code, 413)
+
+        response = self.client.post(
+            "/api/notes/batch",
+            json={"ops": []},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # Every JSON route wants an object, not an array
+        notes.create("n", "Text", "testuser", False)
+        for method, url in (
+            ("post", "/api/notes/batch"),
+            ("post", "/api/notes"),
+            ("put", "/api/notes/n"),
+            ("post", "/api/register"),
+            ("post", "/api/login"),
+        ):
+            response = getattr(self.client, method)(
+                url,
+                json=[{"op": "read", "id": "n"}],
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            self.assertEqual(response.status_code, 400, url)
+
+    def test_export_and_import(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        notes.create("mine-b", "Second", "testuser", False)
+        notes.create("mine-a", "First", "testuser", True)
+        notes.create("theirs", "Public, not mine", "otheruser", True)
+
+        response = self.client.get("/api/notes/export", headers=headers)
+        archive = response.data
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in archive.splitlines()]
+        self.assertEqual([line["id"] for line in lines], ["mine-a", "mine-b"])
+        self.assertEqual(lines[1]["text"], "Second")
+        self.assertFalse(lines[1]["isPublic"])
+
+        # Restore the archive as another user
+        notes.delete("mine-a")
+        notes.delete("mine-b")
+        other = self.register_and_login("otheruser", "otherpass")
+        with mock.patch.dict(app.config, {"API_IMPORT_CHUNK_SIZE": 1}):
+            response = self.client.post(
+                "/api/notes/import",
+                data=archive,
+                headers={"Authorization": f"Bearer {other}"},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {"imported": 2, "failed": 0, "errors": []})
+        self.assertEqual(notes["mine-b"].author, "otheruser")
+        self.assertFalse(notes["mine-b"].is_public)
+
+    def test_import_errors(self):
+        token = self.register_and_login()
+        notes.create("taken", "Exists", "otheruser", True)
+        body = "\n".join(
+            [
+                json.dumps({"id": "n1", "text": "<b>One</b><script>x</script>"}),
+                "",
+                "{not json",
+                json.dumps({"id": "taken", "text": "Duplicate"}),
+                json.dumps({"id": "n2"}),
+                json.dumps(["n3", "text"]),
+                json.dumps({"id": "n4", "text": "x" * 100}),
+                json.dumps({"id": "n6", "text": 5}),
+                json.dumps({"id": "n5", "text": "Last", "isPublic": True}),
+            ]
+        )
+        with mock.patch.dict(app.config, {"API_IMPORT_MAX_LINE": 64}):
+            response = self.client.post(
+                "/api/notes/import",
+                data=body,
+                headers={"Authorization": f"Bearer {token}"},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["imported"], 2)
+        self.assertEqual(response.json["failed"], 6)
+        self.assertEqual(
+            [(error["line"], error["status"]) for error in response.json["errors"]],
+            [(3, 400), (4, 409), (5, 400), (6, 400), (7, 413), (8, 400)],
+        )
+        self.assertNotIn("<script>", notes["n1"].text)
+        self.assertTrue(notes["n5"].is_public)
+        self.assertNotIn("n4", notes)
+
+        response = self.client.post("/api/notes/import", data=body)
+        self.assertEqual(response.status_code, 401)
+
+    def test_note_expiry(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        for expires_in in ("60", 0, -5, True, pastebin.MAX_EXPIRES_IN + 1):
+            response = self.client.post(
+                "/api/notes",
+                json={"id": "bad", "text": "text", "expiresIn": expires_in},
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertNotIn("bad", notes)
+
+        response = self.client.post(
+            "/api/notes",
+            json={"id": "brief", "text": "Gone soon", "expiresIn": 60},
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.get("/api/notes/brief", headers=headers)
+        self.assertAlmostEqual(response.json["expiresAt"], time.time() + 60, delta=5)
+
+        # Expired notes 404 at once, before the sweep deletes them
+        later = time.time() + 61
+        with mock.patch.object(notes, "_clock", lambda: later):
+            response = self.client.get("/api/notes/brief", headers=headers)
+            self.assertEqual(response.status_code, 404)
+            response = self.client.put(
+                "/api/notes/brief",
+                json={"text": "x", "isPublic": True},
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 404)
+            response = self.client.post(
+                "/api/notes",
+                json={"id": "brief", "text": "Reused"},
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertIsNone(notes["brief"].expires_at)
+
+        # Imports carry the expiry over, and skip notes that have expired
+        body = "\n".join(
+            json.dumps({"id": note_id, "text": "text", "expiresAt": expires_at})
+            for note_id, expires_at in (("kept", time.time() + 100), ("old", 1.0))
+        )
+        response = self.client.post("/api/notes/import", data=body, headers=headers)
+        self.assertEqual((response.json["imported"], response.json["failed"]), (1, 1))
+        self.assertAlmostEqual(notes["kept"].expires_at, time.time() + 100, delta=5)
+
+        # The HTML form takes the same field
+        with self.client.session_transaction() as sess:
+            sess["user_id"] = "testuser"
+        with mock.patch.dict(app.config, {"WTF_CSRF_ENABLED": False}):
+            self.client.post(
+                "/notes/create",
+                data={"note_id": "form", "text": "From the form", "expires_in": "30"},
+            )
+        self.assertAlmostEqual(notes["form"].expires_at, time.time() + 30, delta=5)
+
+    def test_write_races(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        notes.create("mine", "Original", "testuser", False)
+
+        # Another request rewrites the note after the permission check
+        def check_then_race(user, note_id):
+            notes.delete(note_id)
+            notes.create(note_id, "Someone else's now", "otheruser", False)
+            return True
+
+        for method in (self.client.put, self.client.delete):
+            with mock.patch.object(pastebin, "can_user_modify", check_then_race):
+                response = method(
+                    "/api/notes/mine",
+                    json={"text": "Mine", "isPublic": True},
+                    headers=headers,
+                )
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(notes["mine"].author, "otheruser")
+            self.assertFalse(notes["mine"].is_public)
+
+        # Another request creates the note, or registers the user, first
+        with mock.patch.object(pastebin, "sanitize_note_text") as sanitize:
+            sanitize.side_effect = lambda text: (
+                notes.create("new", "First", "otheruser", False),
+                (text, None),
+            )[1]
+            response = self.client.post(
+                "/api/notes", json={"id": "new", "text": "Second"}, headers=headers
+            )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(notes["new"].text, "First")
+
+        with mock.patch.object(pastebin.password_hasher, "hash") as hash_password:
+            hash_password.side_effect = lambda password: (
+                users.create("racer", "hash", "first-key"),
+                "hash",
+            )[1]
+            response = self.client.post(
+                "/api/register", json={"user_id": "racer", "password": "secret"}
+            )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(users.get("racer").api_key, "first-key")
+
+    def test_read_raw_note(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        text = "Ünïcode paste\n" + "line\n" * 1000
+        raw = text.encode("utf-8")
+        notes.create("paste", text, "testuser", False)
+        pastebin.raw_cache.clear()
+
+        response = self.client.get("/api/notes/paste/raw", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, "text/plain; charset=utf-8")
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+        self.assertEqual(response.data, raw)
+        etag = response.headers["ETag"]
+
+        # Ranges (and later reads) slice the cached bytes
+        response = self.client.get(
+            "/api/notes/paste/raw", headers={**headers, "Range": "bytes=0-6"}
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, raw[:7])
+        self.assertEqual(response.headers["Content-Range"], f"bytes 0-6/{len(raw)}")
+        response = self.client.get(
+            "/api/notes/paste/raw", headers={**headers, "Range": "bytes=-10"}
+        )
+        self.assertEqual(response.data, raw[-10:])
+        self.assertEqual(pastebin.raw_cache.stats()["hits"], 2)
+        response = self.client.get(
+            "/api/notes/paste/raw",
+            headers={**headers, "Range": f"bytes={len(raw)}-"},
+        )
+        self.assertEqual(response.status_code, 416)
+
+        response = self.client.head("/api/notes/paste/raw", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_length, len(raw))
+        self.assertEqual(response.data, b"")
+        response = self.client.get(
+            "/api/notes/paste/raw", headers={**headers, "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # An update changes the body and the ETag
+        notes.update("paste", "New text", False)
+        response = self.client.get(
+            "/api/notes/paste/raw", headers={**headers, "If-None-Match": etag}
+        )
+        self.assertEqual(response.data, b"New text")
+
+        other = self.register_and_login("otheruser", "otherpass")
+        response = self.client.get(
+            "/api/notes/paste/raw", headers={"Authorization": f"Bearer {other}"}
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get("/api/notes/paste/raw").status_code, 401)
+
+    def test_read_raw_public_note(self):
+        notes.create("public", "Shared", "testuser", True)
+        notes.create("private", "Secret", "testuser", False)
+
+        response = self.client.get("/api/public/notes/public/raw")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b"Shared")
+        response = self.client.get(
+            "/api/public/notes/public/raw", headers={"Range": "bytes=2-"}
+        )
+        self.assertEqual(response.data, b"ared")
+        for note_id in ("private", "missing"):
+            response = self.client.get(f"/api/public/notes/{note_id}/raw")
+            self.assertEqual(response.status_code, 404)
+
+    def test_raw_and_json_have_distinct_etags(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"}
+        text = "A line of a large log file\n" * 1000
+        notes.create("log", text, "testuser", True)
+
+        response = self.client.get("/api/notes/log", headers=headers)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        etag = response.headers["ETag"]
+        for url in ("/api/notes/log/raw", "/api/public/notes/log/raw"):
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.content_type, "text/plain; charset=utf-8")
+            self.assertNotEqual(response.headers["ETag"], etag)
+            self.assertEqual(gzip.decompress(response.data).decode("utf-8"), text)
+            response = self.client.get(url, headers={**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+
+    def test_note_json_serialized_on_write(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        notes.create("a", "First <b>note</b>", "testuser", True)
+        notes.create("b", "Second", "testuser", False)
+        self.assertEqual(
+            pastebin.note_json_cache.get("a")[1],
+            json.dumps(pastebin.note_as_dict("a", notes["a"])).encode(),
+        )
+
+        # Reads and listings only join the bytes serialized at write time
+        with mock.patch.object(pastebin, "note_as_dict") as note_as_dict:
+            read = self.client.get("/api/notes/a", headers=headers)
+            listing = self.client.get("/api/notes", headers=headers)
+            streamed = self.client.get("/api/notes?stream=1", headers=headers)
+            note_as_dict.assert_not_called()
+        self.assertEqual(read.json["text"], "First <b>note</b>")
+        self.assertEqual(listing.data, streamed.data)
+        self.assertEqual(
+            listing.data,
+            json.dumps(
+                [pastebin.note_as_dict(i, notes[i]) for i in ("a", "b")]
+            ).encode(),
+        )
+
+        notes.update("a", "Updated", True)
+        response = self.client.get("/api/notes/a", headers=headers)
+        self.assertEqual(response.json["text"], "Updated")
+        notes.delete("b")
+        self.assertIsNone(pastebin.note_json_cache.get("b"))
+
+        # A note written by another process is serialized on its first read
+        pastebin.note_json_cache.clear()
+        response = self.client.get("/api/notes/a", headers=headers)
+        self.assertEqual(response.json["text"], "Updated")
+        self.assertIsNotNone(pastebin.note_json_cache.get("a"))
+
+        # Notes large enough to be stored compressed are serialized on read
+        text = "x" * app.config["NOTE_COMPRESS_THRESHOLD"]
+        notes.create("big", text, "testuser", True)
+        self.assertIsNone(pastebin.note_json_cache.get("big"))
+        response = self.client.get("/api/notes/big", headers=headers)
+        self.assertEqual(response.json["text"], text)
+        self.assertIsNotNone(pastebin.note_json_cache.get("big"))
+        notes.update("big", text + "y", True)
+        self.assertIsNone(pastebin.note_json_cache.get("big"))
+
     def test_unauthorized_access(self):
         token = self.register_and_login()
         self.client.post(
@@ -207,6 +983,343 @@ class TestPastebin(TestCase):
         )
         self.assertNotIn("<script>", response.json["text"])
 
+    def test_sanitize_fast_path_matches_sanitizer(self):
+        rng = random.Random(42)
+        alphabet = "".join(chr(c) for c in range(1, 128) if chr(c) not in "<>&")
+        samples = ["", " ", "  hello   world  ", "a\r\nb\tc\x0bd", "- item"]
+        samples += [
+            "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 80)))
+            for _ in range(200)
+        ]
+        fast_path_hits = pastebin.sanitize_fast_path_hits
+        for sample in samples:
+            self.assertEqual(sanitize_input(sample), sanitizer.sanitize(sample))
+        self.assertEqual(
+            pastebin.sanitize_fast_path_hits - fast_path_hits, len(samples)
+        )
+
+    def test_sanitize_cache(self):
+        sanitize_cache.clear()
+        markup = '<b>bold</b><script>alert("XSS");</script>'
+
+        self.assertEqual(sanitize_input(markup), sanitizer.sanitize(markup))
+        self.assertEqual(sanitize_cache.stats()["misses"], 1)
+        self.assertEqual(sanitize_input(markup), sanitizer.sanitize(markup))
+        self.assertEqual(sanitize_cache.stats()["hits"], 1)
+
+        # Non-ASCII text goes through the sanitizer (and its NFKC normalization)
+        self.assertEqual(sanitize_input("ﬁ café"), sanitizer.sanitize("ﬁ café"))
+
+        # The cached output is bounded by total size as well as by count
+        self.assertEqual(
+            sanitize_cache.stats()["bytes"],
+            len(sanitizer.sanitize(markup)) + len(sanitizer.sanitize("ﬁ café")),
+        )
+        with mock.patch.object(sanitize_cache, "maxbytes", 64):
+            sanitize_input(markup * 10)
+        self.assertEqual(len(sanitize_cache), 2)
+
+    def test_identical_notes_share_text(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        trace = "<pre>Traceback (most recent call last):</pre>\n" * 20
+        self.client.post("/api/notes", json={"id": "a", "text": trace}, headers=headers)
+
+        # The stored note's text is reused without running the sanitizer
+        sanitize_cache.clear()
+        with mock.patch.object(pastebin, "get_sanitizer") as get_sanitizer:
+            self.client.post(
+                "/api/notes", json={"id": "b", "text": trace}, headers=headers
+            )
+            self.client.post(
+                "/api/notes/batch",
+                json={"operations": [{"op": "create", "id": "c", "text": trace}]},
+                headers=headers,
+            )
+        get_sanitizer.assert_not_called()
+        self.assertIs(notes["a"].text, notes["b"].text)
+        self.assertIs(notes["a"].text, notes["c"].text)
+        stats = notes.memory_stats()
+        self.assertEqual(stats["blobs"], 1)
+        self.assertAlmostEqual(stats["dedup_ratio"], 3.0)
+
+        for note_id in ("a", "b", "c"):
+            self.client.delete(f"/api/notes/{note_id}", headers=headers)
+        self.assertEqual(notes.memory_stats()["blobs"], 0)
+        self.assertIsNone(notes.text_for_source(pastebin._sanitize(trace)[1]))
+
+    def test_token_cache(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        token_cache.clear()
+
+        self.client.get("/api/users/testuser", headers=headers)
+        self.client.get("/api/users/testuser", headers=headers)
+        self.assertEqual(token_cache.stats()["hits"], 1)
+
+        # Cached tokens still expire
+        with mock.patch("pastebin.time.time", return_value=time.time() + 7200):
+            response = self.client.get("/api/users/testuser", headers=headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data, b"Token has expired")
+
+    def test_token_cache_dropped_on_secret_change(self):
+        token = self.register_and_login()
+        headers = {"Authorization": f"Bearer {token}"}
+        response = self.client.get("/api/users/testuser", headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        with mock.patch(
+            "pastebin.SECRET_KEY", "rotated-secret-that-is-long-enough-for-hs256"
+        ):
+            response = self.client.get("/api/users/testuser", headers=headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data, b"Invalid token")
+
+    def test_login_rate_limited(self):
+        self.client.post(
+            "/api/register", json={"user_id": "testuser", "password": "testpass"}
+        )
+        with mock.patch.dict(app.config["RATE_LIMITS"], {"api_login": (1 / 60, 2)}):
+            for _ in range(2):
+                response = self.client.post(
+                    "/api/login", json={"user_id": "testuser", "password": "testpass"}
+                )
+                self.assertEqual(response.status_code, 200)
+            response = self.client.post(
+                "/api/login", json={"user_id": "testuser", "password": "testpass"}
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "60")
+
+        # Other endpoints have their own buckets, and pages are not limited
+        self.assertEqual(self.client.get("/api/notes/missing").status_code, 401)
+        self.assertEqual(self.client.get("/login").status_code, 200)
+
+    def test_rate_limited_per_user(self):
+        alice = {"Authorization": f"Bearer {self.register_and_login('alice')}"}
+        bob = {"Authorization": f"Bearer {self.register_and_login('bob')}"}
+        with mock.patch.dict(app.config["RATE_LIMITS"], {"api_list_notes": (1, 1)}):
+            self.assertEqual(
+                self.client.get("/api/notes", headers=alice).status_code, 200
+            )
+            self.assertEqual(
+                self.client.get("/api/notes", headers=alice).status_code, 429
+            )
+            self.assertEqual(
+                self.client.get("/api/notes", headers=bob).status_code, 200
+            )
+
+    def test_overload_shed(self):
+        token = self.register_and_login()
+        with mock.patch.object(pastebin.in_flight, "limit", 1), mock.patch.object(
+            pastebin.in_flight, "active", 1
+        ):
+            response = self.client.get(
+                "/api/notes", headers={"Authorization": f"Bearer {token}"}
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(pastebin.in_flight.active, 0)
+        with mock.patch.dict(app.config, METRICS_TOKEN="scrape-secret"):
+            response = self.client.get(
+                "/metrics", headers={"Authorization": "Bearer scrape-secret"}
+            )
+        self.assertIn(
+            'pastebin_requests_shed_total{reason="overloaded"}',
+            response.get_data(as_text=True),
+        )
+
+    def test_notes_page_cached(self):
+        notes.create("mine", "<p>Hello <b>there</b> &amp; welcome</p>", "alice", False)
+        notes.create("other", "Someone else's", "bob", False)
+        with self.client.session_transaction() as sess:
+            sess["user_id"] = "alice"
+
+        with mock.patch(
+            "pastebin.render_template", wraps=pastebin.render_template
+        ) as render:
+            page = self.client.get("/notes").get_data(as_text=True)
+            self.assertEqual(self.client.get("/notes").get_data(as_text=True), page)
+            self.assertEqual(render.call_count, 1)
+            self.assertIn("- Hello there &amp; welcome", page)
+            self.assertNotIn("other", page)
+
+            # Any write that changes the listing invalidates the page
+            notes.create("public", "x" * 60, "bob", True)
+            page = self.client.get("/notes").get_data(as_text=True)
+            self.assertEqual(render.call_count, 2)
+            self.assertIn("- " + "x" * 50 + "...", page)
+
+            # Pages with flashed messages are rendered, not cached
+            with self.client.session_transaction() as sess:
+                sess["_flashes"] = [("success", "Note created successfully!")]
+            page = self.client.get("/notes").get_data(as_text=True)
+            self.assertIn("Note created successfully!", page)
+            self.assertNotIn(
+                "Note created successfully!",
+                self.client.get("/notes").get_data(as_text=True),
+            )
+
+            # Pages larger than the cache's byte budget are not cached
+            pastebin.notes_page_cache.clear()
+            rendered = render.call_count
+            with mock.patch.object(pastebin.notes_page_cache, "maxbytes", 100):
+                self.client.get("/notes")
+                self.client.get("/notes")
+            self.assertEqual(render.call_count, rendered + 2)
+            self.assertEqual(len(pastebin.notes_page_cache), 0)
+
+    def test_passwords_hashed(self):
+        self.register_and_login()
+        stored = users.get("testuser").password
+        self.assertTrue(stored.startswith("scrypt$2$8$1$"))
+        self.assertNotIn("testpass", stored)
+
+        response = self.client.post(
+            "/api/login", json={"user_id": "testuser", "password": "wrongpass"}
+        )
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post(
+            "/api/login", json={"user_id": "nobody", "password": "testpass"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_password_hash_upgraded(self):
+        self.register_and_login()
+        with mock.patch.object(pastebin.password_hasher, "n", 4):
+            self.register_and_login()
+        self.assertTrue(users.get("testuser").password.startswith("scrypt$4$"))
+
+        # Plaintext passwords from before hashing are upgraded too
+        users.create("legacy", "oldpass", "key")
+        response = self.client.post(
+            "/api/login", json={"user_id": "legacy", "password": "oldpass"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(users.get("legacy").password.startswith("scrypt$"))
+
+    def test_password_hasher_busy(self):
+        self.client.post(
+            "/api/register", json={"user_id": "testuser", "password": "testpass"}
+        )
+        with mock.patch.object(
+            pastebin.password_hasher._pending, "acquire", return_value=False
+        ):
+            response = self.client.post(
+                "/api/login", json={"user_id": "testuser", "password": "testpass"}
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+
+class TestAppFactory(unittest.TestCase):
+    def setUp(self):
+        users.clear()
+        notes.clear()
+        pastebin.rate_limiter.clear()
+
+    def test_config_overrides(self):
+        small = pastebin.create_app({"API_BATCH_MAX_SIZE": 1})
+        self.assertEqual(small.config["API_BATCH_MAX_SIZE"], 1)
+        self.assertNotEqual(app.config["API_BATCH_MAX_SIZE"], 1)
+
+        # Apps share the stores; each gets every route under its usual name
+        notes.create("shared", "Shared note", "alice", True)
+        self.assertEqual(small.url_map.bind("").build("list_notes"), "/notes")
+        with mock.patch.object(pastebin.password_hasher, "n", 2):
+            client = small.test_client()
+            client.post("/api/register", json={"user_id": "alice", "password": "pw"})
+            token = client.post(
+                "/api/login", json={"user_id": "alice", "password": "pw"}
+            ).json["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        self.assertEqual(
+            client.get("/api/notes/shared", headers=headers).status_code, 200
+        )
+        operations = [{"op": "delete", "note_id": "shared"}] * 2
+        response = client.post(
+            "/api/notes/batch", json={"operations": operations}, headers=headers
+        )
+        self.assertEqual(response.status_code, 413)
+
+    def test_heavy_imports_are_lazy(self):
+        script = (
+            "import sys, pastebin\n"
+            "app = pastebin.create_app()\n"
+            "lazy = ['forms', 'wtforms', 'flask_wtf', 'html_sanitizer']\n"
+            "print(sorted(m for m in lazy if m in sys.modules))\n"
+            "app.test_client().get('/login')\n"
+            "pastebin.sanitize_input('<b>x</b>')\n"
+            "print(sorted(m for m in lazy if m in sys.modules))\n"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env={**os.environ, "LOG_LEVEL": "ERROR"},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.splitlines()
+        self.assertEqual(output[0], "[]")
+        self.assertEqual(
+            output[1], "['flask_wtf', 'forms', 'html_sanitizer', 'wtforms']"
+        )
+
+    def test_expiry_sweeper_starts_with_first_request(self):
+        # A preloading master creates the app but serves no requests, so it
+        # must not sweep (and write to) the stores its workers use
+        script = (
+            "import threading, pastebin\n"
+            "app = pastebin.create_app()\n"
+            "sweeping = lambda: sum(t.name == 'expiry-sweep'"
+            " for t in threading.enumerate())\n"
+            "print(sweeping())\n"
+            "app.test_client().get('/login')\n"
+            "app.test_client().get('/login')\n"
+            "print(sweeping())\n"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env={**os.environ, "LOG_LEVEL": "ERROR"},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.splitlines()
+        self.assertEqual(output, ["0", "1"])
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs os.fork")
+    def test_forked_worker_serves_requests(self):
+        # Start the password hashing threads, which the child does not inherit
+        pastebin.password_hasher.n = 2
+        self.addCleanup(setattr, pastebin.password_hasher, "n", 2**14)
+        pastebin.password_hasher.hash("warm up")
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                client = app.test_client()
+                response = client.post(
+                    "/api/register", json={"user_id": "child", "password": "pw"}
+                )
+                os.write(write_fd, str(response.status_code).encode())
+                status = 0
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+        ready, _, _ = select.select([read_fd], [], [], 10)
+        if not ready:
+            os.kill(pid, 9)
+        result = os.read(read_fd, 16) if ready else b"timeout"
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        self.assertEqual(result, b"201")
+        # The child's writes stay in the child
+        self.assertNotIn("child", users)
+
 
 if __name__ == "__main__":
     unittest.main()
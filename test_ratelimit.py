@@ -0,0 +1,78 @@
+import unittest
+
+from ratelimit import ConcurrencyLimiter, RateLimiter, parse_rate_limits, retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(clock=self.clock)
+
+    def test_burst_then_refill(self):
+        for _ in range(3):
+            self.assertEqual(self.limiter.acquire("alice", rate=1, burst=3), 0)
+        self.assertAlmostEqual(self.limiter.acquire("alice", rate=1, burst=3), 1.0)
+
+        self.clock.now = 0.5
+        self.assertAlmostEqual(self.limiter.acquire("alice", rate=1, burst=3), 0.5)
+        self.clock.now = 1.0
+        self.assertEqual(self.limiter.acquire("alice", rate=1, burst=3), 0)
+
+        # Refills never exceed the burst size
+        self.clock.now = 100.0
+        for _ in range(3):
+            self.assertEqual(self.limiter.acquire("alice", rate=1, burst=3), 0)
+        self.assertGreater(self.limiter.acquire("alice", rate=1, burst=3), 0)
+
+    def test_keys_are_independent(self):
+        self.assertEqual(self.limiter.acquire("alice", rate=1, burst=1), 0)
+        self.assertGreater(self.limiter.acquire("alice", rate=1, burst=1), 0)
+        self.assertEqual(self.limiter.acquire("bob", rate=1, burst=1), 0)
+
+    def test_bounded(self):
+        limiter = RateLimiter(maxsize=2, clock=self.clock)
+        for key in ("a", "b", "c"):
+            limiter.acquire(key, rate=1, burst=1)
+        self.assertEqual(len(limiter), 2)
+        # "a" was evicted, so it starts again with a full bucket
+        self.assertEqual(limiter.acquire("a", rate=1, burst=1), 0)
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+    def test_cap(self):
+        limiter = ConcurrencyLimiter(2)
+        self.assertTrue(limiter.try_acquire())
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        limiter.release()
+        self.assertTrue(limiter.try_acquire())
+        self.assertEqual(limiter.rejected, 1)
+
+    def test_zero_disables(self):
+        limiter = ConcurrencyLimiter(0)
+        self.assertTrue(all(limiter.try_acquire() for _ in range(100)))
+
+
+class TestHelpers(unittest.TestCase):
+    def test_parse_rate_limits(self):
+        self.assertEqual(
+            parse_rate_limits("api_login=10/60, default=50/1,api_x=5"),
+            {"api_login": (10 / 60, 10), "default": (50.0, 50), "api_x": (5.0, 5)},
+        )
+        self.assertEqual(parse_rate_limits(""), {})
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after(0.2), "1")
+        self.assertEqual(retry_after(5.5), "6")
+
+
+if __name__ == "__main__":
+    unittest.main()
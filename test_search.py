@@ -0,0 +1,81 @@
+import threading
+import unittest
+from unittest import mock
+
+from search import SearchIndex, tokenize
+from storage import Note
+
+
+def note(text, author="alice", is_public=True):
+    return Note(text, author, is_public, 1)
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex()
+
+    def test_tokenize(self):
+        self.assertEqual(
+            tokenize("<p>Hello, <strong>World</strong> &amp; co</p>"),
+            ["hello", "world", "co"],
+        )
+
+    def test_all_terms_must_match(self):
+        self.index.update("a", note("disk full on db host"))
+        self.index.update("b", note("disk quota on web host"))
+        self.assertEqual(self.index.search("disk host", "bob")[0], 2)
+        self.assertEqual(self.index.search("DISK full", "bob"), (1, [("a", mock.ANY)]))
+        self.assertEqual(self.index.search("missing disk", "bob"), (0, []))
+
+    def test_ranking_and_pagination(self):
+        self.index.update("a", note("error"))
+        self.index.update("b", note("error error error"))
+        self.index.update("c", note("error error"))
+        self.index.update("d", note("nothing to see"))
+
+        total, hits = self.index.search("error", "bob")
+        self.assertEqual(total, 3)
+        self.assertEqual([note_id for note_id, _ in hits], ["b", "c", "a"])
+        total, hits = self.index.search("error", "bob", offset=1, limit=1)
+        self.assertEqual([note_id for note_id, _ in hits], ["c"])
+
+    def test_visibility(self):
+        self.index.update("a", note("secret plans", author="alice", is_public=False))
+        self.assertEqual(self.index.search("secret", "alice")[0], 1)
+        self.assertEqual(self.index.search("secret", "bob")[0], 0)
+
+    def test_update_delete_and_clear(self):
+        self.index.update("a", note("old words"))
+        self.index.update("a", note("new words"))
+        self.assertEqual(self.index.search("old", "bob")[0], 0)
+        self.assertEqual(self.index.search("new", "bob")[0], 1)
+
+        self.index.update("a", None)
+        self.assertEqual(self.index.search("words", "bob")[0], 0)
+        self.assertEqual(len(self.index), 0)
+
+        self.index.rebuild([("b", note("rebuilt"))])
+        self.assertEqual(self.index.search("rebuilt", "bob")[0], 1)
+        self.index.update(None, None)
+        self.assertEqual(len(self.index), 0)
+
+    def test_tokenized_outside_the_lock(self):
+        tokenized = threading.Event()
+
+        def tokenize_and_signal(text):
+            tokenized.set()
+            return tokenize(text)
+
+        # Another writer holds the index lock while this one tokenizes
+        thread = threading.Thread(
+            target=self.index.update, args=("a", note("some words"))
+        )
+        with self.index._lock, mock.patch("search.tokenize", tokenize_and_signal):
+            thread.start()
+            self.assertTrue(tokenized.wait(5))
+        thread.join()
+        self.assertEqual(self.index.search("words", "bob")[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,499 @@
+import base64
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from search import SearchIndex
+from storage import CompressedNote, ExpirySweeper, open_stores
+
+THREADS = 8
+
+
+def run_threads(target, count=THREADS):
+    """Run ``target(i)`` on ``count`` threads at once and wait for them all."""
+    barrier = threading.Barrier(count)
+
+    def run(i):
+        barrier.wait()
+        target(i)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class StoreTests:
+    """Behaviour shared by every storage backend."""
+
+    def open_stores(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.notes, self.users = self.open_stores()
+
+    def test_note_crud(self):
+        self.notes.create("note1", "Hello", "alice", True)
+        self.assertIn("note1", self.notes)
+        note = self.notes.get("note1")
+        self.assertEqual(
+            (note.text, note.author, note.is_public),
+            ("Hello", "alice", True),
+        )
+
+        self.notes.update("note1", "Updated", False)
+        self.assertEqual(self.notes["note1"].text, "Updated")
+        self.assertEqual(self.notes["note1"].is_public, False)
+        self.assertGreater(self.notes["note1"].version, note.version)
+
+        self.notes.delete("note1")
+        self.assertNotIn("note1", self.notes)
+        self.assertIsNone(self.notes.get("note1"))
+        self.assertEqual(len(self.notes), 0)
+
+    def test_visible_ids(self):
+        self.notes.create("a", "text", "alice", False)
+        self.notes.create("b", "text", "bob", True)
+        self.notes.create("c", "text", "bob", False)
+        self.notes.create("d", "text", "alice", True)
+
+        self.assertEqual(self.notes.visible_ids("alice"), ["a", "b", "d"])
+        self.assertEqual(self.notes.visible_ids("bob"), ["b", "c", "d"])
+        self.assertEqual(self.notes.visible_ids("carol"), ["b", "d"])
+        self.assertEqual(self.notes.visible_ids("alice", after="a", limit=1), ["b"])
+
+        self.notes.update("b", "text", False)
+        self.notes.delete("d")
+        self.assertEqual(self.notes.visible_ids("alice"), ["a"])
+
+    def test_author_ids(self):
+        for note_id in ("c", "a", "d", "b"):
+            self.notes.create(note_id, "text", "alice", note_id == "b")
+        self.notes.create("e", "text", "bob", True)
+
+        self.assertEqual(self.notes.author_ids("alice"), ["a", "b", "c", "d"])
+        self.assertEqual(self.notes.author_ids("alice", limit=2), ["a", "b"])
+        self.assertEqual(self.notes.author_ids("alice", after="b", limit=5), ["c", "d"])
+        self.assertEqual(self.notes.author_ids("carol"), [])
+
+    def test_listing_version(self):
+        alice, bob = self.notes.listing_version("alice"), self.notes.listing_version(
+            "bob"
+        )
+
+        # A private note only changes its author's listing
+        self.notes.create("a", "text", "alice", False)
+        self.assertNotEqual(self.notes.listing_version("alice"), alice)
+        self.assertEqual(self.notes.listing_version("bob"), bob)
+
+        # A public note changes everyone's listing
+        alice = self.notes.listing_version("alice")
+        self.notes.create("b", "text", "carol", True)
+        self.assertNotEqual(self.notes.listing_version("alice"), alice)
+        self.assertNotEqual(self.notes.listing_version("bob"), bob)
+
+        # So does making it private again, and clearing the store
+        bob = self.notes.listing_version("bob")
+        self.notes.update("b", "text", False)
+        self.assertNotEqual(self.notes.listing_version("bob"), bob)
+        alice = self.notes.listing_version("alice")
+        self.notes.clear()
+        self.assertNotEqual(self.notes.listing_version("alice"), alice)
+
+    def test_transaction(self):
+        with self.notes.transaction():
+            self.notes.create("a", "text", "alice", False)
+            with self.notes.transaction():  # Nested transactions are allowed
+                self.notes.create("b", "text", "alice", False)
+        self.assertEqual(self.notes.visible_ids("alice"), ["a", "b"])
+
+    def test_expiry(self):
+        now = 1000.0
+        self.notes._clock = lambda: now
+        self.notes.create("a", "text", "alice", True, expires_at=1010.0)
+        self.notes.create("b", "text", "alice", False, expires_at=1005.0)
+        self.notes.create("c", "text", "alice", False)
+        self.notes.update("a", "updated", True)  # Keeps its expiry
+        self.assertEqual(self.notes["a"].expires_at, 1010.0)
+        self.assertIsNone(self.notes["c"].expires_at)
+        self.assertEqual(self.notes.expire(), 0)
+
+        # Listing versions change when a note expires, not only when swept
+        version = self.notes.listing_version("carol")
+        now = 1004.0
+        self.assertEqual(self.notes.listing_version("carol"), version)
+        now = 1005.0
+        expired = self.notes.listing_version("carol")
+        self.assertNotEqual(expired, version)
+        now = 1006.0
+        self.assertNotEqual(self.notes.listing_version("carol"), expired)
+
+        # Expired notes are hidden at once, and deleted by expire()
+        now = 1005.0
+        self.assertNotIn("b", self.notes)
+        version = self.notes.listing_version("alice")
+        self.assertEqual(self.notes.expire(), 1)
+        self.assertNotEqual(self.notes.listing_version("alice"), version)
+        self.assertEqual(self.notes.visible_ids("alice"), ["a", "c"])
+
+        # The ID of an expired note can be reused before it is deleted
+        now = 1020.0
+        self.notes.create("a", "again", "bob", False)
+        self.assertIsNone(self.notes["a"].expires_at)
+        self.assertEqual(self.notes.expire(), 0)
+        self.assertEqual(self.notes.visible_ids("alice"), ["c"])
+        self.assertEqual(self.notes.author_ids("bob"), ["a"])
+
+    def test_expire_in_batches(self):
+        self.notes._clock = lambda: 1000.0
+        for i in range(5):
+            self.notes.create(f"n{i}", "text", "alice", False, expires_at=990.0 + i)
+        self.notes.create("later", "text", "alice", False, expires_at=2000.0)
+        deleted = []
+        self.notes.subscribe(lambda note_id, note: deleted.append(note_id))
+
+        self.assertEqual(self.notes.expire(limit=2), 2)
+        self.assertEqual(deleted, ["n0", "n1"])  # Oldest expiry first
+        sweeper = ExpirySweeper(self.notes, interval=0, batch_size=2)
+        self.assertEqual(sweeper.sweep(), 3)
+        self.assertEqual(sweeper.expired, 3)
+        self.assertEqual(self.notes.author_ids("alice"), ["later"])
+
+    def test_insert_if_absent(self):
+        self.notes._clock = lambda: 1000.0
+        self.assertTrue(self.notes.insert_if_absent("a", "first", "alice", False))
+        self.assertFalse(self.notes.insert_if_absent("a", "second", "bob", True))
+        self.assertEqual(self.notes["a"].text, "first")
+        self.notes.create("b", "expired", "alice", False, expires_at=999.0)
+        self.assertTrue(self.notes.insert_if_absent("b", "fresh", "bob", False))
+        self.assertEqual(self.notes.author_ids("bob"), ["b"])
+
+    def test_compare_and_set(self):
+        self.notes.create("a", "text", "alice", False)
+        version = self.notes["a"].version
+        self.assertTrue(self.notes.compare_and_set("a", version, "new", True))
+        self.assertFalse(self.notes.compare_and_set("a", version, "stale", False))
+        self.assertFalse(self.notes.compare_and_set("missing", version, "x", False))
+        self.assertEqual(self.notes["a"].text, "new")
+
+        self.assertFalse(self.notes.compare_and_delete("a", version))
+        self.assertTrue(self.notes.compare_and_delete("a", self.notes["a"].version))
+        self.assertNotIn("a", self.notes)
+
+    def test_concurrent_inserts_not_lost(self):
+        winners = {}
+
+        def insert(i):
+            for n in range(50):
+                if self.notes.insert_if_absent(
+                    f"n{n:02d}", f"by {i}", f"user{i}", True
+                ):
+                    winners.setdefault(f"n{n:02d}", []).append(f"user{i}")
+
+        run_threads(insert)
+        self.assertEqual(len(winners), 50)
+        for note_id, authors in winners.items():
+            self.assertEqual(authors, [self.notes[note_id].author])
+        self.assertEqual(len(self.notes.visible_ids("nobody")), 50)
+
+    def test_concurrent_updates_not_lost(self):
+        self.notes.create("counter", "0", "alice", False)
+
+        def increment(i):
+            for _ in range(25):
+                while True:
+                    note = self.notes["counter"]
+                    text = str(int(note.text) + 1)
+                    if self.notes.compare_and_set("counter", note.version, text, False):
+                        break
+
+        run_threads(increment)
+        self.assertEqual(self.notes["counter"].text, str(THREADS * 25))
+
+    def test_concurrent_user_inserts(self):
+        inserted = []
+
+        def register(i):
+            for n in range(20):
+                if self.users.insert_if_absent(f"user{n}", f"hash{i}", f"key{i}"):
+                    inserted.append((f"user{n}", f"key{i}"))
+
+        run_threads(register)
+        self.assertEqual(len(inserted), 20)
+        for user_id, api_key in inserted:
+            self.assertEqual(self.users.get(user_id).api_key, api_key)
+
+    def test_users(self):
+        self.users.create("alice", "secret", "key")
+        self.assertIn("alice", self.users)
+        self.assertEqual(self.users.get("alice").api_key, "key")
+        self.assertIsNone(self.users.get("bob"))
+
+        self.users.clear()
+        self.assertNotIn("alice", self.users)
+
+
+class TestMemoryStores(StoreTests, unittest.TestCase):
+    def open_stores(self):
+        return open_stores("memory://")
+
+    def test_records_are_compact(self):
+        self.notes.create("a", "text", "".join(["ali", "ce"]), False)
+        self.notes.create("b", "text", "".join(["al", "ice"]), False)
+        note = self.notes["a"]
+        self.assertFalse(hasattr(note, "__dict__"))
+        self.assertIs(note.author, self.notes["b"].author)
+
+
+class TestMemoryCompression(StoreTests, unittest.TestCase):
+    def open_stores(self):
+        return open_stores("memory://", compress_threshold=100)
+
+    def test_large_texts_compressed(self):
+        text = "log line with some repetition\n" * 1000
+        self.notes.create("big", text, "alice", False)
+        self.notes.create("small", "short", "alice", False)
+
+        self.assertIsInstance(self.notes.get("big"), CompressedNote)
+        self.assertNotIsInstance(self.notes.get("small"), CompressedNote)
+        self.assertEqual(self.notes["big"].text, text)
+        self.assertEqual(self.notes["big"].author, "alice")
+
+        stats = self.notes.memory_stats()
+        self.assertEqual(stats["notes"], 2)
+        self.assertEqual(stats["compressed_notes"], 1)
+        self.assertEqual(stats["raw_bytes"], len(text) + len("short"))
+        self.assertLess(stats["stored_bytes"], stats["raw_bytes"] // 10)
+
+    def test_repeat_reads_cached(self):
+        text = "x" * 1000
+        self.notes.create("big", text, "alice", False)
+        self.notes["big"].text
+        self.notes["big"].text
+        self.assertEqual(self.notes.memory_stats()["body_cache"]["hits"], 1)
+
+        # A new version is never served from the old version's cache entry
+        self.notes.update("big", "y" * 1000, False)
+        self.assertEqual(self.notes["big"].text, "y" * 1000)
+
+    def test_accounting_follows_writes(self):
+        self.notes.create("big", "x" * 1000, "alice", False)
+        self.notes.update("big", "short", False)
+        stats = self.notes.memory_stats()
+        self.assertEqual(stats["compressed_notes"], 0)
+        self.assertEqual((stats["raw_bytes"], stats["stored_bytes"]), (5, 5))
+
+        self.notes.delete("big")
+        stats = self.notes.memory_stats()
+        self.assertEqual((stats["raw_bytes"], stats["stored_bytes"]), (0, 0))
+
+    def test_incompressible_text_stored_plain(self):
+        text = base64.b64encode(os.urandom(100)).decode()
+        self.notes.create("random", text, "alice", False)
+        self.assertNotIsInstance(self.notes.get("random"), CompressedNote)
+
+
+class TestMemoryDedup(StoreTests, unittest.TestCase):
+    def open_stores(self):
+        return open_stores("memory://", compress_threshold=1000, dedup_threshold=10)
+
+    def test_identical_texts_stored_once(self):
+        trace = "Traceback (most recent call last):\n" * 5
+        self.notes.create("a", trace, "alice", True)
+        self.notes.create("b", "Traceback (most recent call last):\n" * 5, "bob", True)
+        self.notes.create("c", "short", "bob", True)
+
+        self.assertIs(self.notes["a"].text, self.notes["b"].text)
+        stats = self.notes.memory_stats()
+        self.assertEqual(stats["blobs"], 1)  # "short" is under the threshold
+        self.assertEqual(stats["raw_bytes"], 2 * len(trace) + 5)
+        self.assertEqual(stats["unique_bytes"], len(trace) + 5)
+        self.assertEqual(stats["stored_bytes"], len(trace) + 5)
+        self.assertEqual(stats["dedup_saved_bytes"], len(trace))
+        self.assertAlmostEqual(
+            stats["dedup_ratio"], (2 * len(trace) + 5) / (len(trace) + 5)
+        )
+
+    def test_reference_counts_follow_writes(self):
+        text = "shared text " * 10
+        self.notes.create("a", text, "alice", False)
+        self.notes.create("b", text, "alice", False)
+        self.notes.update("a", "something else", False)
+        self.assertEqual(self.notes.memory_stats()["blobs"], 2)
+        self.notes.delete("b")
+        self.assertEqual(self.notes.memory_stats()["blobs"], 1)
+        self.notes.update("a", "something else", True)  # Same text, same blob
+        self.notes.create("a", "something else", "alice", True)
+        self.assertEqual(self.notes["a"].text, "something else")
+        self.notes.delete("a")
+
+        stats = self.notes.memory_stats()
+        self.assertEqual(stats["blobs"], 0)
+        self.assertEqual((stats["raw_bytes"], stats["stored_bytes"]), (0, 0))
+
+    def test_compressed_texts_shared(self):
+        text = "log line with some repetition\n" * 100
+        self.notes.create("a", text, "alice", False)
+        self.notes.create("b", text, "bob", False)
+        self.assertIsInstance(self.notes["a"], CompressedNote)
+        self.assertIs(self.notes["a"].body, self.notes["b"].body)
+        self.assertEqual(self.notes["b"].text, text)
+        self.notes.delete("a")
+        self.assertEqual(self.notes["b"].text, text)
+        self.assertEqual(self.notes.memory_stats()["compressed_notes"], 1)
+
+    def test_text_for_source(self):
+        self.notes.create("a", "sanitized text", "alice", False, source=b"raw-1")
+        self.notes.create("b", "sanitized text", "bob", False, source=b"raw-2")
+        self.assertEqual(self.notes.text_for_source(b"raw-1"), "sanitized text")
+        self.assertEqual(self.notes.text_for_source(b"raw-2"), "sanitized text")
+        self.assertIsNone(self.notes.text_for_source(b"unknown"))
+
+        # Sources are forgotten with the last note using the text
+        self.notes.delete("a")
+        self.assertEqual(self.notes.text_for_source(b"raw-1"), "sanitized text")
+        self.notes.update("b", "other text", False)
+        self.assertIsNone(self.notes.text_for_source(b"raw-1"))
+        self.assertIsNone(self.notes.text_for_source(b"raw-2"))
+
+
+class TestSQLiteStores(StoreTests, unittest.TestCase):
+    def open_stores(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "pastebin.db")
+        notes, users = open_stores(f"sqlite:///{self.path}")
+        self.addCleanup(notes.db.close)
+        return notes, users
+
+    def test_shared_between_stores_and_threads(self):
+        self.notes.create("note1", "Hello", "alice", True)
+
+        # A second store on the same file (e.g. another worker) sees the note
+        other_notes, _ = open_stores(f"sqlite:///{self.path}")
+        self.addCleanup(other_notes.db.close)
+        self.assertEqual(other_notes["note1"].text, "Hello")
+
+        # Other threads get their own connection
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(self.notes.get("note1")))
+        thread.start()
+        thread.join()
+        self.assertEqual(seen[0].author, "alice")
+
+    def test_transaction_rolled_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.notes.transaction():
+                self.notes.create("a", "text", "alice", False)
+                raise RuntimeError
+        self.assertNotIn("a", self.notes)
+
+    def test_migrated_notes_get_distinct_versions(self):
+        path = os.path.join(os.path.dirname(self.path), "old.db")
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE notes (id TEXT PRIMARY KEY, text TEXT NOT NULL,"
+            " author TEXT NOT NULL, is_public INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        conn.executemany(
+            "INSERT INTO notes VALUES (?, ?, ?, ?)",
+            [("a", "A", "alice", 0), ("b", "B", "bob", 1)],
+        )
+        conn.commit()
+        conn.close()
+
+        notes, _ = open_stores(f"sqlite:///{path}")
+        self.addCleanup(notes.db.close)
+        versions = {notes["a"].version, notes["b"].version}
+        self.assertEqual(len(versions), 2)
+        self.assertNotIn(0, versions)
+        # Later writes take versions past the migrated ones
+        notes.create("c", "C", "carol", True)
+        self.assertGreater(notes["c"].version, max(versions))
+
+    def test_search_shared_between_stores(self):
+        # A second store on the same file (e.g. another worker) searches the
+        # notes the first one writes
+        other_notes, _ = open_stores(f"sqlite:///{self.path}")
+        self.addCleanup(other_notes.db.close)
+        self.notes.create("a", "disk full on db host", "alice", True)
+        self.notes.create("b", "<p>Disk quota &amp; web host</p>", "bob", False)
+        self.assertEqual(
+            other_notes.search("disk host", "carol"), (1, [("a", mock.ANY)])
+        )
+        self.assertEqual(other_notes.search("DISK host", "bob")[0], 2)
+        self.assertEqual(other_notes.search("missing disk", "bob"), (0, []))
+
+        self.notes.update("a", "disk replaced", True)
+        self.assertEqual(other_notes.search("host", "carol"), (0, []))
+        self.notes.delete("b")
+        self.assertEqual(other_notes.search("quota", "bob"), (0, []))
+        self.notes.create("c", "temporary disk", "alice", True, expires_at=0)
+        self.assertEqual(other_notes.search("disk", "bob")[0], 1)
+        conn = self.notes.db.connection()
+        # Indexed notes, and their count and total length as kept in versions
+        sizes = (
+            "SELECT COUNT(*), SUM(length), (SELECT value FROM versions"
+            " WHERE name = 'search_docs'), (SELECT value FROM versions"
+            " WHERE name = 'search_length') FROM search_docs"
+        )
+        self.notes.expire()
+        self.assertEqual(conn.execute(sizes).fetchone(), (1, 2, 1, 2))
+        self.notes.clear()
+        self.assertEqual(other_notes.search("disk", "bob"), (0, []))
+        self.assertEqual(conn.execute(sizes).fetchone(), (0, None, 0, 0))
+
+    def test_search_ranked_like_search_index(self):
+        texts = [
+            "error",
+            "error error error",
+            "error error",
+            "nothing to see",
+            "error at disk",
+        ]
+        for i, text in enumerate(texts):
+            self.notes.create(f"n{i}", text, "alice", i % 2 == 0)
+        self.notes.update("n1", "error error error warning", False)
+        index = SearchIndex()
+        index.rebuild(self.notes.items())
+        for query, user, offset in [
+            ("error", "alice", 0),
+            ("error", "bob", 0),
+            ("error disk", "bob", 0),
+            ("error", "alice", 1),
+        ]:
+            total, hits = self.notes.search(query, user, offset, 2)
+            expected_total, expected = index.search(query, user, offset, 2)
+            self.assertEqual(total, expected_total)
+            self.assertEqual(
+                [note_id for note_id, _ in hits], [note_id for note_id, _ in expected]
+            )
+            for (_, score), (_, expected_score) in zip(hits, expected):
+                self.assertAlmostEqual(score, expected_score)
+
+    def test_migrated_notes_searchable(self):
+        path = os.path.join(os.path.dirname(self.path), "old.db")
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE notes (id TEXT PRIMARY KEY, text TEXT NOT NULL,"
+            " author TEXT NOT NULL, is_public INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        conn.execute("INSERT INTO notes VALUES ('a', 'Old words', 'alice', 1)")
+        conn.commit()
+        conn.close()
+
+        notes, _ = open_stores(f"sqlite:///{path}")
+        self.addCleanup(notes.db.close)
+        self.assertEqual(notes.search("old", "bob"), (1, [("a", mock.ANY)]))
+
+    def test_wal_mode(self):
+        mode = self.notes.db.connection().execute("PRAGMA journal_mode").fetchone()
+        self.assertEqual(mode[0], "wal")
+
+
+if __name__ == "__main__":
+    unittest.main()
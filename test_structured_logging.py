@@ -0,0 +1,65 @@
+import json
+import logging
+import queue
+import unittest
+
+from structured_logging import (
+    AsyncQueueHandler,
+    JsonFormatter,
+    SamplingFilter,
+    parse_sample_rates,
+)
+
+
+def make_record(
+    level=logging.INFO, msg="User '%s' read note", args=("alice",), **extra
+):
+    record = logging.makeLogRecord(
+        {"levelno": level, "levelname": logging.getLevelName(level), "msg": msg}
+    )
+    record.args = args
+    record.__dict__.update(extra)
+    return record
+
+
+class TestStructuredLogging(unittest.TestCase):
+    def test_json_formatter(self):
+        record = make_record(event="note.read", note_id="n1")
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "User 'alice' read note")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["event"], "note.read")
+        self.assertEqual(entry["note_id"], "n1")
+
+    def test_sampling(self):
+        sampling = SamplingFilter({"note.read": 0.0})
+        self.assertFalse(sampling.filter(make_record(event="note.read")))
+        self.assertTrue(sampling.filter(make_record(event="note.create")))
+        self.assertTrue(sampling.filter(make_record()))
+        # Warnings (security events) are never sampled out
+        self.assertTrue(
+            sampling.filter(make_record(level=logging.WARNING, event="note.read"))
+        )
+
+    def test_parse_sample_rates(self):
+        self.assertEqual(
+            parse_sample_rates(" note.read=0.01, note.list=0.5,"),
+            {"note.read": 0.01, "note.list": 0.5},
+        )
+        self.assertEqual(parse_sample_rates(""), {})
+
+    def test_queue_handler_defers_formatting_and_never_blocks(self):
+        log_queue = queue.Queue(1)
+        handler = AsyncQueueHandler(log_queue)
+        first, second = make_record(), make_record()
+        handler.handle(first)
+        handler.handle(second)
+
+        queued = log_queue.get_nowait()
+        self.assertIs(queued, first)
+        self.assertEqual(queued.args, ("alice",))  # Not merged into msg yet
+        self.assertEqual(handler.dropped, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()